@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+from ratelimit import TokenBucket
+
+# ---------------------
+# LLM を使うメンションの受付制御
+# ---------------------
+# ユーザーごと・ギルドごとのトークンバケットで連打を弾き、通ったものも
+# 同時実行数 max_concurrent までに抑える。空きを待てるのは max_queue 件までで、
+# それを超えたら待たせずに断る（to_thread のスレッドと上流の枠を守るため）。
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason    # "user" / "guild" / "queue"
+
+
+class AdmissionTicket:
+    """
+    admit() が返す受付票。async with の中で acquire() すると実行枠が空くまで待つ。
+    抜けるときに（待ち中でも実行中でも）枠と待ち行列の席を返す。
+    """
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._created_at = time.monotonic()
+        self._waiting = True
+        self._acquired = False
+        controller.waiting += 1
+
+    async def acquire(self):
+        controller = self._controller
+        if controller._semaphore.locked():
+            controller.queued += 1
+        await controller._semaphore.acquire()
+        self._acquired = True
+        self._leave_queue()
+        controller.in_flight += 1
+        controller.started += 1
+        wait = time.monotonic() - self._created_at
+        controller.total_wait += wait
+        controller.max_wait = max(controller.max_wait, wait)
+
+    def _leave_queue(self):
+        if self._waiting:
+            self._waiting = False
+            self._controller.waiting -= 1
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._leave_queue()
+        if self._acquired:
+            self._acquired = False
+            self._controller.in_flight -= 1
+            self._controller._semaphore.release()
+        return False
+
+
+class AdmissionController:
+    def __init__(self, user_rate: float = 3 / 60, user_burst: int = 3,
+                 guild_rate: float = 20 / 60, guild_burst: int = 10,
+                 max_concurrent: int = 4, max_queue: int = 8):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.guild_rate = guild_rate
+        self.guild_burst = guild_burst
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._user_buckets = {}
+        self._guild_buckets = {}
+        self.waiting = 0          # 受付済みで実行枠待ち（または枠を取る前）の件数
+        self.in_flight = 0
+        self.accepted = 0
+        self.started = 0          # 実行枠を取れた件数
+        self.queued = 0           # 枠が埋まっていて実際に待たされた件数
+        self.shed = {"user": 0, "guild": 0, "queue": 0}
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _bucket(self, buckets: dict, key: int, rate: float, burst: int) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= 1024:
+                self._prune(buckets)
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    @staticmethod
+    def _prune(buckets: dict):
+        # 満タンまで戻ったバケットは新品と同じなので捨ててよい
+        for key, bucket in list(buckets.items()):
+            if bucket.delay_for(bucket.capacity) == 0:
+                del buckets[key]
+
+    def admit(self, user_id: int, guild_id: int) -> AdmissionTicket:
+        """通すなら AdmissionTicket を返し、断るなら AdmissionRejected を投げる"""
+        user_bucket = self._bucket(self._user_buckets, user_id, self.user_rate, self.user_burst)
+        guild_bucket = self._bucket(self._guild_buckets, guild_id, self.guild_rate, self.guild_burst)
+        if user_bucket.delay_for() > 0:
+            reason = "user"
+        elif guild_bucket.delay_for() > 0:
+            reason = "guild"
+        elif self.in_flight + self.waiting >= self.max_concurrent + self.max_queue:
+            reason = "queue"
+        else:
+            user_bucket.try_acquire()
+            guild_bucket.try_acquire()
+            self.accepted += 1
+            return AdmissionTicket(self)
+        self.shed[reason] += 1
+        raise AdmissionRejected(reason)
+
+    def stats(self) -> dict:
+        return {
+            "accepted": self.accepted,
+            "queued": self.queued,
+            "shed": dict(self.shed),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "avg_wait": self.total_wait / self.started if self.started else 0.0,
+            "max_wait": self.max_wait,
+        }
@@ -0,0 +1,488 @@
+"""
+オフラインのベンチマーク（Discord にもつながず、API キーも使わない）
+
+    python bench.py                          # 全シナリオ
+    python bench.py --scenario mentions --messages 500 --llm-latency 0.5
+    python bench.py --json result.json       # 変更前後の比較用に結果を保存
+
+main.py を import し、偽の Channel / Message / Client と、待ち時間を指定できる
+Gemini / OpenRouter / SerpAPI のスタブに差し替えてハンドラを直接呼ぶ。
+シナリオごとにハンドラの p50/p95/p99、メッセージ/秒、叩いた REST の回数を出す。
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+# main.py の import 前に、本物のキーや data/ を使わないようにしておく
+# （load_dotenv は既にある環境変数を上書きしない）
+_TMP_DIR = tempfile.mkdtemp(prefix="bench-")
+for _name, _value in {
+    "DISCORD_TOKEN": "bench",
+    "GEMINI_API_KEY": "",
+    "OPENROUTER_API_KEY": "",
+    "SERPAPI_KEY": "",
+    "GUILD_ID": "1",
+    "CHANNEL_ID": "0",
+    "MESSAGE_LOG_PATH": os.path.join(_TMP_DIR, "messages.db"),
+    "EVENT_JOURNAL_DIR": os.path.join(_TMP_DIR, "journals"),
+    "REPLY_CACHE_PATH": "",
+    "SHARED_STORE_PATH": os.path.join(_TMP_DIR, "shared.db"),
+}.items():
+    os.environ[_name] = _value
+
+import discord  # noqa: E402
+
+import main  # noqa: E402
+import ratelimit  # noqa: E402
+
+QUESTIONS = [
+    "AIって何？",
+    "今日の天気は？",
+    "おすすめの本を教えて",
+    "ブラックホールってどうやってできるの？",
+    "ラーメンのおいしい食べ方",
+    "量子コンピュータについて",
+    "Pythonのasyncioとは",
+    "なでこちゃんは誰？",
+]
+CHATTER = ["こんにちは", "それな", "今日なにする？", "w", "眠い・・・", "わかる", "ゲームしよ", "おつかれ"]
+STAGE3_LINES = ["暗号かな", "名前は？", "ヒントちょうだい", "絵がある", "モニターって？", "うーん", "どういう意味", "鍵だ"]
+
+
+# ---------------------
+# 計測
+# ---------------------
+class Recorder:
+    def __init__(self):
+        self.latencies = {}    # 名前 -> [秒]
+        self.rest = Counter()  # REST の種類 -> 回数
+        self.llm = Counter()   # スタブの種類 -> 回数
+
+    def add(self, name: str, seconds: float):
+        self.latencies.setdefault(name, []).append(seconds)
+
+    @staticmethod
+    def percentile(values: list, q: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self) -> dict:
+        return {
+            name: {
+                "n": len(values),
+                "p50": self.percentile(values, 0.50),
+                "p95": self.percentile(values, 0.95),
+                "p99": self.percentile(values, 0.99),
+                "max": max(values),
+            }
+            for name, values in self.latencies.items()
+        }
+
+
+recorder = Recorder()
+
+
+def timed(name: str, func):
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            recorder.add(name, time.perf_counter() - started)
+    return wrapper
+
+
+# ---------------------
+# 偽の Discord
+# ---------------------
+_ids = itertools.count(1)
+
+
+def new_snowflake(when: datetime = None) -> int:
+    return discord.utils.time_snowflake(when or datetime.now(timezone.utc)) + next(_ids)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str, bot: bool = False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+
+class FakeMessage:
+    def __init__(self, channel, author: FakeUser, content: str, mentions: list = (), created_at: datetime = None):
+        self.created_at = created_at or datetime.now(timezone.utc)
+        self.id = new_snowflake(self.created_at)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.mentions = list(mentions)
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.rest("edit")
+        self.content = content
+        return self
+
+    async def delete(self):
+        await self.channel.rest("delete")
+
+
+class FakePartialMessage:
+    def __init__(self, channel, message_id: int):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.rest("edit")
+
+    async def delete(self):
+        await self.channel.rest("delete")
+
+
+class FakeChannel:
+    def __init__(self, client, channel_id: int, guild: FakeGuild, rest_latency: float):
+        self.client = client
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"bench-{channel_id}"
+        self.rest_latency = rest_latency
+        self.sent = []
+
+    async def rest(self, kind: str):
+        recorder.rest[kind] += 1
+        if self.rest_latency:
+            await asyncio.sleep(self.rest_latency)
+
+    async def send(self, content=None, **kwargs):
+        await self.rest("send")
+        message = FakeMessage(self, self.client.user, content)
+        self.sent.append(message)
+        return message
+
+    async def delete_messages(self, messages):
+        await self.rest("bulk_delete")
+
+    def get_partial_message(self, message_id: int):
+        return FakePartialMessage(self, message_id)
+
+    async def history(self, limit=100, after=None, before=None, oldest_first=None):
+        await self.rest("history")
+        return
+        yield
+
+
+class FakeClient:
+    """main.bot の代わり（ハンドラが使う分だけ）"""
+
+    def __init__(self, rest_latency: float):
+        self.user = FakeUser(10 ** 17, "なでこ", bot=True)
+        self.rest_latency = rest_latency
+        self.guild = FakeGuild(1)
+        self.channels = {}
+
+    def channel(self, channel_id: int) -> FakeChannel:
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeChannel(self, channel_id, self.guild, self.rest_latency)
+        return channel
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    def get_partial_messageable(self, channel_id: int, guild_id: int = None):
+        return self.channel(channel_id)
+
+    def get_guild(self, guild_id: int):
+        return self.guild if guild_id == self.guild.id else None
+
+    async def wait_until_ready(self):
+        return
+
+
+# ---------------------
+# スタブ（to_thread から呼ばれるので同期で待つ）
+# ---------------------
+class _Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubGemini:
+    def __init__(self, latency: float, chunks: int = 8):
+        self.latency = latency
+        self.chunks = chunks
+
+    def generate_content(self, contents, stream=False):
+        recorder.llm["gemini"] += 1
+        text = "それはね・・・検索してみたけど、たぶんこういうことだよ・・・。" * 3
+        if not stream:
+            time.sleep(self.latency)
+            return _Chunk(text)
+        return self._stream(text)
+
+    def _stream(self, text: str):
+        step = max(1, len(text) // self.chunks)
+        for i in range(0, len(text), step):
+            time.sleep(self.latency / self.chunks)
+            yield _Chunk(text[i:i + step])
+
+
+class _Namespace:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class StubOpenAI:
+    def __init__(self, latency: float, chunks: int = 8):
+        self.latency = latency
+        self.chunks = chunks
+        self.chat = _Namespace(completions=_Namespace(create=self.create))
+
+    def create(self, model=None, messages=None, stream=False):
+        recorder.llm["openrouter"] += 1
+        text = "うーん・・・わたしはこう思うかな・・・。" * 3
+        if not stream:
+            time.sleep(self.latency)
+            return _Namespace(choices=[_Namespace(message=_Namespace(content=text))])
+        return self._stream(text)
+
+    def _stream(self, text: str):
+        step = max(1, len(text) // self.chunks)
+        for i in range(0, len(text), step):
+            time.sleep(self.latency / self.chunks)
+            yield _Namespace(choices=[_Namespace(delta=_Namespace(content=text[i:i + step]))])
+
+
+class StubSearch:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def search(self, query, hl="ja", gl="jp"):
+        recorder.llm["serpapi"] += 1
+        await asyncio.sleep(self.latency)
+        return f"{query} についての検索結果の抜粋"
+
+    def stats(self) -> dict:
+        return {}
+
+    async def close(self):
+        pass
+
+
+# ---------------------
+# セットアップ
+# ---------------------
+def install(args) -> FakeClient:
+    client = FakeClient(args.rest_latency)
+    main.bot = client
+    main.gemini_provider.set(StubGemini(args.llm_latency))
+    main.openrouter_provider.set(StubOpenAI(args.llm_latency * 1.5))
+    main.search_provider.set(StubSearch(args.search_latency))
+    main.message_log.begin_session()
+    if not args.pacing:
+        # Discord のレートリミットによる待ちを外して、ハンドラ自体の速さを見る
+        ratelimit.buckets.limits.update({route: (1e9, 1e9) for route in ratelimit.ROUTE_LIMITS})
+    # 謎解きのタイマー（7秒後のモニター・最終シーケンスなど）を縮める
+    call_later = main.event_timers.call_later
+
+    def scaled_call_later(delay, callback, *cb_args, **kwargs):
+        return call_later(delay * args.time_scale, callback, *cb_args, **kwargs)
+    main.event_timers.call_later = scaled_call_later
+
+    for name in ("on_message", "start_event", "finalize_and_delete_event", "summarize_logs", "handle_event_message"):
+        setattr(main, name, timed(name, getattr(main, name)))
+    return client
+
+
+async def dispatch(messages, rate: float = 0):
+    """Gateway と同じくイベントごとにタスクを作る。rate > 0 なら1秒あたりその件数で流す"""
+    tasks = []
+    for message in messages:
+        tasks.append(asyncio.create_task(main.on_message(message)))
+        if rate:
+            await asyncio.sleep(1 / rate)
+        else:
+            await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+
+# ---------------------
+# シナリオ
+# ---------------------
+async def scenario_chatter(client: FakeClient, args):
+    """メンション無しの雑談（ログ・直近バッファ・3% の自動会話）"""
+    users = [FakeUser(1000 + i, f"user{i}") for i in range(args.users)]
+    channels = [client.channel(100 + i) for i in range(args.channels)]
+    messages = [
+        FakeMessage(random.choice(channels), random.choice(users), random.choice(CHATTER))
+        for _ in range(args.messages)
+    ]
+    await dispatch(messages, args.rate)
+    return len(messages)
+
+
+async def scenario_mentions(client: FakeClient, args):
+    """LLM に行くメンション質問（受付制御・返信キャッシュ・ストリーミング表示込み）"""
+    users = [FakeUser(2000 + i, f"asker{i}") for i in range(args.users)]
+    channels = [client.channel(200 + i) for i in range(args.channels)]
+    messages = [
+        FakeMessage(
+            random.choice(channels),
+            random.choice(users),
+            f"{client.user.mention} {random.choice(QUESTIONS)}",
+            mentions=[client.user],
+        )
+        for _ in range(args.messages)
+    ]
+    await dispatch(messages, args.rate)
+    return len(messages)
+
+
+async def scenario_puzzle(client: FakeClient, args):
+    """Open Lain から最終解答・削除まで。参加者が並行してメンションを送る"""
+    channel = client.channel(300)
+    users = [FakeUser(3000 + i, f"player{i}") for i in range(args.users)]
+    mention = client.user.mention
+
+    def says(text: str, user: FakeUser = None):
+        return FakeMessage(channel, user or random.choice(users), f"{mention} {text}", mentions=[client.user])
+
+    count = 0
+    await dispatch([FakeMessage(channel, users[0], "Open Lain")])
+    await dispatch([says("いるよ")])
+    await dispatch([says("だれでしょう"), says("なでこ")])
+    count += 4
+    session = main.sessions.for_channel(channel)
+    # 7秒後（を縮めた時間）のモニター表示を待つ
+    while session.stage == 3 and not any("モニター" in (m.content or "") for m in channel.sent):
+        await asyncio.sleep(0.01)
+    flood = [says(random.choice(STAGE3_LINES)) for _ in range(args.messages)]
+    await dispatch(flood, args.rate)
+    count += len(flood)
+    await dispatch([says("observation")])
+    count += 1
+    # 最終シーケンス → 「観測した」書き換え → 削除 まで待つ
+    deadline = time.monotonic() + 120 * max(args.time_scale, 0.01) + 10
+    while "finalize_and_delete_event" not in recorder.latencies and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    return count
+
+
+async def scenario_summary(client: FakeClient, args):
+    """昨日分のログ args.messages 件から「できごとまとめ」を作る"""
+    channel = client.channel(400)
+    users = [FakeUser(4000 + i, f"writer{i}") for i in range(args.users)]
+    jst = timezone(timedelta(hours=9))
+    now = datetime.now(jst)
+    start = datetime(now.year, now.month, now.day, 7, 0, 0, tzinfo=jst) - timedelta(days=1)
+    for i in range(args.messages):
+        created_at = start + timedelta(seconds=i * 86000 / max(1, args.messages))
+        text = f"{random.choice(CHATTER)} {random.choice(QUESTIONS)}"
+        main.message_log._insert(FakeMessage(channel, random.choice(users), text, created_at=created_at))
+    main.message_log.db.commit()
+    await main.summarize_logs(channel)
+    return args.messages
+
+
+SCENARIOS = {
+    "chatter": scenario_chatter,
+    "mentions": scenario_mentions,
+    "puzzle": scenario_puzzle,
+    "summary": scenario_summary,
+}
+
+
+async def run(args) -> dict:
+    client = install(args)
+    results = {}
+    for name in (SCENARIOS if args.scenario == "all" else [args.scenario]):
+        recorder.latencies.clear()
+        recorder.rest.clear()
+        recorder.llm.clear()
+        output = io.StringIO()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+            count = await SCENARIOS[name](client, args)
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            "messages": count,
+            "elapsed": elapsed,
+            "messages_per_second": count / elapsed if elapsed else 0.0,
+            "handlers": recorder.summary(),
+            "rest": dict(recorder.rest),
+            "rest_total": sum(recorder.rest.values()),
+            "upstream": dict(recorder.llm),
+        }
+        report(name, results[name])
+    results["_stats"] = {
+        "admission": main.admission.stats(),
+        "reply_cache": main.reply_cache.stats(),
+        "outbound": main.outbound.stats(),
+        "dispatcher": main.llm_dispatcher.stats(),
+    }
+    return results
+
+
+def report(name: str, result: dict):
+    print(f"[{name}] {result['messages']} msgs in {result['elapsed']:.2f}s ({result['messages_per_second']:.1f} msg/s)")
+    for handler, s in sorted(result["handlers"].items()):
+        print(
+            f"  {handler:<26} n={s['n']:<5} p50={s['p50'] * 1000:8.1f}ms "
+            f"p95={s['p95'] * 1000:8.1f}ms p99={s['p99'] * 1000:8.1f}ms"
+        )
+    rest = " ".join(f"{k}={v}" for k, v in sorted(result["rest"].items()))
+    upstream = " ".join(f"{k}={v}" for k, v in sorted(result["upstream"].items()))
+    print(f"  REST: total={result['rest_total']} {rest}")
+    if upstream:
+        print(f"  upstream: {upstream}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="offline benchmark for the bot handlers")
+    parser.add_argument("--scenario", choices=["all", *SCENARIOS], default="all")
+    parser.add_argument("--messages", type=int, default=300, help="messages per scenario")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=0, help="messages per second (0 = as fast as possible)")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds per stub LLM completion")
+    parser.add_argument("--search-latency", type=float, default=0.1, help="seconds per stub SerpAPI search")
+    parser.add_argument("--rest-latency", type=float, default=0.01, help="seconds per fake REST call")
+    parser.add_argument("--time-scale", type=float, default=0.01, help="multiplier for puzzle timers")
+    parser.add_argument("--pacing", action="store_true", help="keep Discord rate-limit pacing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own log output")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
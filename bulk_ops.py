@@ -0,0 +1,191 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+import discord
+
+import ratelimit
+
+# ---------------------
+# 一括削除（purge）
+# ---------------------
+BULK_DELETE_MAX = 100                          # bulk-delete 1回あたりの上限
+BULK_DELETE_MAX_AGE = 14 * 24 * 3600 - 60      # 14日より古いと bulk-delete 不可（1分の余裕）
+DISCORD_EPOCH_MS = 1420070400000
+MAX_RETRIES = 3
+
+
+def snowflake_timestamp(message_id: int) -> float:
+    """メッセージIDから作成時刻（UNIX秒）を出す。Message オブジェクトが無くても使える"""
+    return ((message_id >> 22) + DISCORD_EPOCH_MS) / 1000
+
+
+@dataclass
+class PurgeResult:
+    deleted: int = 0
+    missing: int = 0          # 既に消えていた（NotFound）
+    failed: int = 0
+    bulk_requests: int = 0
+    single_requests: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+
+    def __str__(self):
+        return (
+            f"deleted={self.deleted} missing={self.missing} failed={self.failed} "
+            f"bulk={self.bulk_requests} single={self.single_requests} retries={self.retries} "
+            f"elapsed={self.elapsed:.2f}s"
+        )
+
+
+async def _with_retry(bucket: ratelimit.TokenBucket, call, result):
+    def count_retry():
+        result.retries += 1
+    return await ratelimit.call_with_retry(bucket, call, MAX_RETRIES, count_retry)
+
+
+async def _delete_single(channel_id, message, result: PurgeResult, buckets: ratelimit.RouteBuckets):
+    bucket = buckets.get("delete_message", channel_id)
+    result.single_requests += 1
+    try:
+        await _with_retry(bucket, message.delete, result)
+        result.deleted += 1
+    except discord.NotFound:
+        result.missing += 1
+    except Exception as e:
+        print(f"[削除エラー] {channel_id}/{message.id}: {e}")
+        result.failed += 1
+
+
+async def _purge_channel(channel, messages: list, result: PurgeResult, buckets: ratelimit.RouteBuckets, now: float):
+    channel_id = channel.id
+    recent = []
+    old = []
+    for m in messages:
+        if now - snowflake_timestamp(m.id) < BULK_DELETE_MAX_AGE:
+            recent.append(m)
+        else:
+            old.append(m)
+
+    # DM などは bulk-delete が無いので全部単発
+    if not hasattr(channel, "delete_messages"):
+        old.extend(recent)
+        recent = []
+
+    bulk_bucket = buckets.get("bulk_delete", channel_id)
+    for i in range(0, len(recent), BULK_DELETE_MAX):
+        batch = recent[i:i + BULK_DELETE_MAX]
+        if len(batch) == 1:
+            # 1件だけなら bulk-delete は使えない
+            old.append(batch[0])
+            continue
+        result.bulk_requests += 1
+        try:
+            await _with_retry(bulk_bucket, lambda: channel.delete_messages(batch), result)
+            result.deleted += len(batch)
+        except Exception as e:
+            # 一部が古い・権限が無い等で失敗したらこのバッチだけ単発に落とす
+            print(f"[一括削除エラー] {channel_id}: {e}")
+            old.extend(batch)
+
+    # 単発削除はバケットがペースを決めるのでまとめて投げる
+    await asyncio.gather(*(_delete_single(channel_id, m, result, buckets) for m in old))
+
+
+async def purge_messages(messages, buckets: ratelimit.RouteBuckets = None) -> PurgeResult:
+    """
+    メッセージ群を削除する。
+    - メッセージIDで重複除去
+    - チャンネルごとに 14日以内のものは 100件ずつ bulk-delete、古いものだけ単発削除
+    - チャンネル間は並行、同じチャンネル内は per-route バケットでペース配分
+    messages は Message / PartialMessage など .id と .channel を持つもの。
+    """
+    buckets = buckets or ratelimit.buckets
+    result = PurgeResult()
+    started = time.monotonic()
+
+    seen = set()
+    by_channel = {}
+    for m in messages:
+        if m is None or m.id in seen:
+            continue
+        seen.add(m.id)
+        channel = m.channel
+        entry = by_channel.get(channel.id)
+        if entry is None:
+            entry = by_channel[channel.id] = (channel, [])
+        entry[1].append(m)
+
+    now = time.time()
+    await asyncio.gather(*(
+        _purge_channel(channel, msgs, result, buckets, now)
+        for channel, msgs in by_channel.values()
+    ))
+    result.elapsed = time.monotonic() - started
+    return result
+
+
+# ---------------------
+# 一括編集
+# ---------------------
+@dataclass
+class BulkEditResult:
+    edited: int = 0
+    missing: int = 0
+    failed: int = 0
+    timed_out: int = 0        # 期限までに終わらず諦めた
+    retries: int = 0
+    elapsed: float = 0.0
+
+    def __str__(self):
+        return (
+            f"edited={self.edited} missing={self.missing} failed={self.failed} "
+            f"timed_out={self.timed_out} retries={self.retries} elapsed={self.elapsed:.2f}s"
+        )
+
+
+async def bulk_edit(messages, content: str, concurrency: int = 5, deadline: float = 30.0,
+                    buckets: ratelimit.RouteBuckets = None) -> BulkEditResult:
+    """
+    メッセージ群を同じ内容に書き換える。
+    - 同時実行数は concurrency まで、チャンネルごとの edit バケットでペース配分
+    - 429 はサーバー指定の秒数だけ待って再試行
+    - deadline 秒で終わらなかった分は諦めて返す（後続の削除を遅らせない）
+    - 新しいメッセージから順に書き換える（edit はチャンネルあたり約1件/秒なので、
+      期限で打ち切られるのは画面から遠い古いものになるように）
+    """
+    buckets = buckets or ratelimit.buckets
+    result = BulkEditResult()
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def edit_one(m):
+        async with semaphore:
+            bucket = buckets.get("edit_message", m.channel.id)
+            try:
+                await _with_retry(bucket, lambda: m.edit(content=content), result)
+                result.edited += 1
+            except discord.NotFound:
+                result.missing += 1
+            except Exception as e:
+                print(f"[編集エラー] {m.channel.id}/{m.id}: {e}")
+                result.failed += 1
+
+    seen = set()
+    unique = []
+    for m in messages:
+        if m is None or m.id in seen:
+            continue
+        seen.add(m.id)
+        unique.append(m)
+    # ID はスノーフレークなので大きいほど新しい
+    unique.sort(key=lambda m: m.id, reverse=True)
+    tasks = [asyncio.ensure_future(edit_one(m)) for m in unique]
+
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+        result.timed_out = len(pending)
+    result.elapsed = time.monotonic() - started
+    return result
@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+
+# ---------------------
+# LRU + TTL のインメモリキャッシュ
+# ---------------------
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    maxsize 件を超えたら最も使われていないものから捨て、
+    ttl 秒を過ぎたものは読み出し時に捨てる。
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        item = self._data.get(key, _MISSING)
+        return item is not _MISSING and item[0] >= time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def items(self):
+        """期限内の (key, value, 残り秒数) を古い順に。永続化用"""
+        now = time.monotonic()
+        for key, (expires_at, value) in list(self._data.items()):
+            if expires_at >= now:
+                yield key, value, expires_at - now
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,118 @@
+import time
+from collections import OrderedDict, deque
+
+from textutil import estimate_tokens
+
+# ---------------------
+# チャンネル（必要ならユーザー）ごとの会話履歴
+# ---------------------
+# トークン予算を超えた古いターンは短い要約に畳み込むので、
+# 1リクエストあたりのプロンプトの大きさは稼働時間に関係なく一定に収まる。
+
+ROLE_LABELS = {"user": "ユーザー", "model": "なでこ"}
+
+
+def default_compactor(summary: str, turns: list, limit: int) -> str:
+    """
+    LLM を使わない要約：古いターンを1行ずつ短く切って要約の後ろにつなぎ、
+    limit 文字を超えたら古い側から捨てる。
+    """
+    lines = [summary] if summary else []
+    for role, text in turns:
+        line = " ".join(text.split())
+        if len(line) > 60:
+            line = line[:60] + "…"
+        lines.append(f"{ROLE_LABELS.get(role, role)}: {line}")
+    merged = "\n".join(lines)
+    if len(merged) > limit:
+        merged = "…" + merged[-limit:]
+    return merged
+
+
+class Conversation:
+    def __init__(self):
+        self.summary = ""
+        self.turns = deque()   # (role, text, tokens)
+        self.tokens = 0
+        self.last_used = time.monotonic()
+
+    def history(self) -> list:
+        return [(role, text) for role, text, _ in self.turns]
+
+
+class ConversationStore:
+    """
+    key -> Conversation の LRU。
+    - max_contexts を超えたら一番使われていない会話から捨てる
+    - idle_ttl 秒使われていない会話も捨てる
+    - 1会話のターン合計が token_budget を超えたら古いターンを要約に畳み込む
+    """
+
+    def __init__(self, token_budget: int = 1500, max_contexts: int = 200,
+                 idle_ttl: float = 6 * 3600, summary_chars: int = 400,
+                 per_user: bool = False, compactor=default_compactor):
+        self.token_budget = token_budget
+        self.max_contexts = max_contexts
+        self.idle_ttl = idle_ttl
+        self.summary_chars = summary_chars
+        self.per_user = per_user
+        self.compactor = compactor
+        self._contexts = OrderedDict()
+        self.evictions = 0
+        self.compactions = 0
+
+    def key(self, channel_id: int, user_id: int = None):
+        return (channel_id, user_id if self.per_user else None)
+
+    def _evict_idle(self, now: float):
+        while self._contexts:
+            oldest_key, oldest = next(iter(self._contexts.items()))
+            if now - oldest.last_used < self.idle_ttl and len(self._contexts) <= self.max_contexts:
+                break
+            del self._contexts[oldest_key]
+            self.evictions += 1
+
+    def get(self, key) -> Conversation:
+        now = time.monotonic()
+        conv = self._contexts.get(key)
+        if conv is None:
+            conv = self._contexts[key] = Conversation()
+        self._contexts.move_to_end(key)
+        conv.last_used = now
+        self._evict_idle(now)
+        return conv
+
+    def append(self, key, role: str, text: str):
+        conv = self.get(key)
+        tokens = estimate_tokens(text)
+        conv.turns.append((role, text, tokens))
+        conv.tokens += tokens
+        if conv.tokens > self.token_budget:
+            self._compact(conv)
+
+    def _compact(self, conv: Conversation):
+        # 予算の半分まで古いターンを畳む（毎回要約し直さないように余裕を持たせる）
+        folded = []
+        while conv.turns and conv.tokens > self.token_budget // 2:
+            role, text, tokens = conv.turns.popleft()
+            conv.tokens -= tokens
+            folded.append((role, text))
+        # Gemini は履歴が user から始まる必要があるので、返答だけが残らないようにする
+        while conv.turns and conv.turns[0][0] != "user":
+            role, text, tokens = conv.turns.popleft()
+            conv.tokens -= tokens
+            folded.append((role, text))
+        if folded:
+            conv.summary = self.compactor(conv.summary, folded, self.summary_chars)
+            self.compactions += 1
+
+    def clear(self, key):
+        self._contexts.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "contexts": len(self._contexts),
+            "tokens": sum(c.tokens for c in self._contexts.values()),
+            "evictions": self.evictions,
+            "compactions": self.compactions,
+        }
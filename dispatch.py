@@ -0,0 +1,280 @@
+import asyncio
+import time
+from collections import deque
+
+import metrics
+
+# ---------------------
+# LLM バックエンドのヘッジ付きディスパッチ + サーキットブレーカー
+# ---------------------
+
+LLM_SECONDS = metrics.histogram("llm_request_seconds", "LLM backend call latency by backend and outcome")
+LLM_FIRST_CHUNK_SECONDS = metrics.histogram("llm_first_chunk_seconds", "Time until a streaming backend sent its first text")
+
+
+class BackendUnavailable(Exception):
+    """APIキー未設定などで、そもそも呼べないバックエンド"""
+
+
+class AllBackendsFailed(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    failure_threshold 回連続で失敗したら open にして reset_timeout 秒スキップ。
+    時間が経ったら half-open で1回だけ試し、成功すれば closed に戻す。
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """結果を待たずにキャンセルされたとき、half-open の試行枠だけ返す"""
+        self._trial_running = False
+
+
+class BackendStats:
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.successes = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.skipped = 0
+
+    def percentile(self, q: float):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "successes": self.successes,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "skipped": self.skipped,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+        }
+
+
+class Backend:
+    def __init__(self, name: str, call, timeout: float = 30.0, breaker: CircuitBreaker = None, stream=None):
+        self.name = name
+        self.call = call            # async def call(query, **kwargs) -> str
+        self.stream = stream        # async def stream(query, **kwargs) -> 文字列の断片を yield（任意）
+        self.timeout = timeout      # ストリーミング時は断片と断片の間の最大待ち時間
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = BackendStats()
+
+    async def invoke(self, query: str, **kwargs) -> str:
+        return await self._observe(asyncio.wait_for(self.call(query, **kwargs), timeout=self.timeout))
+
+    async def invoke_stream(self, query: str, on_text, **kwargs) -> str:
+        """断片が届くたびに on_text(ここまでの全文) を呼び、最後に全文を返す"""
+        return await self._observe(self._consume_stream(query, on_text, **kwargs))
+
+    async def _consume_stream(self, query: str, on_text, **kwargs) -> str:
+        parts = []
+        started = time.monotonic()
+        chunks = self.stream(query, **kwargs)
+        try:
+            while True:
+                try:
+                    delta = await asyncio.wait_for(chunks.__anext__(), timeout=self.timeout)
+                except StopAsyncIteration:
+                    break
+                if delta:
+                    if not parts:
+                        LLM_FIRST_CHUNK_SECONDS.observe(time.monotonic() - started, backend=self.name)
+                    parts.append(delta)
+                    on_text("".join(parts))
+        finally:
+            await chunks.aclose()
+        return "".join(parts).strip()
+
+    async def _observe(self, awaitable) -> str:
+        self.stats.calls += 1
+        started = time.monotonic()
+        outcome = "ok"
+        try:
+            result = await awaitable
+            if not result:
+                raise ValueError("empty response")
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            self.stats.timeouts += 1
+            self.breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            self.stats.cancelled += 1
+            self.breaker.release()
+            raise
+        except BackendUnavailable:
+            outcome = "skipped"
+            self.stats.skipped += 1
+            self.breaker.release()
+            raise
+        except Exception:
+            outcome = "error"
+            self.stats.errors += 1
+            self.breaker.record_failure()
+            raise
+        finally:
+            LLM_SECONDS.observe(time.monotonic() - started, backend=self.name, outcome=outcome)
+        self.stats.latencies.append(time.monotonic() - started)
+        self.stats.successes += 1
+        self.breaker.record_success()
+        return result
+
+
+class HedgedDispatcher:
+    """
+    先頭のバックエンドから順に投げ、hedge_delay 秒（十分なサンプルがあれば
+    そのバックエンドの p95）経っても返ってこなければ次のバックエンドも並行で走らせる。
+    最初に返ってきた正常な回答を採用し、残りはキャンセルする。
+    失敗したら待たずに次へ回す。ブレーカーが open のバックエンドは飛ばす。
+    """
+
+    def __init__(self, backends: list, hedge_delay: float = 3.0,
+                 min_hedge_delay: float = 0.5, p95_min_samples: int = 20):
+        self.backends = backends
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.p95_min_samples = p95_min_samples
+
+    def _delay_for(self, backend: Backend) -> float:
+        if len(backend.stats.latencies) >= self.p95_min_samples:
+            p95 = backend.stats.percentile(0.95)
+            return max(self.min_hedge_delay, min(self.hedge_delay, p95))
+        return self.hedge_delay
+
+    async def run(self, query: str, **kwargs) -> str:
+        return await self._hedge(self.backends, query, kwargs)
+
+    async def stream(self, query: str, on_text, **kwargs) -> str:
+        """
+        run() と同じヘッジで投げ、ストリーミング対応のバックエンドは断片が届くたびに
+        on_text(ここまでの全文) を呼ぶ。hedge_delay は「最初の断片」の締め切りとして扱い、
+        最初に断片を送ってきたバックエンドに決めて残りはキャンセルする。
+        決めたバックエンドが途中で失敗したら、残りでヘッジをやり直す
+        （それまでに on_text に渡した途中経過は、後の on_text と返り値で上書きされる前提）。
+        """
+        return await self._hedge(self.backends, query, kwargs, on_text)
+
+    async def _hedge(self, backends: list, query: str, kwargs: dict, on_text=None) -> str:
+        queue = []
+        for b in backends:
+            if b.breaker.allow():
+                queue.append(b)
+            else:
+                b.stats.skipped += 1
+        if not queue:
+            raise AllBackendsFailed("all circuit breakers are open")
+
+        pending = {}
+        errors = []
+        owner = None                        # ストリーミング時、最初に断片を送ってきたバックエンド
+        first_chunk = asyncio.Event()
+        waiter = None
+
+        def start(backend: Backend):
+            if on_text is None or backend.stream is None:
+                return asyncio.ensure_future(backend.invoke(query, **kwargs))
+
+            def forward(text: str):
+                nonlocal owner
+                if owner is None:
+                    owner = backend
+                    first_chunk.set()
+                if owner is backend:
+                    on_text(text)
+            return asyncio.ensure_future(backend.invoke_stream(query, forward, **kwargs))
+
+        try:
+            while queue or pending:
+                delay = None
+                if queue and owner is None:
+                    backend = queue.pop(0)
+                    pending[start(backend)] = backend
+                    delay = self._delay_for(backend) if queue else None
+                wait_for = set(pending)
+                if on_text is not None and owner is None:
+                    if waiter is None:
+                        waiter = asyncio.ensure_future(first_chunk.wait())
+                    wait_for.add(waiter)
+                done, _ = await asyncio.wait(wait_for, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is waiter:
+                        continue
+                    backend = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(f"{backend.name}: {task.exception()!r}")
+                    if backend is owner:
+                        # 書き始めたものが途中で失敗したら、もう一度「最初の断片」を待つところから
+                        owner = None
+                        first_chunk.clear()
+                        waiter = None
+                if owner is not None:
+                    # 書き始めたものに決め、他はキャンセル（決めたものが失敗したときのために列に戻す）
+                    cancelled = []
+                    for task, backend in list(pending.items()):
+                        if backend is not owner:
+                            task.cancel()
+                            del pending[task]
+                            cancelled.append(backend)
+                    queue[:0] = cancelled
+            raise AllBackendsFailed("; ".join(errors))
+        finally:
+            for task in pending:
+                task.cancel()
+            if waiter is not None:
+                waiter.cancel()
+            # 投げずに終わったバックエンドの half-open 試行枠を返す
+            for b in queue:
+                b.breaker.release()
+
+    def stats(self) -> dict:
+        return {
+            b.name: {**b.stats.as_dict(), "breaker": b.breaker.state}
+            for b in self.backends
+        }
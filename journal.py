@@ -0,0 +1,102 @@
+import os
+import struct
+from array import array
+
+# ---------------------
+# イベント中のメッセージIDジャーナル
+# ---------------------
+# Message オブジェクトを丸ごと抱える代わりに (channel_id, message_id, kind) だけを
+# 配列で持ち、同じ内容を固定長レコードでファイルに追記しておく。
+# 落ちて再起動しても、ファイルを読み直せば消すべきメッセージがそのまま分かる。
+
+KIND_BOT = 0            # Bot の投稿（「観測した」への書き換え対象）
+KIND_PARTICIPANT = 1    # 参加者が Bot にメンションした投稿
+
+_RECORD = struct.Struct("<QQB")
+
+
+class MessageJournal:
+    def __init__(self, path: str):
+        self.path = path
+        self.channel_ids = array("Q")
+        self.message_ids = array("Q")
+        self.kinds = array("B")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._load()
+        self._file = open(path, "ab")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        # 書きかけで落ちた末尾の半端なレコードは捨てる
+        usable = len(data) - len(data) % _RECORD.size
+        if usable != len(data):
+            with open(self.path, "r+b") as f:
+                f.truncate(usable)
+        for channel_id, message_id, kind in _RECORD.iter_unpack(data[:usable]):
+            self.channel_ids.append(channel_id)
+            self.message_ids.append(message_id)
+            self.kinds.append(kind)
+
+    def add(self, channel_id: int, message_id: int, kind: int):
+        self.channel_ids.append(channel_id)
+        self.message_ids.append(message_id)
+        self.kinds.append(kind)
+        self._file.write(_RECORD.pack(channel_id, message_id, kind))
+        self._file.flush()
+
+    def record(self, message, kind: int = KIND_BOT):
+        if message is not None:
+            self.add(message.channel.id, message.id, kind)
+
+    def entries(self, kind: int = None):
+        for channel_id, message_id, k in zip(self.channel_ids, self.message_ids, self.kinds):
+            if kind is None or k == kind:
+                yield channel_id, message_id, k
+
+    def partial_messages(self, client, kind: int = None) -> list:
+        """
+        編集・削除用の PartialMessage を作る（API は叩かない）。
+        キャッシュにチャンネルがあればそれを、無ければ PartialMessageable を使う。
+        """
+        channels = {}
+        result = []
+        for channel_id, message_id, _ in self.entries(kind):
+            channel = channels.get(channel_id)
+            if channel is None:
+                channel = client.get_channel(channel_id)
+                if channel is None or not hasattr(channel, "get_partial_message"):
+                    channel = client.get_partial_messageable(channel_id)
+                channels[channel_id] = channel
+            result.append(channel.get_partial_message(message_id))
+        return result
+
+    def discard_first(self, count: int):
+        """先頭から count 件だけ消す（削除を始めた時点までの分。削除中に増えた分は残す）"""
+        if count >= len(self):
+            self.clear()
+            return
+        self.channel_ids = self.channel_ids[count:]
+        self.message_ids = self.message_ids[count:]
+        self.kinds = self.kinds[count:]
+        self._file.truncate(0)
+        self._file.write(b"".join(
+            _RECORD.pack(c, m, k) for c, m, k in zip(self.channel_ids, self.message_ids, self.kinds)
+        ))
+        self._file.flush()
+
+    def clear(self):
+        self.channel_ids = array("Q")
+        self.message_ids = array("Q")
+        self.kinds = array("B")
+        self._file.truncate(0)
+        self._file.flush()
+
+    def __len__(self):
+        return len(self.message_ids)
+
+    def close(self):
+        self._file.close()
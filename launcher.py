@@ -0,0 +1,169 @@
+import argparse
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from dotenv import load_dotenv
+
+# ---------------------
+# シャードを複数のワーカープロセスに分けて起動する
+# ---------------------
+# 1プロセスだと Gateway の受信もプロンプト作りも要約も1つのイベントループに乗るので、
+# シャードを --workers 個のプロセスに分けて main.py をそれぞれ起動する。
+# 各ワーカーは SHARD_COUNT / SHARD_IDS で自分のシャードだけに繋ぎ、
+# イベントの占有・クールダウン・返信キャッシュは共有ストア（SQLite・WAL）で揃える。
+# 落ちたワーカーは間隔を空けて起動し直す。
+#
+#   python launcher.py --workers 4            # シャード数は Discord の推奨値
+#   python launcher.py --workers 2 --shards 4
+
+IDENTIFY_INTERVAL = 5.0     # 同じ枠での IDENTIFY の間隔（Discord の制限）
+RESTART_BACKOFF_MAX = 60.0  # 落ちたワーカーを起動し直すまでの最大待ち秒数
+STABLE_SECONDS = 300.0      # これ以上動いていたら、次に落ちたときの待ちを最初から数え直す
+
+
+def fetch_gateway_info(token: str) -> dict:
+    """GET /gateway/bot（推奨シャード数と IDENTIFY の同時実行数）"""
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot (launcher, 1.0)"},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)
+
+
+def split_shards(shard_count: int, workers: int) -> list:
+    """0..shard_count-1 を連続したかたまりで workers 個に分ける（空のワーカーは作らない）"""
+    workers = max(1, min(workers, shard_count))
+    per_worker, extra = divmod(shard_count, workers)
+    blocks = []
+    start = 0
+    for i in range(workers):
+        size = per_worker + (1 if i < extra else 0)
+        blocks.append(list(range(start, start + size)))
+        start += size
+    return blocks
+
+
+def _per_worker_path(path: str, worker_id: str) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.{worker_id}{ext}"
+
+
+def worker_env(index: int, shard_ids: list, shard_count: int) -> dict:
+    worker_id = f"worker-{index}"
+    env = dict(os.environ)
+    env["SHARD_COUNT"] = str(shard_count)
+    env["SHARD_IDS"] = ",".join(str(i) for i in shard_ids)
+    env["WORKER_ID"] = worker_id
+    # /metrics はワーカーごとにポートをずらす（0 なら全員出さない）
+    metrics_port = int(os.getenv("METRICS_PORT", "9108"))
+    env["METRICS_PORT"] = str(metrics_port + index if metrics_port else 0)
+    # メッセージログの「繋がっていた区間」はプロセスのシャードにしか当てはまらないので、ワーカーごとに分ける
+    env["MESSAGE_LOG_PATH"] = _per_worker_path(os.getenv("MESSAGE_LOG_PATH", os.path.join("data", "messages.db")), worker_id)
+    return env
+
+
+class Worker:
+    def __init__(self, index: int, shard_ids: list, shard_count: int, start_at: float):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.start_at = start_at    # この時刻（time.monotonic()）以降に起動する
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")],
+            env=worker_env(self.index, self.shard_ids, self.shard_count),
+        )
+        self.started_at = time.monotonic()
+        print(f"[ワーカー起動] worker-{self.index} pid={self.process.pid} shards={self.shard_ids}")
+
+    def check(self, now: float):
+        """起動時刻になっていれば起動し、落ちていれば間隔を空けて起動し直す"""
+        if self.process is None:
+            if now >= self.start_at:
+                self.start()
+            return
+        code = self.process.poll()
+        if code is None:
+            return
+        if now - self.started_at >= STABLE_SECONDS:
+            self.restarts = 0
+        delay = min(RESTART_BACKOFF_MAX, IDENTIFY_INTERVAL * 2 ** self.restarts)
+        self.restarts += 1
+        print(f"[ワーカー終了] worker-{self.index} code={code}; {delay:.0f}秒後に起動し直す")
+        self.process = None
+        self.start_at = now + delay
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(self, timeout: float):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="run the bot as several sharded worker processes")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "2")))
+    parser.add_argument("--shards", type=int, default=int(os.getenv("SHARD_COUNT", "0")),
+                        help="total shard count (0 = ask Discord for the recommended count)")
+    args = parser.parse_args()
+
+    max_concurrency = 1
+    shard_count = args.shards
+    if not shard_count:
+        info = fetch_gateway_info(os.getenv("DISCORD_TOKEN"))
+        shard_count = info["shards"]
+        max_concurrency = info.get("session_start_limit", {}).get("max_concurrency", 1)
+    blocks = split_shards(shard_count, args.workers)
+    print(f"[ランチャー] shards={shard_count} workers={len(blocks)} max_concurrency={max_concurrency}")
+
+    # 各ワーカーは自分のシャードを順に IDENTIFY するので、前のワーカーが終わる頃に次を起動する
+    now = time.monotonic()
+    workers = []
+    identified = 0
+    for index, shard_ids in enumerate(blocks):
+        start_at = now + math.ceil(identified / max_concurrency) * IDENTIFY_INTERVAL
+        workers.append(Worker(index, shard_ids, shard_count, start_at))
+        identified += len(shard_ids)
+
+    stopping = False
+
+    def handle_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    while not stopping:
+        now = time.monotonic()
+        for worker in workers:
+            worker.check(now)
+        time.sleep(1.0)
+
+    print("[ランチャー] 停止します")
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.wait(timeout=15)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,37 @@
+from providers import LazyProvider, StartupTimer
 import os
+import sys
+import json
 import discord
 import asyncio
 import random
-import requests
-import google.generativeai as genai
 from dotenv import load_dotenv
-from openai import OpenAI
 from datetime import datetime, timedelta, time, timezone
 from discord.ext import tasks
+from bulk_ops import bulk_edit, purge_messages
+from search import SearchClient
+from dispatch import LLM_SECONDS, Backend, BackendUnavailable, HedgedDispatcher
+from conversation import ConversationStore
+from message_log import MessageLog
+from summarizer import MapReduceSummarizer
+from presence import LeanPresenceClient, LeanShardedPresenceClient, OnlineCounter, RawPresenceCounter, ThresholdTrigger
+from scheduler import TimerScheduler
+from journal import KIND_BOT, KIND_PARTICIPANT
+from session import EventSession, SessionRegistry
+from shared_store import SharedStore
+from scenario import SCENARIO_PATH, ScenarioStore
+from outbound import PRIORITY_FILLER, PRIORITY_REPLY, PRIORITY_SCRIPT, OutboundScheduler
+from streaming import ProgressiveEditor, iterate_in_thread
+from recent import RecentMessages
+from admission import AdmissionController, AdmissionRejected
+from reply_cache import REPLY_CACHE_PATH, ReplyCache, context_fingerprint, prompt_version
+import metrics
+from metrics import LoopLagMonitor
+
+# 起動時間の計測（python main.py --startup-timing で ready までの内訳を出して終了）
+startup = StartupTimer()
+startup.mark("imports")
+STARTUP_TIMING = "--startup-timing" in sys.argv or os.getenv("STARTUP_TIMING", "0") == "1"
 
 load_dotenv()
 
@@ -17,29 +41,87 @@ SERPAPI_KEY = os.getenv("SERPAPI_KEY")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 GUILD_ID = int(os.getenv("GUILD_ID", "0"))
 CHANNEL_ID = int(os.getenv("CHANNEL_ID", "0"))
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "3.0"))      # この秒数で2つ目のバックエンドも投げる
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "10.0"))
+OPENROUTER_TIMEOUT = float(os.getenv("OPENROUTER_TIMEOUT", "60.0"))
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "1500"))
+CONVERSATION_PER_USER = os.getenv("CONVERSATION_PER_USER", "0") == "1"
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "3000"))  # 1チャンクあたりのトークン上限
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "3"))              # チャンク要約の同時実行数
+ONLINE_CHECK_MINUTES = float(os.getenv("ONLINE_CHECK_MINUTES", "6"))       # オンライン人数チェックの間隔
+MESSAGE_LOG_RETENTION_DAYS = float(os.getenv("MESSAGE_LOG_RETENTION_DAYS", "2"))  # まとめ用ログを残す日数（まとめは最大で約2日前から読む）
+MESSAGE_LOG_FLUSH_SECONDS = float(os.getenv("MESSAGE_LOG_FLUSH_SECONDS", "5"))  # メッセージログをまとめて書き出す間隔
+ONLINE_RECONCILE_MINUTES = float(os.getenv("ONLINE_RECONCILE_MINUTES", "60"))  # 全件スキャンで数え直す間隔
+ONLINE_PUSH_TRIGGER = os.getenv("ONLINE_PUSH_TRIGGER", "0") == "1"         # 閾値を超えた瞬間に開始する
+ONLINE_HYSTERESIS = int(os.getenv("ONLINE_HYSTERESIS", "2"))              # 再発火には 閾値-この値 まで下がる必要あり
+# 「観測した」書き換えの打ち切り秒数。edit はチャンネルあたり約1件/秒なので、書き換わるのは新しい方から
+# およそこの秒数分の件数まで（それより古い Bot の投稿は書き換えずに、直後の削除でまとめて消える）
+FINAL_EDIT_DEADLINE = float(os.getenv("FINAL_EDIT_DEADLINE", "10"))
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"                      # メンション返信を生成しながら少しずつ表示する
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))     # 途中経過の edit の最短間隔（秒）
+LLM_USER_PER_MINUTE = float(os.getenv("LLM_USER_PER_MINUTE", "3"))         # 1ユーザーあたりのメンション質問数/分
+LLM_GUILD_PER_MINUTE = float(os.getenv("LLM_GUILD_PER_MINUTE", "20"))      # 1ギルドあたりのメンション質問数/分
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "4"))             # 同時に走らせる LLM 呼び出し数
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "8"))                       # 空き待ちできる件数（超えたら断る）
+REPLY_CACHE = os.getenv("REPLY_CACHE", "1") == "1"                          # 同じ質問への返信を使い回す
+REPLY_CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", "1800"))               # 使い回す期間（秒）
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", "500"))
+REPLY_CACHE_BYPASS_PREFIX = "!fresh"                                        # 質問の先頭に付けるとキャッシュを使わない
+METRICS_DIGEST_MINUTES = float(os.getenv("METRICS_DIGEST_MINUTES", "10"))   # メトリクスのダイジェストをログに出す間隔
+PREWARM_PROVIDERS = os.getenv("PREWARM_PROVIDERS", "0") == "1"               # ready 後に裏で LLM クライアントを作っておく
+MEMBER_CACHE = os.getenv("MEMBER_CACHE", "full")                            # "lean" ならメンバーをキャッシュせず ID と presence だけ持つ
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))                           # 0 なら分割しない。launcher.py がワーカーごとに設定する
+SHARD_IDS = [int(x) for x in os.getenv("SHARD_IDS", "").split(",") if x.strip()] or None  # このプロセスが受け持つシャード（空なら全部）
+WORKER_ID = os.getenv("WORKER_ID", "main")                                 # 共有ストアでのこのプロセスの名前（再起動しても同じにする）
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 intents.presences = True
-bot = discord.Client(intents=intents)
+client_options = {"intents": intents}
+if SHARD_COUNT:
+    # 複数プロセスに分けるときは、各プロセスが SHARD_IDS のシャードだけ Gateway に繋ぐ
+    client_options.update(shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+if MEMBER_CACHE == "lean":
+    # 起動時のチャンクをやめ、オンライン人数に要る ID・Bot かどうか・オンラインかどうかだけを持つ
+    # （Bot かどうか分からない ID は必要になったときに query_members でまとめて問い合わせる）
+    online_counter = RawPresenceCounter()
+    bot = (LeanShardedPresenceClient if SHARD_COUNT else LeanPresenceClient)(online_counter, **client_options)
+else:
+    online_counter = OnlineCounter()  # Bot以外のオンライン人数（イベントで差分更新）
+    bot = (discord.AutoShardedClient if SHARD_COUNT else discord.Client)(**client_options)
+
+# ワーカー間で共有する状態（イベントの占有・クールダウン・返信キャッシュ）
+shared_store = SharedStore(owner=WORKER_ID)
 
-# Gemini 設定
-if GEMINI_API_KEY:
+# Gemini / OpenRouter / SerpAPI のクライアントは初めて使うときに作る
+# （キーが無ければ import もしない。起動を軽くし、使わない機能のメモリを持たない）
+def create_gemini_model():
+    import google.generativeai as genai
     genai.configure(api_key=GEMINI_API_KEY)
-    gemini_model = genai.GenerativeModel("gemini-pro")
-    chat = gemini_model.start_chat(history=[])
-else:
-    chat = None
+    return genai.GenerativeModel("gemini-pro")
 
-# OpenRouter 設定
-if OPENROUTER_API_KEY:
-    openrouter_client = OpenAI(
+OPENROUTER_MODEL = "tngtech/deepseek-r1t2-chimera:free"
+
+def create_openrouter_client():
+    from openai import OpenAI
+    return OpenAI(
         base_url="https://openrouter.ai/api/v1",
         api_key=OPENROUTER_API_KEY
     )
-else:
-    openrouter_client = None
+
+gemini_provider = LazyProvider("gemini", create_gemini_model, enabled=bool(GEMINI_API_KEY))
+openrouter_provider = LazyProvider("openrouter", create_openrouter_client, enabled=bool(OPENROUTER_API_KEY))
+# SerpAPI はイベントループを塞がないよう非同期クライアントで検索
+search_provider = LazyProvider("serpapi", lambda: SearchClient(SERPAPI_KEY), enabled=bool(SERPAPI_KEY))
+providers = [gemini_provider, openrouter_provider, search_provider]
+
+# 会話履歴（チャンネルごと、CONVERSATION_PER_USER=1 ならユーザーごと）
+# 全体で1つの chat を使い回すと履歴が無限に伸びるので、予算を超えた分は要約に畳む
+conversations = ConversationStore(
+    token_budget=CONVERSATION_TOKEN_BUDGET,
+    per_user=CONVERSATION_PER_USER,
+)
 
 # system_instruction の定義
 system_instruction = (
@@ -53,279 +135,458 @@ system_instruction = (
     "できるだけ2〜6行の短い文で答えてください。"
 )
 
+# まとめ用のローカルメッセージログ（on_message から追記）
+message_log = MessageLog()
+
+# メンション質問の返信キャッシュ（キャッシュに入れるのは各バックエンドのラッパー、引くのは on_message）
+# REPLY_CACHE_PATH を空にすればディスクには書かない
+reply_cache = ReplyCache(
+    prompt_version(system_instruction),
+    maxsize=REPLY_CACHE_SIZE,
+    ttl=REPLY_CACHE_TTL,
+    # シャード分割時は JSON ではなく共有ストアに置き、ほかのワーカーとも使い回す
+    path=None if SHARD_COUNT else REPLY_CACHE_PATH or None,
+    shared=shared_store if SHARD_COUNT else None,
+    # 返信は会話履歴にも左右されるので、要約と履歴のハッシュもキーに入れる
+    context=lambda context_key: context_fingerprint(*conversation_context(context_key)),
+)
+
+# メンション質問の受付制御（連打するユーザー・ギルドを弾き、同時実行数と待ち行列を絞る）
+admission = AdmissionController(
+    user_rate=LLM_USER_PER_MINUTE / 60,
+    user_burst=max(1, int(LLM_USER_PER_MINUTE)),
+    guild_rate=LLM_GUILD_PER_MINUTE / 60,
+    guild_burst=max(1, int(LLM_GUILD_PER_MINUTE) // 2),
+    max_concurrent=LLM_MAX_CONCURRENT,
+    max_queue=LLM_MAX_QUEUE,
+)
+SHED_REPLIES = {
+    "user": "ちょっと話しかけすぎかも…少し時間をおいてからまた聞いてね・・・",
+    "guild": "いまは混み合ってるみたい…少し待ってからもう一度話しかけてね・・・",
+    "queue": "いまは混み合ってるみたい…少し待ってからもう一度話しかけてね・・・",
+}
+
+# 自動会話用の直近の発言（チャンネルごとに10件、API を叩かずにプロンプトを作る）
+recent_messages = RecentMessages(per_channel=10)
+
+# 送信はすべてチャンネルごとの優先度つきキュー経由（台詞 > 直接の返信 > 「・・・。」等）
+outbound = OutboundScheduler()
+
+# ホットパスの計測（127.0.0.1:METRICS_PORT/metrics に Prometheus 形式、METRICS_DIGEST_MINUTES ごとにログへ）
+ON_MESSAGE_SECONDS = metrics.histogram("on_message_seconds", "on_message handling time by branch")
+metrics.gauge("outbound_queue_depth", "Messages waiting in the outbound queues", fn=outbound.depth)
+metrics.gauge("llm_admission_in_flight", "Mention questions currently calling an LLM", fn=lambda: admission.in_flight)
+metrics.gauge("llm_admission_waiting", "Mention questions waiting for an LLM slot", fn=lambda: admission.waiting)
+metrics.gauge("reply_cache_hit_rate", "Reply cache hit rate since start", fn=lambda: reply_cache.stats()["hit_rate"])
+metrics.gauge("member_cache_size", "Members held in the discord.py cache", fn=lambda: member_cache_size())
+metrics.gauge("presence_tracked_ids", "Member IDs held by the online counter", fn=lambda: online_counter.stats()["tracked_ids"])
+loop_lag = LoopLagMonitor()
+metrics_runner = None
+
 next_response_time = 0  # 1時間ロック用グローバル変数（もともとの自動会話抑止に利用）
 
 # ---------------------
 # 謎解きイベント用の状態管理
 # ---------------------
-event_active = False              # 謎解き全体のオン/オフ
-event_channel_id = CHANNEL_ID     # 実行対象チャンネル（環境変数）
-event_start_ts = 0                # イベント開始時のループ時間 (asyncio loop time)
-event_end_ts = 0                  # イベント終了予定時刻（開始 + 3600）
-event_stage = 0                   # 0=待機 1=問いかけ済→待メンション 2=名前受付→待指定名 3=モニター段階 ... etc
-event_messages = []               # イベント中に生成したメッセージオブジェクト（botの投稿）を保存
-participant_messages = []         # イベント中に参加者が送ったメッセージ（botにメンションしているもの）を記録
-count_cooldown_until = 0          # オンラインカウントのクールダウン（1時間停止させる時に使用）
+# イベントの状態（段階・世代・投稿ジャーナル・ロック）は (guild_id, channel_id) ごとの EventSession に持つ
+# （bot の投稿 = KIND_BOT、bot にメンションした参加者の投稿 = KIND_PARTICIPANT としてジャーナルに記録）
+# オンラインカウントのクールダウン（1時間停止させる時に使用）とイベントの占有は共有ストアにギルドごとに持つ
+# （シャードを分けた別プロセスとも「1ギルド1イベント」を守る）
+sessions = SessionRegistry(store=shared_store)
+event_channel_id = CHANNEL_ID     # 自動開始の実行対象チャンネル（環境変数）
+event_timers = TimerScheduler()   # イベントのタイマー（59分チェック・最終シーケンス・1時間削除）
 ONLINE_THRESHOLD = 7              # 起動条件の閾値
-NAME_KEYWORDS = [
-    "よるのは","yorunoha","えび","えヴぃ","なでこ","いずれ","izure",
-    "lufe","macomo","まこも","ちる","れいちる","チル","レイチル",
-    "ロイ","ロイズ","ろいず","えび","えヴぃ"
-]
-CIPHER_TEXT = "XHAJRVETKOU"       # 出題するヴィジュネル暗号文（先に作ったもの）
-CIPHER_KEY = "JGIFAAEACAHCDIHGHF" # 指定のキー（ユーザー提供）
-ANSWER = "OBSERVATION"            # 正解（大文字比較）
-MONITOR_CODE = "XHAJRVETKOU"
+online_trigger = ThresholdTrigger(ONLINE_THRESHOLD, ONLINE_HYSTERESIS)
+# 段階ごとの台詞・名前・トリガー語・暗号文/キー/正解は scenario.json に持つ
+# （ファイルを書き換えれば再起動なしで反映される）
+scenario_store = ScenarioStore(SCENARIO_PATH)
 
 # ---------------------
-# 既存機能ラッパー（Web検索・OpenRouter等）を残すが、イベント中は無効にする
+# 既存機能ラッパー（Web検索・OpenRouter等）を残すが、イベント中のチャンネルでは使わない
 # ---------------------
-def serpapi_search(query):
-    if not SERPAPI_KEY:
+async def serpapi_search(query):
+    search_client = await search_provider.aget()
+    if not search_client:
         return "検索サービスが設定されていないよ・・・"
-    url = "https://serpapi.com/search"
-    params = {
-        "q": query,
-        "hl": "ja",
-        "gl": "jp",
-        "api_key": SERPAPI_KEY
-    }
-    try:
-        res = requests.get(url, params=params, timeout=5)
-        res.raise_for_status()
-        data = res.json()
-        if "answer_box" in data and "answer" in data["answer_box"]:
-            return data["answer_box"]["answer"]
-        elif "organic_results" in data and data["organic_results"]:
-            return data["organic_results"][0].get("snippet", "検索結果が見つからなかったかな…")
-        else:
-            return "検索結果が見つからなかったかな…"
-    except Exception as e:
-        print(f"[SerpAPIエラー] {e}")
-        return "検索サービスに接続できなかったかな…"
-
-async def gemini_search_reply(query):
-    # イベント中は無効化
-    if event_active:
-        return "今はちょっと静かにするね・・・"
-    if not chat:
-        return "Gemini が利用できないよ・・・"
-    search_result = serpapi_search(query)
-    full_query = f"{system_instruction}\nユーザーの質問: {query}\n事前の検索結果: {search_result}"
-    response = await asyncio.to_thread(chat.send_message, full_query)
+    return await search_client.search(query, hl="ja", gl="jp")
+
+def conversation_context(context_key):
+    """(要約テキスト, [(role, text), ...]) を返す。context_key が無ければ空"""
+    if context_key is None:
+        return "", []
+    conv = conversations.get(context_key)
+    return conv.summary, conv.history()
+
+async def gemini_contents(query, context_key=None):
+    search_result = await serpapi_search(query)
+    summary, history = conversation_context(context_key)
+    contents = [{"role": role, "parts": [text]} for role, text in history]
+    summary_text = f"\nこれまでの会話の要約:\n{summary}" if summary else ""
+    full_query = f"{system_instruction}{summary_text}\nユーザーの質問: {query}\n事前の検索結果: {search_result}"
+    contents.append({"role": "user", "parts": [full_query]})
+    return contents
+
+async def gemini_search_complete(query, context_key=None):
+    """ディスパッチャ用：失敗時は例外をそのまま投げる"""
+    gemini_model = await gemini_provider.aget()
+    if not gemini_model:
+        raise BackendUnavailable("Gemini が未設定")
+    contents = await gemini_contents(query, context_key)
+    response = await asyncio.to_thread(gemini_model.generate_content, contents)
     return response.text
 
+async def gemini_search_stream(query, context_key=None):
+    """ディスパッチャ用（ストリーミング）：届いた断片を順に yield する"""
+    gemini_model = await gemini_provider.aget()
+    if not gemini_model:
+        raise BackendUnavailable("Gemini が未設定")
+    contents = await gemini_contents(query, context_key)
+    async for chunk in iterate_in_thread(lambda: gemini_model.generate_content(contents, stream=True)):
+        try:
+            yield chunk.text
+        except ValueError:
+            # セーフティで止められた断片などは text が取れない
+            continue
+
 async def openrouter_reply(query):
-    # イベント中は無効化
-    if event_active:
-        return "今はちょっと静かにするね・・・"
-    if not openrouter_client:
+    # イベント中のチャンネルからは呼ばれない（on_message 側で分岐済み）
+    if not openrouter_provider.enabled:
         return "OpenRouter が利用できないよ・・・"
     try:
-        completion = await asyncio.to_thread(
-            openrouter_client.chat.completions.create,
-            model="tngtech/deepseek-r1t2-chimera:free",
-            messages=[
-                {"role": "system", "content": system_instruction},
-                {"role": "user", "content": query}
-            ]
-        )
-        return completion.choices[0].message.content.strip()
+        return await openrouter_direct(query)
     except Exception as e:
         print(f"[OpenRouterエラー] {e}")
         return "ごめんね、ちょっと考えがまとまらなかったかも"
 
+def openrouter_messages(query, context_key=None):
+    summary, history = conversation_context(context_key)
+    system_content = f"{system_instruction}\nこれまでの会話の要約:\n{summary}" if summary else system_instruction
+    messages = [{"role": "system", "content": system_content}]
+    for role, text in history:
+        messages.append({"role": "assistant" if role == "model" else "user", "content": text})
+    messages.append({"role": "user", "content": query})
+    return messages
+
+async def openrouter_complete(query, context_key=None):
+    """ディスパッチャ用：失敗時は例外をそのまま投げる"""
+    openrouter_client = await openrouter_provider.aget()
+    if not openrouter_client:
+        raise BackendUnavailable("OpenRouter が未設定")
+    completion = await asyncio.to_thread(
+        openrouter_client.chat.completions.create,
+        model=OPENROUTER_MODEL,
+        messages=openrouter_messages(query, context_key)
+    )
+    return completion.choices[0].message.content.strip()
+
+async def openrouter_stream(query, context_key=None):
+    """ディスパッチャ用（ストリーミング）：OpenAI 互換の stream=True の delta を順に yield する"""
+    openrouter_client = await openrouter_provider.aget()
+    if not openrouter_client:
+        raise BackendUnavailable("OpenRouter が未設定")
+    messages = openrouter_messages(query, context_key)
+    def stream():
+        return openrouter_client.chat.completions.create(
+            model=OPENROUTER_MODEL,
+            messages=messages,
+            stream=True
+        )
+    async for chunk in iterate_in_thread(stream):
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def timed_llm(label, call):
+    """ディスパッチャを通らない LLM 呼び出しも llm_request_seconds に残す"""
+    async def timed_call(query, **kwargs):
+        with LLM_SECONDS.time(backend=label):
+            return await call(query, **kwargs)
+    return timed_call
+
+openrouter_direct = timed_llm("openrouter_direct", openrouter_complete)
+
+# メンション質問用：Gemini を先に投げ、遅ければ OpenRouter も並行で投げて早い方を採用
+# （to_thread で走っている側はキャンセルしても結果を捨てるだけ）
+llm_dispatcher = HedgedDispatcher(
+    [
+        Backend(
+            "gemini",
+            reply_cache.wrap("gemini", gemini_search_complete),
+            timeout=GEMINI_TIMEOUT,
+            stream=reply_cache.wrap_stream("gemini", gemini_search_stream),
+        ),
+        Backend(
+            "openrouter",
+            reply_cache.wrap("openrouter", openrouter_complete),
+            timeout=OPENROUTER_TIMEOUT,
+            stream=reply_cache.wrap_stream("openrouter", openrouter_stream),
+        ),
+    ],
+    hedge_delay=LLM_HEDGE_DELAY,
+)
+
+# まとめ用：長いログはチャンクに分けて並行で要約し、最後に1つにまとめる
+log_summarizer = MapReduceSummarizer(
+    timed_llm("openrouter_summary", openrouter_complete),
+    map_prompt=(
+        f"{system_instruction}\n以下は Discord のチャンネルにおける会話ログの一部です。\n"
+        f"あとで他の部分とまとめるので、出来事を箇条書きで短く抜き出してください。\n\n{{text}}"
+    ),
+    reduce_prompt=(
+        f"{system_instruction}\n以下は Discord のチャンネルにおける会話ログの部分ごとの要約です。\n"
+        f"重複をまとめて、出来事を箇条書きで短く整理してください。\n\n{{text}}"
+    ),
+    final_prompt=(
+        f"{system_instruction}\n以下は Discord のチャンネルにおける昨日の 7:00〜今日の 6:59 までの会話ログ（または部分ごとの要約）です。\n"
+        f"内容を要約して簡単に報告してください。\n\n{{text}}"
+    ),
+    chunk_tokens=SUMMARY_CHUNK_TOKENS,
+    workers=SUMMARY_WORKERS,
+)
+
 # ---------------------
-# ヴィジュネル暗号の暗号化/復号ユーティリティ（必要なら）
+# ヴィジュネル暗号の暗号化/復号ユーティリティは vigenere.py
+# （NumPy でまとめて処理する。Bot 自体は使わないので import しない。
+#   scenario.json の暗号はデプロイ前に python vigenere.py で検査する）
 # ---------------------
-def vigenere_encrypt(plaintext, key):
-    result = []
-    key = key.upper()
-    key_indices = [ord(c) - ord('A') for c in key if c.isalpha()]
-    if not key_indices:
-        return plaintext
-    ki = 0
-    for ch in plaintext.upper():
-        if ch.isalpha():
-            p = ord(ch) - ord('A')
-            k = key_indices[ki % len(key_indices)]
-            c = (p + k) % 26
-            result.append(chr(c + ord('A')))
-            ki += 1
-        else:
-            result.append(ch)
-    return "".join(result)
-
-def vigenere_decrypt(ciphertext, key):
-    result = []
-    key = key.upper()
-    key_indices = [ord(c) - ord('A') for c in key if c.isalpha()]
-    if not key_indices:
-        return ciphertext
-    ki = 0
-    for ch in ciphertext.upper():
-        if ch.isalpha():
-            c = ord(ch) - ord('A')
-            k = key_indices[ki % len(key_indices)]
-            p = (c - k) % 26
-            result.append(chr(p + ord('A')))
-            ki += 1
-        else:
-            result.append(ch)
-    return "".join(result)
 
 # ---------------------
 # ヘルパー：オンライン人数カウント
 # ---------------------
 def count_online_members(guild: discord.Guild):
-    count = 0
-    for m in guild.members:
-        # Botは除外、かつ presence がオンライン/idle/dnd（offlineは除外）
-        try:
-            if m.bot:
-                continue
-            if m.status != discord.Status.offline:
-                count += 1
-        except Exception:
-            # 一部のメンバーは presence が取れないことがある
-            continue
-    return count
+    # presence/join/leave で差分更新しているカウンターを読むだけ（O(1)）
+    return online_counter.count(guild.id)
+
+def member_cache_size():
+    # discord.py が持っている Member の数（lean では自分だけになるはず）
+    return sum(len(guild.members) for guild in bot.guilds)
+
+def owns_guild(guild_id: int) -> bool:
+    # このプロセスが受け持つシャードのギルドか（discord.py と同じ割り当て式）
+    if not SHARD_COUNT or SHARD_IDS is None:
+        return True
+    return (guild_id >> 22) % SHARD_COUNT in SHARD_IDS
+
+def try_start_event_by_online(guild: discord.Guild, push=False):
+    """オンライン人数が閾値以上ならイベントを開始する。クールダウン中は何もしない"""
+    if sessions.in_cooldown(guild.id):
+        # カウントは休止中
+        return
+    online = count_online_members(guild)
+    # push（presence 更新時）はヒステリシス付き、定期チェックは従来どおり閾値だけ見る
+    over = online_trigger.observe(online) if push else online >= ONLINE_THRESHOLD
+    channel = bot.get_channel(event_channel_id)
+    if over and not sessions.active_in_guild(guild.id) and channel:
+        # イベントを開始
+        online_trigger.fired()
+        asyncio.create_task(start_event(channel, reason="auto"))
 
 # ---------------------
-# 60分ループでオンライン人数をチェックしてイベントを開始
+# 6分ループでオンライン人数をチェックしてイベントを開始
 # ---------------------
-@tasks.loop(minutes=60)
-async def hourly_online_check():
-    global count_cooldown_until, event_active
+last_reconcile = 0
+
+@tasks.loop(minutes=ONLINE_CHECK_MINUTES)
+async def online_check():
+    global last_reconcile
     await bot.wait_until_ready()
-    now = asyncio.get_event_loop().time()
-    if now < count_cooldown_until:
-        # カウントは休止中
-        return
+    # 期限切れのリース・クールダウン・キャッシュを掃除
+    await shared_store.call(shared_store.prune)
+    pruned = message_log.prune(datetime.now(timezone.utc).timestamp() - MESSAGE_LOG_RETENTION_DAYS * 86400)
+    if pruned:
+        print(f"[ログ整理] {pruned} messages")
     guild = bot.get_guild(GUILD_ID)
     if not guild:
         return
-    online = count_online_members(guild)
-    channel = bot.get_channel(event_channel_id)
-    if online >= ONLINE_THRESHOLD and not event_active and channel:
-        # イベントを開始
-        asyncio.create_task(start_event(channel, reason="auto"))
+    if MEMBER_CACHE == "lean":
+        # 全件スキャンはできないので、Bot かどうか未確認の ID をここで確定させる
+        # （presence 更新から走っている問い合わせがあればそれを待ち、同じ ID を2重に問い合わせない）
+        resolving = online_counter.schedule_resolve(guild)
+        if resolving is not None:
+            await asyncio.shield(resolving)
+        print(f"[メンバーキャッシュ] lean members={member_cache_size()} {online_counter.stats()}")
+        try_start_event_by_online(guild)
+        return
+    now = asyncio.get_event_loop().time()
+    if now - last_reconcile >= ONLINE_RECONCILE_MINUTES * 60:
+        # イベントの取りこぼしがあってもここで全件スキャンして合わせる
+        drift = online_counter.reconcile(guild)
+        last_reconcile = now
+        if drift:
+            print(f"[オンライン数補正] drift={drift} online={online_counter.count(guild.id)} members={member_cache_size()}")
+    try_start_event_by_online(guild)
 
 # ---------------------
 # イベントオーケストレーション
 # ---------------------
 async def start_event(channel: discord.abc.GuildChannel, reason="manual"):
     """
-    イベント開始。reasonは "auto"（60分チェック）か "manual"（Open Lain）など
+    イベント開始。reasonは "auto"（オンライン人数チェック）か "manual"（Open Lain）など
+    1つのギルドで同時に動くイベントは1つまで。開始できたら True
     """
-    global event_active, event_start_ts, event_end_ts, event_stage, event_messages, participant_messages, count_cooldown_until
-
-    if event_active:
-        return
-    event_active = True
-    event_stage = 1
-    event_messages = []
-    participant_messages = []
-    loop_now = asyncio.get_event_loop().time()
-    event_start_ts = loop_now
-    event_end_ts = loop_now + 3600  # 1時間
-    # Post initial message (①)
-    initial = await channel.send("ねえ・・・誰かいる・・・？")
-    event_messages.append(initial)
+    session = sessions.for_channel(channel)
+    async with session.lock:
+        if session.active or sessions.active_in_guild(session.guild_id):
+            return False
+        # 自動開始は、手元の写しではなく共有ストアのクールダウンで最終確認する
+        if reason == "auto" and await sessions.cooldown_active(session.guild_id):
+            return False
+        if not await sessions.claim(session.guild_id):
+            print(f"[イベント開始見送り] {session.guild_id} は {await sessions.holder(session.guild_id)} が実行中")
+            return False
+        session.active = True
+        session.finalizing = False
+        session.generation += 1
+        generation = session.generation
+        session.stage = 1
+        session.journal.clear()
+        loop_now = asyncio.get_event_loop().time()
+        session.start_ts = loop_now
+        session.end_ts = loop_now + 3600  # 1時間
+        # Post initial message (①)
+        try:
+            initial = await outbound.send(channel, scenario_store.get().text("initial"), priority=PRIORITY_SCRIPT)
+        except Exception as e:
+            # 最初の投稿に失敗したら開始しなかったことにする（タイマーが無いので active のまま残ってしまう）
+            session.active = False
+            session.stage = 0
+            await sessions.release(session.guild_id)
+            print(f"[イベント開始エラー] {session.guild_id}/{session.channel_id} {e}")
+            return False
+        session.journal.record(initial)
     # start waiting for mentions (stage 1 -> stage2 when mention received)
-    # 同時に「1時間後」の削除スケジュールはイベント終了側で管理（ただし最終解答による早期終了でも削除は実行）
+    # タイマーはすべてこのセッションの世代に紐づけ、finalize_and_delete_event でまとめて破棄する
     # 59分タイマー：到達しない場合の睡眠メッセージ
-    asyncio.create_task(stage_59min_check(channel, event_start_ts))
-    return
+    event_timers.call_later(59 * 60, stage_59min_check, session, generation, name="stage_59min_check", generation=session.timer_generation)
+    # 1時間タイマー：初投稿から1時間で投稿を削除（最終解答による早期終了でも削除は実行）
+    event_timers.call_later(3600, end_event_by_timeout, session, generation, name="end_event_by_timeout", generation=session.timer_generation)
+    return True
 
-async def stage_59min_check(channel: discord.abc.GuildChannel, start_ts):
+def session_channel(session: EventSession):
+    # キャッシュに無いチャンネル（スレッド・再接続直後など）でも .guild が引けるように guild_id を渡す
+    return bot.get_channel(session.channel_id) or bot.get_partial_messageable(session.channel_id, guild_id=session.guild_id)
+
+async def stage_59min_check(session: EventSession, generation):
     """
     イベント開始から59分経過してもFINALに到達していなければ
     BOT が寝るメッセージを出して、メンション受け付けを停止（削除されるまで）
     """
-    await asyncio.sleep(59 * 60)  # 59分
-    global event_active, event_stage
-    # もし既にイベント終了していたら何もしない
-    if not event_active:
+    async with session.lock:
+        # もし既にイベント終了していたら何もしない
+        if not session.is_current(generation):
+            return
+        # まだFINALに到達していない（つまり stage < 4 ）なら眠る
+        if session.stage < 4:
+            # 以降、メンションは削除されるまで受け付けない（どの段階の分岐にも当たらない stage 5 にする）
+            session.stage = 5
+            # ロックを持ったまま送信は待たない（記録は送信の future で行う）
+            queue_event_reply(session, session_channel(session), scenario_store.get().text("sleep"), PRIORITY_SCRIPT)
+            # 削除実行は通常通り event_end または final 解答による早期削除で行う
+
+async def end_event_by_timeout(session: EventSession, generation):
+    if not session.is_current(generation):
         return
-    # まだFINALに到達していない（つまり event_stage < 4 ）なら眠る
-    if event_stage < 4:
-        msg = await channel.send("眠くなってきちゃった・・・。少し眠るね。")
-        event_messages.append(msg)
-        # 以降、メンションは削除されるまで受け付けない（実装上 event_active True の間は受け付けないので既に無効）
-        # 削除実行は通常通り event_end または final 解答による早期削除で行う
-    return
+    await finalize_and_delete_event(session)
 
-# ---------------------
-# イベント終了処理：投稿の削除とカウント休止セット
-# ---------------------
-async def finalize_and_delete_event(channel: discord.abc.GuildChannel, force_now=False):
+async def send_event_script(session: EventSession, content: str):
     """
-    イベント終了時に実行。仕様により：
-    - 初投稿から1時間分の投稿を削除（ここでは bot 投稿 + bot をメンションしたユーザー投稿を削除）
-    - 削除後、1時間はオンライン人数のカウントを停止
+    タイマーからの台詞を送り、届くまで待つ。ジャーナルへの記録は送信の future に任せるので、
+    送信中にタイマーがキャンセルされても（1時間タイマーが最終シーケンスと重なったときなど）届いたものは消える
     """
-    global event_active, event_stage, event_messages, participant_messages, count_cooldown_until
+    future = queue_event_reply(session, session_channel(session), content, PRIORITY_SCRIPT)
+    return await asyncio.shield(future)
+
+async def show_monitor(session: EventSession, generation, after=None):
+    """名前が通ってから7秒後にモニター表示（after は名前への返信の送信。それより先には出さない）"""
+    if after is not None and not after.done():
+        await asyncio.wait([after])
+    if not session.is_current(generation):
+        return
+    await send_event_script(session, scenario_store.get().text("monitor"))
 
-    # collect window
-    start_dt = event_start_ts
-    end_dt = event_start_ts + 3600
+# 最終シーケンス：各ステップが次のステップをタイマーに積む
+async def final_error_message(session: EventSession, generation):
+    if not session.is_current(generation):
+        return
+    await send_event_script(session, scenario_store.get().text("final_error"))
+    event_timers.call_later(10, final_lain_message, session, generation, name="final_lain_message", generation=session.timer_generation)
 
-    # Delete bot messages saved in event_messages
-    # and delete participant_messages (user posts that mention bot during event)
-    # Note: we only stored objects while running; fallback: search history in window.
-    to_delete = []
-    try:
-        for m in event_messages:
-            try:
-                to_delete.append(m)
-            except Exception:
-                continue
-        for m in participant_messages:
-            try:
-                to_delete.append(m)
-            except Exception:
-                continue
-    except Exception as e:
-        print(f"[収集エラー] {e}")
+async def final_lain_message(session: EventSession, generation):
+    if not session.is_current(generation):
+        return
+    await send_event_script(session, scenario_store.get().text("final_lain"))
+    event_timers.call_later(6, final_rewrite, session, generation, name="final_rewrite", generation=session.timer_generation)
+
+async def final_rewrite(session: EventSession, generation):
+    if not session.is_current(generation):
+        return
+    # Edit all bot messages contents to "観測した"（並行で書き換え、期限を過ぎたら諦めて次へ）
+    observed = scenario_store.get().text("observed")
+    result = await bulk_edit(session.journal.partial_messages(bot, KIND_BOT), observed, deadline=FINAL_EDIT_DEADLINE)
+    print(f"[観測した書き換え] {result}")
+    # After 15秒 from now, delete event messages (even if 1 hour hasn't passed)
+    event_timers.call_later(15, end_event_by_timeout, session, generation, name="final_delete", generation=session.timer_generation)
 
-    # As fallback, try to find recent messages in channel mentioning bot in the time window
+# ---------------------
+# イベント終了処理：投稿の削除とカウント休止セット
+# ---------------------
+async def purge_journal(session: EventSession):
+    """ジャーナルに記録された投稿を PartialMessage 経由でまとめて削除し、消した分をジャーナルから外す"""
+    # 削除を始めた時点の分だけを対象にする（削除中に記録されたものを消さずにジャーナルから落とさないように）
+    count = len(session.journal)
+    targets = session.journal.partial_messages(bot)
+    # Perform deletions (14日以内は100件ずつ bulk-delete、古いものだけ単発)
+    result = await purge_messages(targets)
+    session.journal.discard_first(count)
+    # 削除イベントを取りこぼしてもまとめに出ないよう、ログからも消す
     try:
-        async for msg in channel.history(limit=1000, after=datetime.now(timezone.utc) - timedelta(hours=2)):
-            # if msg is within our event window (approx): check timestamp
-            ts = msg.created_at.replace(tzinfo=timezone.utc).timestamp()
-            if ts >= start_dt - 5 and ts <= end_dt + 5:
-                if msg.author == bot.user or (bot.user in msg.mentions):
-                    if msg not in to_delete:
-                        to_delete.append(msg)
+        message_log.delete([m.id for m in targets])
     except Exception as e:
-        print(f"[履歴取得エラー] {e}")
-
-    # Perform deletions (bulk if possible; otherwise single)
-    deleted = 0
-    for m in to_delete:
-        try:
-            await m.delete()
-            deleted += 1
-        except Exception:
-            continue
-
-    # set cooldown for counting
-    count_cooldown_until = asyncio.get_event_loop().time() + 3600  # 1時間カウント停止
+        print(f"[ログ保存エラー] {e}")
+    return result
 
-    # reset event flags
-    event_active = False
-    event_stage = 0
-    event_messages = []
-    participant_messages = []
+async def finalize_and_delete_event(session: EventSession):
+    """
+    イベント終了時に実行。仕様により：
+    - 初投稿から1時間分の投稿を削除（ここでは bot 投稿 + bot をメンションしたユーザー投稿を削除）
+    - 削除後、1時間はオンライン人数のカウントを停止
+    チャンネルから引き直さず、セッションそのものを受け取る（キャッシュに無いチャンネルだと別のセッションを引いてしまう）
+    """
+    async with session.lock:
+        # 1時間タイマーと最終シーケンスが重なっても削除は1回だけ
+        if session.finalizing or not session.active:
+            return
+        session.finalizing = True
+        # このイベントに紐づく残りのタイマーを破棄（59分チェックが次のイベントに漏れないように）
+        for line in event_timers.dump():
+            print(f"[タイマー] {line}")
+        event_timers.cancel_generation(session.timer_generation)
+
+    # 積んだまま送り始めていない返信は取り消し、送信中のものだけ待つ（届いたものはジャーナルに入るので一緒に消える）
+    outbound.discard(session.pending_sends)
+    if session.pending_sends:
+        await asyncio.wait(list(session.pending_sends))
+
+    # Delete bot messages and participant messages recorded in the session journal
+    # ジャーナルはディスクにも残っているので、履歴をスキャンし直す必要はない
+    result = await purge_journal(session)
+
+    async with session.lock:
+        # set cooldown for counting
+        await sessions.start_cooldown(session.guild_id, 3600)  # 1時間カウント停止
+
+        # reset event flags
+        session.active = False
+        session.stage = 0
+        await sessions.release(session.guild_id)
 
     # Optionally announce in channel (but event messages were deleted)
     try:
-        await channel.send("--- 謎解きは終了しました。しばらくカウントを停止します・・・")
+        await outbound.send(session_channel(session), scenario_store.get().text("closing"), priority=PRIORITY_SCRIPT)
     except Exception:
         pass
 
-    print(f"[イベント削除] deleted {deleted} messages; counting paused for 1 hour.")
+    print(f"[イベント削除] {session.guild_id}/{session.channel_id} {result}; counting paused for 1 hour.")
+    print(f"[送信キュー] {outbound.stats()}")
     return
 
 # ---------------------
@@ -334,17 +595,217 @@ async def finalize_and_delete_event(channel: discord.abc.GuildChannel, force_now
 @bot.event
 async def on_ready():
     print(f'Bot {bot.user} is ready.')
-    # 60分ごとのチェック開始
-    hourly_online_check.start()
-    # Summarize daily loop should still be running but must check event_active before doing work
-    summarize_previous_day.start()
+    if SHARD_COUNT:
+        print(f"[シャード] worker={WORKER_ID} shards={sorted(bot.shards)}/{SHARD_COUNT} guilds={len(bot.guilds)}")
+    if not any(name == "ready" for name, _, _ in startup.marks):
+        startup.mark("ready")
+        if STARTUP_TIMING:
+            print(f"[起動時間] {startup.report()} {[(p.name, p.stats()) for p in providers]}")
+            await bot.close()
+            return
+    if PREWARM_PROVIDERS:
+        for provider in providers:
+            if provider.enabled and not provider.loaded:
+                asyncio.create_task(provider.aget())
+    # ここからはメッセージを取りこぼさないのでログの「揃っている区間」を開始
+    if message_log.session_id is None:
+        message_log.begin_session()
+    # 前回イベント中に落ちていた場合は、ジャーナルに残っている投稿を片付ける
+    # （シャード分割時は自分の受け持ちのギルドだけ。ほかのワーカーが実行中のイベントには触らない）
+    for session in sessions.load_leftovers(owns=owns_guild):
+        result = await purge_journal(session)
+        await sessions.release(session.guild_id)
+        print(f"[イベント削除（再起動後）] {session.guild_id}/{session.channel_id} {result}")
+    # 6分ごとのチェック開始（初回・再接続後は全件スキャンでカウンターを作り直す）
+    global last_reconcile
+    last_reconcile = 0
+    if not online_check.is_running():
+        online_check.start()
+    # Summarize daily loop should still be running but must check the event session before doing work
+    if not summarize_previous_day.is_running():
+        summarize_previous_day.start()
+    # 計測（ループの遅れ・/metrics・定期ダイジェスト）
+    global metrics_runner
+    loop_lag.start()
+    if metrics_runner is None:
+        try:
+            metrics_runner = await metrics.start_http_server()
+        except OSError as e:
+            print(f"[メトリクスHTTPエラー] {e}")
+    if not metrics_digest.is_running():
+        metrics_digest.start()
+    if not flush_message_log.is_running():
+        flush_message_log.start()
+
+@bot.event
+async def on_presence_update(before, after):
+    if after.bot:
+        return
+    online_counter.update(after)
+    if ONLINE_PUSH_TRIGGER and after.guild.id == GUILD_ID:
+        try_start_event_by_online(after.guild, push=True)
+
+@bot.event
+async def on_raw_presence_update(payload):
+    # MEMBER_CACHE=lean のときだけ届く（キャッシュに無いメンバーの presence）
+    online_counter.update_raw(payload.guild_id, payload.user_id, str(payload.status))
+    if payload.guild_id == GUILD_ID:
+        guild = bot.get_guild(GUILD_ID)
+        if guild is None:
+            return
+        online_counter.schedule_resolve(guild)
+        if ONLINE_PUSH_TRIGGER:
+            try_start_event_by_online(guild, push=True)
+
+@bot.event
+async def on_member_join(member):
+    online_counter.update(member)
+
+@bot.event
+async def on_raw_member_remove(payload):
+    # キャッシュに無いメンバーの退出も届くので on_member_remove ではなくこちらで受ける
+    online_counter.remove_raw(payload.guild_id, payload.user.id)
+
+@bot.event
+async def on_resumed():
+    if message_log.session_id is None:
+        message_log.begin_session()
+
+@bot.event
+async def on_disconnect():
+    message_log.end_session()
+    try:
+        reply_cache.save()
+    except OSError as e:
+        print(f"[返信キャッシュ保存エラー] {e}")
+
+async def close_clients():
+    """読み込み済みのクライアントの接続（aiohttp のセッションなど）を閉じる"""
+    if search_provider.loaded:
+        search_client = search_provider.get()
+        if search_client is not None:
+            await search_client.close()
+
+def queue_event_reply(session: EventSession, channel, content: str, priority: int):
+    """
+    イベント中の返信を送信キューに積むだけで、届くのは待たない（session.lock を持ったまま
+    1通ずつ送信を待つと、メンションが送信ペースでしか捌けず正解も後ろで待たされる）。
+    届いたらジャーナルに記録する。終了処理は pending_sends が空になるのを待ってから削除する。
+    """
+    future = outbound.submit(channel, content, priority)
+    # まとめられた filler は同じ future が返る（届き済みならもう記録してある）
+    if not future.done() and future not in session.pending_sends:
+        session.pending_sends.add(future)
+
+        def record(f):
+            session.pending_sends.discard(f)
+            if not f.cancelled() and f.exception() is None:
+                session.journal.record(f.result())
+        future.add_done_callback(record)
+    return future
+
+async def handle_event_message(session: EventSession, message):
+    """イベント中のチャンネルでのメッセージ処理（session.lock を取った状態で呼ぶ。返信は積むだけで待たない）"""
+    channel = message.channel
+    content = message.content or ""
+    # 終了処理（削除）に入ったら何も記録・返信しない（イベント中扱いなので通常の機能にも回さない）
+    if session.finalizing:
+        return
+    # record participant messages if they mention the bot or are relevant to puzzle flow
+    if bot.user in message.mentions:
+        session.journal.record(message, KIND_PARTICIPANT)
+
+        # トリガー語はシナリオから読み、本文を1回なめるだけで段階ごとの一致を出す
+        scenario = scenario_store.get()
+        matches = scenario.match(content)
+
+        # STAGE 1: Bot asked "ねえ・・・誰かいる・・・？" -> any mention moves to stage 2
+        if session.stage == 1:
+            # reply and progress
+            queue_event_reply(session, channel, scenario.text("stage1_reply", mention=message.author.mention), PRIORITY_REPLY)
+            session.stage = 2
+            return
+
+        # STAGE 2: Expect only mention; check whether mention contains allowed name keywords
+        if session.stage == 2:
+            matched_name = matches.get("names")
+            if matched_name:
+                name_sent = queue_event_reply(session, channel, scenario.text("name_reply", name=matched_name), PRIORITY_REPLY)
+                session.stage = 3
+                # schedule the 7秒後モニター表示（名前への返信より先に出ないよう、その送信を待ってから）
+                event_timers.call_later(7, show_monitor, session, session.generation, name_sent, name="show_monitor", generation=session.timer_generation)
+            else:
+                queue_event_reply(session, channel, scenario.text("name_miss"), PRIORITY_REPLY)
+            return
+
+        # STAGE 3: monitor interactions — respond depending on keywords inside the mention
+        if session.stage == 3:
+            # 一番優先度の高いキーワードの返信だけ返す
+            reply = matches.get("stage3")
+            # 1通への返信どうしは同じ優先度で積み、送る順番を保つ（正解なら「final」の前にキーワードの返信）
+            answered = matches.get("answer")
+            if reply:
+                queue_event_reply(session, channel, reply, PRIORITY_SCRIPT if answered else PRIORITY_REPLY)
+            # FINAL: check for answer (OBSERVATION)
+            if answered:
+                # final sequence
+                session.stage = 4
+                queue_event_reply(session, channel, scenario.text("final"), PRIORITY_SCRIPT)
+                # 5秒後: error spam（以降はタイマーで順に進む）
+                event_timers.call_later(5, final_error_message, session, session.generation, name="final_error_message", generation=session.timer_generation)
+            elif not reply:
+                # If mention without relevant keywords, reply "・・・。"
+                queue_event_reply(session, channel, scenario.text("fallback"), PRIORITY_FILLER)
+            return
+
+    # If event is active but message does not mention bot, ignore (no other features)
+    return
+
+
+@bot.event
+async def on_raw_message_edit(payload):
+    # 本文の変わらない更新（埋め込みの展開など）は content を含まない
+    if "content" in payload.data:
+        recent_messages.edit(payload.channel_id, payload.message_id, payload.data["content"])
+        try:
+            message_log.update(payload.message_id, payload.data["content"])
+        except Exception as e:
+            print(f"[ログ保存エラー] {e}")
+
+@bot.event
+async def on_raw_message_delete(payload):
+    recent_messages.delete(payload.channel_id, [payload.message_id])
+    try:
+        message_log.delete([payload.message_id])
+    except Exception as e:
+        print(f"[ログ保存エラー] {e}")
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    recent_messages.delete(payload.channel_id, payload.message_ids)
+    try:
+        message_log.delete(payload.message_ids)
+    except Exception as e:
+        print(f"[ログ保存エラー] {e}")
 
 @bot.event
 async def on_message(message):
-    global next_response_time, event_active, event_stage, event_messages, participant_messages, event_end_ts
+    # 通った分岐ごとに処理時間を残す
+    with ON_MESSAGE_SECONDS.time(branch="unknown") as timer:
+        timer.labels["branch"] = await route_message(message)
+
+async def route_message(message):
+    """on_message の本体。通った分岐の名前を返す"""
+    global next_response_time
+
+    try:
+        message_log.append(message)
+    except Exception as e:
+        print(f"[ログ保存エラー] {e}")
+    recent_messages.add(message)
 
     if message.author.bot:
-        return
+        return "bot"
 
     channel = message.channel
     content = message.content or ""
@@ -352,195 +813,107 @@ async def on_message(message):
 
     # 強制開始トリガー ("Open Lain" — case-insensitive, exact phrase anywhere)
     if content_stripped.lower() == "open lain":
-        if not event_active:
-            await channel.send("Open Lain をトリガーとして受け取りました・・・")
+        # イベントはギルドごとに1つまで（他のギルドのイベントとは独立）
+        if not sessions.active_in_guild(message.guild.id if message.guild else 0):
+            await outbound.send(channel, "Open Lain をトリガーとして受け取りました・・・", priority=PRIORITY_REPLY)
             await start_event(channel, reason="manual")
         else:
-            await channel.send("もう謎解きは始まっているよ・・・")
-        return
-
-    # If event is active, only handle event-specific interactions and ignore all other features
-    if event_active:
-        # record participant messages if they mention the bot or are relevant to puzzle flow
-        if bot.user in message.mentions:
-            participant_messages.append(message)
-
-            # STAGE 1: Bot asked "ねえ・・・誰かいる・・・？" -> any mention moves to stage 2
-            if event_stage == 1:
-                # reply and progress
-                rep = await channel.send(f"{message.author.mention} あ、いた。よかった。・・・ところであなたの名前は？")
-                event_messages.append(rep)
-                event_stage = 2
-                return
-
-            # STAGE 2: Expect only mention; check whether mention contains allowed name keywords
-            if event_stage == 2:
-                lower = content.lower()
-                matched = False
-                for kw in NAME_KEYWORDS:
-                    if kw.lower() in lower:
-                        matched = True
-                        matched_name = kw
-                        break
-                if matched:
-                    rep = await channel.send(f"{matched_name}・・・！助けてほしいの。今わたしは、部屋に閉じ込められているんだ。")
-                    event_messages.append(rep)
-                    event_stage = 3
-                    # schedule the 7秒後モニター表示
-                    async def monitor_after_7():
-                        await asyncio.sleep(7)
-                        m = await channel.send("あ、モニターがついたみたい・・・。『XHAJRVETKOU』　『これを解く鍵はあなたの名前』って書いている・・・。なんだかわかる？")
-                        event_messages.append(m)
-                    asyncio.create_task(monitor_after_7())
-                else:
-                    rep = await channel.send("・・・ごめんなさいそのユーザー名の登録はないわ")
-                    event_messages.append(rep)
-                return
-
-            # STAGE 3: monitor interactions — respond depending on keywords inside the mention
-            if event_stage == 3:
-                lower = content.lower()
-                # check each special keyword; respond accordingly
-                if "暗号" in content or "あんごう" in lower:
-                    rep = await channel.send("確かに暗号文に見えるわ・・・ただ、何の暗号化がわからない・・・")
-                    event_messages.append(rep)
-                elif "名前" in content or "なまえ" in lower:
-                    rep = await channel.send("あなたの名前ってなんだろうね、わたし？それともあなた？・・・。")
-                    event_messages.append(rep)
-                elif "ヒント" in content or "hint" in lower:
-                    rep = await channel.send("・・・ヒント？うーん、わたしにはよくわからない・・・。この部屋、暗いけどいくつか絵が飾っているのがわかる・・・。アルファベットがいっぱい書いてある絵がある・・・。目がチカチカするよ・・・。")
-                    event_messages.append(rep)
-                elif "絵" in content:
-                    rep = await channel.send("他の絵は・・・。見たことある絵画ばかりだね・・・。『ヴィーナスの誕生』『最後の晩餐』『アテナイの学堂』。３つにつながりはあるのかな？・・・わたし、ラファエロの絵好きだなあ・・・。")
-                    event_messages.append(rep)
-                elif "モニター" in content:
-                    rep = await channel.send("・・・モニター？・・・大きなモニターだよ。モニターに近づくと文字が数字に変わっていく・・・。")
-                    event_messages.append(rep)
-                elif "どういう意味" in content:
-                    rep = await channel.send("わからない・・・。あなたは何かわかる？")
-                    event_messages.append(rep)
-                elif "なでこ" in content or "968900402072387675" in content:
-                    rep = await channel.send("・・・なに？わたしの名前・・・だよね？")
-                    event_messages.append(rep)
-                elif "あなたは誰" in content:
-                    rep = await channel.send("わたし？わたしは”なでこ”。いろんなサーバーに散在している。”集合体”と言ってもいいかしら・・・。・・・今はわたしの話はいいわ、早く謎解きを一緒に考えてよ")
-                    event_messages.append(rep)
-                elif "xhaajrvetktou".lower() in lower or MONITOR_CODE.lower() in lower:
-                    # note: user asked about exact code
-                    rep = await channel.send("・・・なんて読むんだろう、わたしは読めいないけどあなたは読める？")
-                    event_messages.append(rep)
-                elif "鍵" in content:
-                    rep = await channel.send("鍵・・・？よくわからないよ。鍵で開けるようなところはこの部屋にはないよ")
-                    event_messages.append(rep)
-                elif "ヴィジュネル暗号" in content or "ヴィジュネル" in content or "vigenere" in lower or "ヴィジュネル暗号" in lower:
-                    rep = await channel.send("・・・ヴィジュネル暗号それかもしれない・・・アルファベットをアルファベットの鍵で解く暗号だよね・・・解いてみて")
-                    # provide the cipher and key as hint (spec earlier provided the key)
-                    event_messages.append(rep)
-                # FINAL: check for answer (OBSERVATION)
-                if ANSWER.lower() in content.lower():
-                    # final sequence
-                    event_stage = 4
-                    rep1 = await channel.send("あ、モニターが動いている・・・外とつながっているみたい！ここから出られるよ！ありがとう・・・")
-                    event_messages.append(rep1)
-                    # 5秒後: error spam
-                    async def final_sequence():
-                        await asyncio.sleep(5)
-                        rep2 = await channel.send("あなた達は観測した。serial experiments　Layer:01 ERROR...Layer:01 ERROR...Layer:01 ERROR...Layer:01 ERROR...Layer:01 ERROR...")
-                        event_messages.append(rep2)
-                        await asyncio.sleep(10)
-                        rep3 = await channel.send("Let's all love Lain")
-                        event_messages.append(rep3)
-                        await asyncio.sleep(6)
-                        # Edit all event_messages contents to "観測した"
-                        for m in list(event_messages):
-                            try:
-                                await m.edit(content="観測した")
-                            except Exception:
-                                continue
-                        # After 15秒 from now, delete event messages (even if 1 hour hasn't passed)
-                        await asyncio.sleep(15)
-                        await finalize_and_delete_event(channel, force_now=True)
-                    asyncio.create_task(final_sequence())
-                else:
-                    # If mention without relevant keywords, reply "・・・。"
-                    # But we don't want to send "・・・。" when we already responded to a matched keyword
-                    # We check last event message: if none of above matched, send ellipsis.
-                    # Determine if last action generated something by counting recent event_messages.
-                    # If none of the conditions above matched, reply "・・・。"
-                    # We check a subset of keywords that cause explicit reply; if none matched, send ellipsis.
-                    keywords = ["暗号","名前","ヒント","絵","モニター","どういう意味","なでこ",
-                                "968900402072387675","あなたは誰","XHAJRVETKOU","鍵","ヴィジュネル"]
-                    matched_any = any(k.lower() in content.lower() for k in keywords)
-                    # If no match, reply ellipsis
-                    if not matched_any:
-                        rep = await channel.send("・・・。")
-                        event_messages.append(rep)
-                return
-
-        # If event_active but message does not mention bot, ignore (no other features)
-        return
-
-    # ここからは event_active == False の通常処理
+            await outbound.send(channel, "もう謎解きは始まっているよ・・・", priority=PRIORITY_REPLY)
+        return "open_lain"
+
+    # If event is active in this channel, only handle event-specific interactions and ignore all other features
+    session = sessions.for_channel(channel, create=False)
+    if session and session.active:
+        if not session.finalizing:
+            async with session.lock:
+                await handle_event_message(session, message)
+        return "event"
+
+    # ここからはこのチャンネルでイベントが動いていないときの通常処理
     # 強制まとめトリガー
     if content_stripped == "できごとまとめ":
         await summarize_logs(channel)
-        return
+        return "summary"
 
     # メンションによる質問処理（通常モード）
     if content.startswith(f"<@{bot.user.id}>") or content.startswith(f"<@!{bot.user.id}>"):
         query = content.replace(f"<@{bot.user.id}>", "").replace(f"<@!{bot.user.id}>", "").strip()
+        bypass_cache = not REPLY_CACHE or query.startswith(REPLY_CACHE_BYPASS_PREFIX)
+        if query.startswith(REPLY_CACHE_BYPASS_PREFIX):
+            query = query[len(REPLY_CACHE_BYPASS_PREFIX):].strip()
         if not query:
-            await channel.send(f"{message.author.mention} 質問内容が見つからなかったかな…")
-            return
-
-        thinking_msg = await channel.send(f"{message.author.mention} 考え中だよ\U0001F50D")
-
-        async def try_gemini():
-            return await gemini_search_reply(query)
+            await outbound.send(channel, f"{message.author.mention} 質問内容が見つからなかったかな…", priority=PRIORITY_REPLY)
+            return "mention_empty"
+
+        context_key = conversations.key(channel.id, message.author.id)
+        cached_reply = await reply_cache.alookup(query, [b.name for b in llm_dispatcher.backends], bypass=bypass_cache, context_key=context_key)
+        if cached_reply is not None:
+            # キャッシュから返すときは LLM を呼ばないので受付制御も通さない
+            print(f"[返信キャッシュ] hit {reply_cache.stats()}")
+            conversations.append(context_key, "user", query)
+            conversations.append(context_key, "model", cached_reply)
+            await outbound.send(channel, f"{message.author.mention} {cached_reply}", priority=PRIORITY_REPLY)
+            return "mention_cached"
 
         try:
-            reply_text = await asyncio.wait_for(try_gemini(), timeout=10.0)
-        except (asyncio.TimeoutError, Exception):
-            reply_text = await openrouter_reply(query)
-
-        await thinking_msg.edit(content=f"{message.author.mention} {reply_text}")
-        return
-
-    # 自動会話（ランダムで入る）--- これも event_active で止めたいので上に分岐済み
+            ticket = admission.admit(message.author.id, message.guild.id if message.guild else 0)
+        except AdmissionRejected as e:
+            print(f"[受付制限] {e.reason} user={message.author.id} {admission.stats()}")
+            # メンションを付けないので、同じ断り文句は送信キューで1通にまとまる
+            await outbound.send(channel, SHED_REPLIES[e.reason], priority=PRIORITY_FILLER)
+            return "mention_shed"
+
+        async with ticket:
+            thinking_msg = await outbound.send(channel, f"{message.author.mention} 考え中だよ\U0001F50D", priority=PRIORITY_REPLY)
+            await ticket.acquire()
+
+            editor = ProgressiveEditor(thinking_msg, prefix=f"{message.author.mention} ", min_interval=STREAM_EDIT_INTERVAL)
+            try:
+                if LLM_STREAMING:
+                    reply_text = await llm_dispatcher.stream(query, editor.update, context_key=context_key)
+                else:
+                    reply_text = await llm_dispatcher.run(query, context_key=context_key)
+                # 検索結果や system_instruction は履歴に残さず、質問と返答だけ積む
+                conversations.append(context_key, "user", query)
+                conversations.append(context_key, "model", reply_text)
+            except Exception as e:
+                print(f"[LLMディスパッチエラー] {e} {llm_dispatcher.stats()} {admission.stats()}")
+                reply_text = "ごめんね、ちょっと考えがまとまらなかったかも"
+
+        await editor.finish(reply_text)
+        return "mention"
+
+    # 自動会話（ランダムで入る）--- これもイベント中のチャンネルでは止めたいので上に分岐済み
     now = asyncio.get_event_loop().time()
     if now < next_response_time:
-        return
+        return "chat"
 
     if random.random() < 0.03:
         try:
-            history = []
-            async for msg in channel.history(limit=20, oldest_first=False):
-                if not msg.author.bot and msg.content.strip():
-                    history.append(f"{msg.author.display_name}: {msg.content.strip()}")
-                if len(history) >= 10:
-                    break
-            history.reverse()
-            history_text = "\n".join(history)
+            history_text = "\n".join(recent_messages.lines(channel.id))
             prompt = (
                 f"{system_instruction}\n以下はDiscordのチャンネルでの最近の会話です。\n"
                 f"これらを読んで自然に会話に入ってみてください。\n\n{history_text}"
             )
             response = await openrouter_reply(prompt)
-            await channel.send(response)
+            await outbound.send(channel, response, priority=PRIORITY_FILLER)
             next_response_time = now + 60 * 60
         except Exception as e:
             print(f"[履歴会話エラー] {e}")
+        return "autochat"
+    return "chat"
 
 # ---------------------
-# 既存の summarize_previous_day は event_active をチェックするように改修
+# 既存の summarize_previous_day はイベントセッションをチェックするように改修
 # ---------------------
 @tasks.loop(time=time(7, 0, 0))
 async def summarize_previous_day():
     await bot.wait_until_ready()
-    # イベント中は要約処理を実行しない
-    if event_active:
-        return
     channel = bot.get_channel(CHANNEL_ID)
+    # イベント中のチャンネルでは要約処理を実行しない
+    session = sessions.for_channel(channel, create=False) if channel else None
+    if session and session.active:
+        return
     if channel:
         await summarize_logs(channel)
 
@@ -550,34 +923,76 @@ async def summarize_logs(channel):
     start_time = datetime(now.year, now.month, now.day, 7, 0, 0, tzinfo=JST) - timedelta(days=1)
     end_time = datetime(now.year, now.month, now.day, 6, 59, 59, tzinfo=JST)
 
+    # ローカルログから読む。Bot が落ちていた区間だけ API から取り直す
+    start_ts = start_time.timestamp()
+    end_ts = end_time.timestamp()
+    try:
+        fetched = await message_log.backfill(channel, start_ts, end_ts)
+        if fetched:
+            print(f"[ログ補完] {fetched} messages")
+    except Exception as e:
+        print(f"[ログ補完エラー] {e}")
+
     messages = []
-    async for msg in channel.history(limit=1000, after=start_time, before=end_time, oldest_first=True):
-        if msg.author.bot:
-            continue
-        clean_content = msg.content.strip()
+    for author_name, content in message_log.fetch_window(channel.id, start_ts, end_ts):
+        clean_content = content.strip()
         if clean_content:
-            messages.append(f"{msg.author.display_name}: {clean_content}")
+            messages.append(f"{author_name}: {clean_content}")
 
     if not messages:
-        await channel.send("昨日は何も話されていなかったみたい・・・")
+        await outbound.send(channel, "昨日は何も話されていなかったみたい・・・", priority=PRIORITY_REPLY)
         return
 
-    joined = "\n".join(messages)
-    prompt = (
-        f"{system_instruction}\n以下は Discord のチャンネルにおける昨日の 7:00〜今日の 6:59 までの会話ログです。\n"
-        f"内容を要約して簡単に報告してください。\n\n{joined}"
-    )
     try:
-        summary = await openrouter_reply(prompt)
-        await channel.send(f"\U0001F4CB **昨日のまとめだよ・・・**\n{summary}")
+        summary, stats = await log_summarizer.summarize(messages)
+        print(f"[要約] {stats}")
+        await outbound.send(channel, f"\U0001F4CB **昨日のまとめだよ・・・**\n{summary}", priority=PRIORITY_REPLY)
     except Exception as e:
         print(f"[要約エラー] {e}")
-        await channel.send("ごめんね、昨日のまとめを作れなかった・・・")
+        await outbound.send(channel, "ごめんね、昨日のまとめを作れなかった・・・", priority=PRIORITY_REPLY)
+
+# ---------------------
+# メトリクスのダイジェスト（1行の JSON をログへ）
+# ---------------------
+@tasks.loop(minutes=METRICS_DIGEST_MINUTES)
+async def metrics_digest():
+    print(f"[メトリクス] {json.dumps(metrics.registry.digest(), ensure_ascii=False)}")
+    loop_lag.reset_max()
+
+# ---------------------
+# メッセージログの書き出し（on_message はバッファに積むだけ）
+# ---------------------
+@tasks.loop(seconds=MESSAGE_LOG_FLUSH_SECONDS)
+async def flush_message_log():
+    # 発言が無い間も、繋がっている区間はここで延ばしておく
+    try:
+        message_log.touch_session()
+    except Exception as e:
+        print(f"[ログ保存エラー] {e}")
+
+startup.mark("module_init")
 
 # ---------------------
-# ボット起動
+# ボット起動（bench.py などから import したときは起動しない）
 # ---------------------
-bot.run(DISCORD_TOKEN)
+if __name__ == "__main__":
+    if STARTUP_TIMING:
+        print(f"[起動時間] {startup.report()}")
+    # bot.run() と同じ流れだが、終了時に検索クライアントなども閉じる
+    async def run_bot():
+        try:
+            async with bot:
+                await bot.start(DISCORD_TOKEN)
+        finally:
+            await close_clients()
+            # バッファに残っているメッセージログも書き出す
+            message_log.close()
+
+    discord.utils.setup_logging()
+    try:
+        asyncio.run(run_bot())
+    except KeyboardInterrupt:
+        pass
 
 
 
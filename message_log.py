@@ -0,0 +1,212 @@
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+from ratelimit import REST_SECONDS
+
+# ---------------------
+# ローカルのメッセージログ（SQLite・追記のみ）
+# ---------------------
+# on_message で受け取ったものをそのまま貯めておき、まとめはここから読む。
+# Bot が落ちていた時間帯（= どのセッションにも coverage にも含まれない区間）だけ
+# channel.history で取り直す。
+# 削除・編集も反映し（まとめに消えた発言や古い本文が出ないように）、古い行は prune で捨てる。
+# on_message ごとに INSERT + commit するとイベントループが全ギルドの発言ぶん止まるので、
+# append() はバッファに積むだけにして、flush() で（定期的に・読む前に）まとめて書く。
+# last_alive は書き込んだ時点でしか進めないので、落ちて書けなかった分は区間の外になり取り直される。
+
+MESSAGE_LOG_PATH = os.getenv("MESSAGE_LOG_PATH", os.path.join("data", "messages.db"))
+
+INSERT_MESSAGE = "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    message_id  INTEGER PRIMARY KEY,
+    channel_id  INTEGER NOT NULL,
+    author_id   INTEGER NOT NULL,
+    author_name TEXT NOT NULL,
+    is_bot      INTEGER NOT NULL,
+    content     TEXT NOT NULL,
+    created_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_channel_ts ON messages (channel_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages (created_at);
+-- Gateway に繋がっていた区間（全チャンネル共通）
+CREATE TABLE IF NOT EXISTS sessions (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    last_alive REAL NOT NULL
+);
+-- history で取り直し済みの区間（チャンネルごと）
+CREATE TABLE IF NOT EXISTS coverage (
+    channel_id INTEGER NOT NULL,
+    start_ts   REAL NOT NULL,
+    end_ts     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_coverage_channel ON coverage (channel_id);
+"""
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class MessageLog:
+    def __init__(self, path: str = MESSAGE_LOG_PATH, flush_size: int = 500):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.session_id = None
+        self.flush_size = flush_size    # これだけ溜まったら flush() を待たずに書く
+        self._pending = []              # まだ書いていない行
+        self._dirty = False             # commit していない書き込みがある
+
+    # --- 接続区間の管理 ---
+    def begin_session(self):
+        now = time.time()
+        cur = self.db.execute("INSERT INTO sessions (started_at, last_alive) VALUES (?, ?)", (now, now))
+        self.db.commit()
+        self.session_id = cur.lastrowid
+
+    def touch_session(self):
+        self.flush()
+        if self.session_id is None:
+            return
+        self.db.execute("UPDATE sessions SET last_alive = ? WHERE id = ?", (time.time(), self.session_id))
+        self.db.commit()
+
+    def end_session(self):
+        self.touch_session()
+        self.session_id = None
+
+    # --- 書き込み ---
+    def append(self, message):
+        """バッファに積むだけ（flush_size 件溜まったときだけその場で書く）"""
+        self._pending.append(self._row(message))
+        if len(self._pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """溜まった行をまとめて書き、接続区間を今まで延ばして commit する"""
+        if self._pending:
+            self.db.executemany(INSERT_MESSAGE, self._pending)
+            self._pending.clear()
+            if self.session_id is not None:
+                self.db.execute("UPDATE sessions SET last_alive = ? WHERE id = ?", (time.time(), self.session_id))
+            self._dirty = True
+        if self._dirty:
+            self.db.commit()
+            self._dirty = False
+
+    @staticmethod
+    def _row(message) -> tuple:
+        return (
+            message.id,
+            message.channel.id,
+            message.author.id,
+            message.author.display_name,
+            1 if message.author.bot else 0,
+            message.content or "",
+            message.created_at.timestamp(),
+        )
+
+    def _insert(self, message):
+        self.db.execute(INSERT_MESSAGE, self._row(message))
+
+    def update(self, message_id: int, content: str):
+        """編集された本文に置き換える（まだバッファにある行にも効くよう先に書き出す）"""
+        self.flush()
+        self.db.execute("UPDATE messages SET content = ? WHERE message_id = ?", (content or "", message_id))
+        self.db.commit()
+
+    def delete(self, message_ids):
+        """削除されたメッセージを消す（ユーザー自身の削除・イベント後の一括削除）"""
+        self.flush()
+        self.db.executemany("DELETE FROM messages WHERE message_id = ?", ((i,) for i in message_ids))
+        self.db.commit()
+
+    def prune(self, before_ts: float) -> int:
+        """before_ts より古いメッセージ・接続区間・取り直し済み区間を捨て、消したメッセージ数を返す"""
+        self.flush()
+        removed = self.db.execute("DELETE FROM messages WHERE created_at < ?", (before_ts,)).rowcount
+        self.db.execute("DELETE FROM coverage WHERE end_ts < ?", (before_ts,))
+        self.db.execute(
+            "DELETE FROM sessions WHERE last_alive < ? AND id IS NOT ?", (before_ts, self.session_id)
+        )
+        self.db.commit()
+        return removed
+
+    # --- 読み出し ---
+    def gaps(self, channel_id: int, start_ts: float, end_ts: float) -> list:
+        """[start_ts, end_ts) のうちログが揃っていない区間のリスト"""
+        self.flush()
+        rows = self.db.execute(
+            "SELECT started_at, last_alive FROM sessions WHERE last_alive >= ? AND started_at <= ?",
+            (start_ts, end_ts),
+        ).fetchall()
+        rows += self.db.execute(
+            "SELECT start_ts, end_ts FROM coverage WHERE channel_id = ? AND end_ts >= ? AND start_ts <= ?",
+            (channel_id, start_ts, end_ts),
+        ).fetchall()
+        gaps = []
+        cursor = start_ts
+        for start, end in _merge(rows):
+            if start > cursor:
+                gaps.append((cursor, min(start, end_ts)))
+            cursor = max(cursor, end)
+            if cursor >= end_ts:
+                break
+        if cursor < end_ts:
+            gaps.append((cursor, end_ts))
+        return gaps
+
+    def fetch_window(self, channel_id: int, start_ts: float, end_ts: float, include_bots: bool = False) -> list:
+        """(author_name, content) を古い順に返す"""
+        self.flush()
+        sql = (
+            "SELECT author_name, content FROM messages "
+            "WHERE channel_id = ? AND created_at >= ? AND created_at < ?"
+        )
+        if not include_bots:
+            sql += " AND is_bot = 0"
+        sql += " ORDER BY created_at"
+        return self.db.execute(sql, (channel_id, start_ts, end_ts)).fetchall()
+
+    async def backfill(self, channel, start_ts: float, end_ts: float) -> int:
+        """
+        落ちていた区間だけ channel.history で取り直して保存する。
+        取り直した件数を返す。
+        """
+        end_ts = min(end_ts, time.time())
+        self.touch_session()
+        fetched = 0
+        for gap_start, gap_end in self.gaps(channel.id, start_ts, end_ts):
+            with REST_SECONDS.time(route="history"):
+                async for msg in channel.history(
+                    limit=None,
+                    after=datetime.fromtimestamp(gap_start, timezone.utc),
+                    before=datetime.fromtimestamp(gap_end, timezone.utc),
+                    oldest_first=True,
+                ):
+                    self._insert(msg)
+                    fetched += 1
+            self.db.execute(
+                "INSERT INTO coverage (channel_id, start_ts, end_ts) VALUES (?, ?, ?)",
+                (channel.id, gap_start, gap_end),
+            )
+            self.db.commit()
+        return fetched
+
+    def close(self):
+        self.end_session()
+        self.db.close()
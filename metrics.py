@@ -0,0 +1,269 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+
+# ---------------------
+# 軽量メトリクス（カウンター・ヒストグラム・ゲージ）
+# ---------------------
+# print だけでは本番でどこに時間がかかっているか分からないので、
+# ホットパスの処理時間と回数をここに集めて、ローカルの HTTP で Prometheus の
+# テキスト形式として出し、定期的に1行のダイジェストもログに出す。
+# observe は bisect 1回と足し算だけなので常時オンで構わない。
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))     # 0 なら HTTP で出さない
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _digest_key(key: tuple, default: str) -> str:
+    return ",".join(f"{k}={v}" for k, v in key) or default
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values = {}    # ラベル -> 値
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        return [f"{self.name}{_format_labels(key)} {_format_value(v)}" for key, v in self.values.items()]
+
+    def digest(self) -> dict:
+        return {_digest_key(key, "total"): v for key, v in self.values.items()}
+
+
+class Gauge:
+    """値を set するか、fn を渡して出力時に読む"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.values = {}
+
+    def set(self, value: float, **labels):
+        self.values[_label_key(labels)] = value
+
+    def _current(self) -> dict:
+        if self.fn is None:
+            return self.values
+        try:
+            return {(): self.fn()}
+        except Exception:
+            return {}
+
+    def render(self) -> list:
+        return [f"{self.name}{_format_labels(key)} {_format_value(v)}" for key, v in self._current().items()]
+
+    def digest(self) -> dict:
+        return {_digest_key(key, "value"): v for key, v in self._current().items()}
+
+
+class _Series:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if "outcome" not in self.labels:
+            if exc_type is None:
+                self.labels["outcome"] = "ok"
+            else:
+                self.labels["outcome"] = "cancelled" if exc_type is asyncio.CancelledError else "error"
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}    # ラベル -> _Series
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = _Series(len(self.buckets) + 1)
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def time(self, **labels) -> _Timer:
+        """with histogram.time(...): で囲んだ区間を計る（outcome=ok/error/cancelled を付ける）"""
+        return _Timer(self, labels)
+
+    def quantile(self, key: tuple, q: float) -> float:
+        """バケットの上限で近似した分位点"""
+        series = self.series[key]
+        target = q * series.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def render(self) -> list:
+        lines = []
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series.count}")
+        return lines
+
+    def digest(self) -> dict:
+        return {
+            _digest_key(key, "all"): {
+                "n": series.count,
+                "avg": round(series.sum / series.count, 4) if series.count else 0.0,
+                "p50": self.quantile(key, 0.50),
+                "p95": self.quantile(key, 0.95),
+            }
+            for key, series in self.series.items()
+        }
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, help, **kwargs)
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(Counter, name, help)
+
+    def histogram(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def gauge(self, name: str, help: str, fn=None) -> Gauge:
+        return self._get(Gauge, name, help, fn=fn)
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def digest(self) -> dict:
+        """ログ用：値の入っているものだけ"""
+        result = {}
+        for name, metric in self._metrics.items():
+            values = metric.digest()
+            if values:
+                result[name] = values
+        return result
+
+
+# プロセス全体で共有するレジストリ
+registry = Registry()
+counter = registry.counter
+histogram = registry.histogram
+gauge = registry.gauge
+
+
+class LoopLagMonitor:
+    """interval 秒ごとに起き、予定より何秒遅れて起きたか（イベントループの詰まり）を記録する"""
+
+    def __init__(self, interval: float = 0.5, registry: Registry = registry):
+        self.interval = interval
+        self.histogram = registry.histogram(
+            "event_loop_lag_seconds", "How late the event loop woke up a sleeping task",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+        )
+        self.max_lag = registry.gauge("event_loop_lag_max_seconds", "Largest loop lag since the last digest")
+        self._worst = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.histogram.observe(lag)
+            self._worst = max(self._worst, lag)
+            self.max_lag.set(self._worst)
+
+    def reset_max(self):
+        self._worst = 0.0
+
+
+async def start_http_server(port: int = METRICS_PORT, host: str = METRICS_HOST, registry: Registry = registry):
+    """GET /metrics で Prometheus のテキストを返す。port が 0 なら何もしない"""
+    if not port:
+        return None
+
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
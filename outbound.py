@@ -0,0 +1,156 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+import metrics
+import ratelimit
+
+# ---------------------
+# 送信キュー（チャンネルごと・優先度つき）
+# ---------------------
+# channel.send を直接呼ぶ代わりにここへ積む。チャンネルごとにワーカーが1本だけ動き、
+# send_message バケットでペースを守りながら優先度の高いものから送る。
+# メンションが殺到しても最終シーケンスの台詞が「・・・。」の後ろで待たされない。
+
+PRIORITY_SCRIPT = 0     # イベントの台詞（最優先）
+PRIORITY_REPLY = 1      # メンションへの直接の返信・まとめ
+PRIORITY_FILLER = 2     # 「・・・。」や自動会話など
+
+PRIORITY_NAMES = {PRIORITY_SCRIPT: "script", PRIORITY_REPLY: "reply", PRIORITY_FILLER: "filler"}
+
+QUEUE_WAIT_SECONDS = metrics.histogram("outbound_wait_seconds", "Time from enqueue to sent message by priority")
+COALESCED = metrics.counter("outbound_coalesced_total", "Filler messages merged into an identical pending send")
+
+
+class _Outgoing:
+    def __init__(self, channel, content, kwargs, priority):
+        self.channel = channel
+        self.content = content
+        self.kwargs = kwargs
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+        # 待ち手がキャンセルされていても例外が「未回収」扱いにならないように
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+class _WaitStats:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "avg_wait": self.total_wait / self.sent if self.sent else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class OutboundScheduler:
+    def __init__(self, buckets: ratelimit.RouteBuckets = None, coalesce_window: float = 3.0):
+        self.buckets = buckets or ratelimit.buckets
+        self.coalesce_window = coalesce_window
+        self._queues = {}         # channel_id -> [(priority, seq, _Outgoing)]
+        self._workers = {}        # channel_id -> Task
+        self._recent_filler = {}  # (channel_id, content) -> (送信予定/済みの時刻, future)
+        self._seq = itertools.count()
+        self._stats = {p: _WaitStats() for p in PRIORITY_NAMES}
+
+    async def send(self, channel, content: str = None, priority: int = PRIORITY_REPLY, **kwargs):
+        """
+        キューに積んで送信されるまで待ち、送った Message を返す。
+        filler は coalesce_window 秒以内に同じチャンネルへ同じ内容があれば1通にまとめる。
+        """
+        return await asyncio.shield(self.submit(channel, content, priority, **kwargs))
+
+    def submit(self, channel, content: str = None, priority: int = PRIORITY_REPLY, **kwargs) -> asyncio.Future:
+        """
+        キューに積むだけで待たない。送った Message（または例外）が入る future を返す。
+        ロックを持ったまま送信を待ちたくない呼び出し元用（まとめられた filler は同じ future）。
+        """
+        if priority == PRIORITY_FILLER and content is not None and not kwargs:
+            key = (channel.id, content)
+            recent = self._recent_filler.get(key)
+            now = time.monotonic()
+            if recent is not None and now - recent[0] < self.coalesce_window:
+                self._stats[priority].coalesced += 1
+                COALESCED.inc()
+                return recent[1]
+        item = _Outgoing(channel, content, kwargs, priority)
+        if priority == PRIORITY_FILLER and content is not None and not kwargs:
+            self._recent_filler[(channel.id, content)] = (item.enqueued_at, item.future)
+        queue = self._queues.setdefault(channel.id, [])
+        heapq.heappush(queue, (priority, next(self._seq), item))
+        worker = self._workers.get(channel.id)
+        if worker is None or worker.done():
+            self._workers[channel.id] = asyncio.get_running_loop().create_task(self._drain(channel.id))
+        return item.future
+
+    async def _drain(self, channel_id: int):
+        queue = self._queues[channel_id]
+        bucket = self.buckets.get("send_message", channel_id)
+        while queue:
+            _, _, item = heapq.heappop(queue)
+            if item.future.cancelled():
+                continue
+            stats = self._stats[item.priority]
+            try:
+                message = await ratelimit.call_with_retry(
+                    bucket, lambda: item.channel.send(item.content, **item.kwargs)
+                )
+            except Exception as e:
+                stats.failed += 1
+                if not item.future.done():
+                    item.future.set_exception(e)
+                continue
+            wait = time.monotonic() - item.enqueued_at
+            stats.sent += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            QUEUE_WAIT_SECONDS.observe(wait, priority=PRIORITY_NAMES[item.priority])
+            if not item.future.done():
+                item.future.set_result(message)
+        self._queues.pop(channel_id, None)
+        self._workers.pop(channel_id, None)
+        self._prune_filler()
+
+    def discard(self, futures) -> int:
+        """まだ送り始めていないものをキューから外してキャンセルする（送信中のものはそのまま届く）"""
+        targets = set(futures)
+        removed = 0
+        for queue in self._queues.values():
+            kept = [entry for entry in queue if entry[2].future not in targets]
+            if len(kept) == len(queue):
+                continue
+            for entry in queue:
+                if entry[2].future in targets:
+                    entry[2].future.cancel()
+                    removed += 1
+            queue[:] = kept
+            heapq.heapify(queue)
+        return removed
+
+    def _prune_filler(self):
+        now = time.monotonic()
+        for key, (sent_at, _) in list(self._recent_filler.items()):
+            if now - sent_at >= self.coalesce_window:
+                del self._recent_filler[key]
+
+    def depth(self, channel_id: int = None) -> int:
+        if channel_id is not None:
+            return len(self._queues.get(channel_id, ()))
+        return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "channels": len(self._queues),
+            **{PRIORITY_NAMES[p]: s.as_dict() for p, s in self._stats.items()},
+        }
@@ -0,0 +1,256 @@
+import asyncio
+
+import discord
+
+# ---------------------
+# オンライン人数（Bot除外）をイベントで差分更新するカウンター
+# ---------------------
+
+
+def is_counted(member) -> bool:
+    """Bot 以外で offline 以外（online/idle/dnd）なら数える"""
+    try:
+        return not member.bot and member.status != discord.Status.offline
+    except Exception:
+        # 一部のメンバーは presence が取れないことがある
+        return False
+
+
+class OnlineCounter:
+    """
+    ギルドごとにオンラインの非Botメンバーの ID を set で持つ。
+    presence/join/leave で差分更新するので count() は O(1)。
+    取りこぼし対策に reconcile() で時々全件スキャンして合わせる。
+    """
+
+    def __init__(self):
+        self._online = {}   # guild_id -> set(member_id)
+        self.drift = 0      # 直近の reconcile で見つかったズレ
+
+    def _set(self, guild_id: int) -> set:
+        s = self._online.get(guild_id)
+        if s is None:
+            s = self._online[guild_id] = set()
+        return s
+
+    def update(self, member):
+        online = self._set(member.guild.id)
+        if is_counted(member):
+            online.add(member.id)
+        else:
+            online.discard(member.id)
+
+    def remove(self, member):
+        self.remove_raw(member.guild.id, member.id)
+
+    def remove_raw(self, guild_id: int, member_id: int):
+        self._set(guild_id).discard(member_id)
+
+    def reconcile(self, guild) -> int:
+        """全件スキャンで作り直し、差分更新とのズレを返す"""
+        fresh = {m.id for m in guild.members if is_counted(m)}
+        old = self._online.get(guild.id, set())
+        self.drift = len(fresh ^ old)
+        self._online[guild.id] = fresh
+        return self.drift
+
+    def count(self, guild_id: int) -> int:
+        return len(self._online.get(guild_id, ()))
+
+    def stats(self) -> dict:
+        online = sum(len(s) for s in self._online.values())
+        return {"online": online, "tracked_ids": online, "drift": self.drift}
+
+
+class RawPresenceCounter(OnlineCounter):
+    """
+    メンバーキャッシュを持たないモード（MEMBER_CACHE=lean）用のカウンター。
+    Member オブジェクトの代わりに、Gateway の presence から ID・Bot かどうか・
+    オンラインかどうかだけを持つ。
+    presence には Bot フラグが入っていないので、初めて見た ID は pending に置いて
+    数えず、resolve() で Gateway にまとめて問い合わせてから数える。
+    """
+
+    def __init__(self, resolve_batch: int = 100, resolve_interval: float = 1.0):
+        super().__init__()
+        self.resolve_batch = resolve_batch          # 1回の問い合わせの ID 数（Discord の上限は100）
+        self.resolve_interval = resolve_interval    # 問い合わせの間隔（Gateway の送信制限よけ）
+        self._bots = {}         # guild_id -> set(member_id)
+        self._humans = {}       # guild_id -> set(member_id)
+        self._pending = {}      # guild_id -> set(オンラインだが Bot かどうか未確認の member_id)
+        self._resolving = {}    # guild_id -> Task
+        self.resolved = 0
+
+    @staticmethod
+    def _of(table: dict, guild_id: int) -> set:
+        s = table.get(guild_id)
+        if s is None:
+            s = table[guild_id] = set()
+        return s
+
+    def learn(self, guild_id: int, member_id: int, bot: bool):
+        """Bot かどうかが分かった ID を記録し、保留中なら数える側に回す"""
+        if bot:
+            self._of(self._bots, guild_id).add(member_id)
+            self._of(self._humans, guild_id).discard(member_id)
+            self._of(self._online, guild_id).discard(member_id)
+        else:
+            self._of(self._humans, guild_id).add(member_id)
+        pending = self._pending.get(guild_id)
+        if pending and member_id in pending:
+            pending.discard(member_id)
+            if not bot:
+                self._of(self._online, guild_id).add(member_id)
+
+    def update_raw(self, guild_id: int, member_id: int, status: str, bot: bool = None):
+        if bot is not None:
+            self.learn(guild_id, member_id, bot)
+        online = self._of(self._online, guild_id)
+        pending = self._of(self._pending, guild_id)
+        if status == "offline" or member_id in self._of(self._bots, guild_id):
+            online.discard(member_id)
+            pending.discard(member_id)
+        elif member_id in self._of(self._humans, guild_id):
+            online.add(member_id)
+        else:
+            pending.add(member_id)
+
+    def update(self, member):
+        self.update_raw(member.guild.id, member.id, str(member.status), member.bot)
+
+    def remove_raw(self, guild_id: int, member_id: int):
+        for table in (self._online, self._pending, self._humans, self._bots):
+            table.get(guild_id, set()).discard(member_id)
+
+    def load_guild(self, data: dict):
+        """GUILD_CREATE の生データから、最初のメンバー（一部）と presence を取り込む"""
+        if data.get("unavailable"):
+            return
+        guild_id = int(data["id"])
+        self._online[guild_id] = set()
+        self._pending[guild_id] = set()
+        for member in data.get("members", []):
+            user = member.get("user", {})
+            self.learn(guild_id, int(user["id"]), bool(user.get("bot", False)))
+        for presence in data.get("presences", []):
+            user = presence.get("user", {})
+            self.update_raw(guild_id, int(user["id"]), presence.get("status", "offline"), user.get("bot"))
+
+    def reconcile(self, guild) -> int:
+        # 全件のメンバーを持っていないので数え直しはできない（再接続時の GUILD_CREATE で作り直す）
+        return 0
+
+    def pending(self, guild_id: int) -> int:
+        return len(self._pending.get(guild_id, ()))
+
+    def schedule_resolve(self, guild):
+        """
+        保留中の ID があれば、まとめて問い合わせるタスクを（ギルドごとに1本だけ）走らせる。
+        走っているタスク（無ければ None）を返すので、終わりを待ちたいときはそれを待つ
+        """
+        task = self._resolving.get(guild.id)
+        if self.pending(guild.id) and (task is None or task.done()):
+            task = self._resolving[guild.id] = asyncio.get_running_loop().create_task(self.resolve(guild))
+        return task if task is not None and not task.done() else None
+
+    async def resolve(self, guild):
+        """保留中の ID を resolve_batch 件ずつ query_members で問い合わせて Bot かどうかを確定する"""
+        pending = self._pending.get(guild.id)
+        while pending:
+            batch = list(pending)[:self.resolve_batch]
+            try:
+                members = await guild.query_members(user_ids=batch, limit=len(batch), cache=False)
+            except Exception as e:
+                print(f"[メンバー問い合わせエラー] {guild.id}: {e}")
+                return
+            found = set()
+            for member in members:
+                found.add(member.id)
+                self.learn(guild.id, member.id, member.bot)
+            # 返ってこなかった ID はもうギルドにいない
+            for member_id in batch:
+                if member_id not in found:
+                    pending.discard(member_id)
+            self.resolved += len(batch)
+            if pending:
+                await asyncio.sleep(self.resolve_interval)
+
+    def stats(self) -> dict:
+        pending = sum(len(s) for s in self._pending.values())
+        humans = sum(len(s) for s in self._humans.values())
+        bots = sum(len(s) for s in self._bots.values())
+        return {
+            **super().stats(),
+            "tracked_ids": pending + humans + bots,
+            "pending": pending,
+            "known_humans": humans,
+            "known_bots": bots,
+            "resolved": self.resolved,
+        }
+
+
+class LeanPresenceMixin:
+    """
+    メンバーをキャッシュしない Client（discord.Client / AutoShardedClient に混ぜて使う）。
+    起動時のチャンクをやめ、GUILD_CREATE に入っている presence だけを counter に流す
+    （discord.py はキャッシュに無いメンバーの presence を捨てるので、パーサーの手前で拾う）。
+    以降の変化は on_raw_presence_update で受け取る。
+
+    discord.py の内部に依存している（requirements.txt で 2.5 以上 3 未満に固定）:
+    - Client(enable_raw_presences=...) は 2.5 から
+    - Client._get_state() が ConnectionState を作ること
+    - ConnectionState.parsers が Gateway のイベント名 -> parse_* の dict で、
+      "GUILD_CREATE" の parser が生の payload を受け取ること
+    上げるときはこの3点を確認すること。
+    """
+
+    def __init__(self, counter: RawPresenceCounter, **options):
+        self.presence_counter = counter
+        options.setdefault("chunk_guilds_at_startup", False)
+        options.setdefault("member_cache_flags", discord.MemberCacheFlags.none())
+        options.setdefault("enable_raw_presences", True)
+        super().__init__(**options)
+
+    def _get_state(self, **options):
+        state = super()._get_state(**options)
+        parse_guild_create = state.parsers["GUILD_CREATE"]
+
+        def parse_guild_create_with_presences(data):
+            try:
+                self.presence_counter.load_guild(data)
+            except Exception as e:
+                print(f"[presence取り込みエラー] {e}")
+            parse_guild_create(data)
+
+        state.parsers["GUILD_CREATE"] = parse_guild_create_with_presences
+        return state
+
+
+class LeanPresenceClient(LeanPresenceMixin, discord.Client):
+    pass
+
+
+class LeanShardedPresenceClient(LeanPresenceMixin, discord.AutoShardedClient):
+    pass
+
+
+class ThresholdTrigger:
+    """
+    count が threshold 以上になったら一度だけ発火する。
+    一度発火したら threshold - hysteresis 以下に下がるまで再発火しない
+    （閾値付近でオンライン人数がばたついても連続で発火しないように）。
+    """
+
+    def __init__(self, threshold: int, hysteresis: int = 2):
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.armed = True
+
+    def observe(self, count: int) -> bool:
+        """発火すべきなら True。実際に開始したら fired() を呼ぶこと"""
+        if count <= self.threshold - self.hysteresis:
+            self.armed = True
+        return self.armed and count >= self.threshold
+
+    def fired(self):
+        self.armed = False
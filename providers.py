@@ -0,0 +1,94 @@
+import asyncio
+import sys
+import threading
+import time
+
+_IMPORTED_AT = time.perf_counter()    # main.py が最初に import するので、ほぼプロセスの起動時刻
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+# ---------------------
+# 外部サービスのクライアントを初回利用時に作る
+# ---------------------
+# google.generativeai や openai は import だけで重く、キーが無い・機能を使わない
+# ときまで起動時に読み込む必要はない。LazyProvider は factory を最初に必要になった
+# ときに1回だけ呼び（import もその中で行う）、以降は同じものを返す。
+
+
+class LazyProvider:
+    def __init__(self, name: str, factory, enabled: bool = True):
+        self.name = name
+        self.factory = factory      # () -> クライアント（重い import はこの中で）
+        self.enabled = enabled      # False（キー未設定など）なら get() は常に None
+        self.load_seconds = None
+        self._value = None
+        self._loaded = False
+        self._thread_lock = threading.Lock()
+        self._async_lock = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self):
+        """同期版。イベントループの外（to_thread の中など）から使う"""
+        if not self.enabled:
+            return None
+        if not self._loaded:
+            with self._thread_lock:
+                if not self._loaded:
+                    started = time.perf_counter()
+                    self._value = self.factory()
+                    self.load_seconds = time.perf_counter() - started
+                    self._loaded = True
+                    print(f"[遅延初期化] {self.name} {self.load_seconds * 1000:.0f}ms")
+        return self._value
+
+    async def aget(self):
+        """非同期版。初回の import と生成はスレッドで行い、イベントループを止めない"""
+        if not self.enabled:
+            return None
+        if self._loaded:
+            return self._value
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            if not self._loaded:
+                await asyncio.to_thread(self.get)
+        return self._value
+
+    def set(self, value):
+        """作ったものを直接差し込む（ベンチマークのスタブなど）"""
+        with self._thread_lock:
+            self._value = value
+            self._loaded = True
+            self.enabled = True
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "loaded": self._loaded, "load_seconds": self.load_seconds}
+
+
+def max_rss_mb() -> float:
+    """これまでの最大常駐メモリ（MB）。取れない環境では 0"""
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class StartupTimer:
+    """起動の各段階（import 完了・モジュール初期化完了・ready）までの経過時間を記録する"""
+
+    def __init__(self, started: float = None):
+        self.started = _IMPORTED_AT if started is None else started
+        self.marks = []     # (名前, 経過秒, 最大RSS MB)
+
+    def mark(self, name: str):
+        self.marks.append((name, time.perf_counter() - self.started, max_rss_mb()))
+
+    def report(self) -> str:
+        return " ".join(f"{name}={elapsed * 1000:.0f}ms(rss={rss:.0f}MB)" for name, elapsed, rss in self.marks)
@@ -0,0 +1,138 @@
+import asyncio
+import time
+
+import metrics
+
+# ---------------------
+# Discord の per-route レートリミットに合わせたトークンバケット
+# ---------------------
+# (1秒あたりの補充数, バースト上限) のおおよその値。
+# Discord 側の正確な値はレスポンスヘッダで変わるので、429 が来たら penalize() で合わせる。
+ROUTE_LIMITS = {
+    "send_message": (5 / 5, 5),
+    "edit_message": (5 / 5, 5),
+    "delete_message": (5 / 1, 5),
+    "bulk_delete": (1 / 1, 1),
+}
+DEFAULT_LIMIT = (1.0, 1)
+
+REST_SECONDS = metrics.histogram("discord_rest_seconds", "Discord REST call latency by route")
+BUCKET_WAIT_SECONDS = metrics.histogram("ratelimit_wait_seconds", "Time spent waiting for a local token bucket")
+RATE_LIMITED = metrics.counter("discord_rate_limited_total", "429 responses from Discord by route")
+
+
+class TokenBucket:
+    """
+    rate 個/秒で補充され、最大 capacity 個まで貯まるトークンバケット。
+    try_acquire は待たずに判定、acquire は取れるまで待つ。
+    """
+
+    def __init__(self, rate: float, capacity: float, route: str = ""):
+        self.rate = rate
+        self.capacity = capacity
+        self.route = route
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def delay_for(self, n: float = 1) -> float:
+        """n 個取れるまでの待ち秒数（0 なら今すぐ取れる）"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < n:
+            wait = max(wait, (n - self.tokens) / self.rate)
+        return wait
+
+    def try_acquire(self, n: float = 1) -> bool:
+        if self.delay_for(n) > 0:
+            return False
+        self.tokens -= n
+        return True
+
+    async def acquire(self, n: float = 1):
+        # 待ち行列の順番を守るためロックの中で待つ
+        async with self._lock:
+            while True:
+                wait = self.delay_for(n)
+                if wait <= 0:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep(wait)
+
+    def penalize(self, retry_after: float):
+        """429 の Retry-After 分だけバケットを止める"""
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+class RouteBuckets:
+    """
+    (route, major_id) ごとの TokenBucket を持つ。
+    major_id は Discord と同じくチャンネルID単位。
+    """
+
+    def __init__(self, limits: dict = None):
+        self.limits = dict(ROUTE_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self._buckets = {}
+
+    def get(self, route: str, major_id: int) -> TokenBucket:
+        key = (route, major_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate, capacity = self.limits.get(route, DEFAULT_LIMIT)
+            bucket = self._buckets[key] = TokenBucket(rate, capacity, route)
+        return bucket
+
+    async def acquire(self, route: str, major_id: int):
+        await self.get(route, major_id).acquire()
+
+
+def retry_after_from(exc) -> float:
+    """
+    429 系の例外から待ち秒数を取り出す。取れなければ None。
+    discord.RateLimited は retry_after、HTTPException はレスポンスヘッダを見る。
+    """
+    retry_after = getattr(exc, "retry_after", None)
+    if retry_after is not None:
+        return float(retry_after)
+    if getattr(exc, "status", None) != 429:
+        return None
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After", 1.0))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+async def call_with_retry(bucket: TokenBucket, call, max_retries: int = 3, on_retry=None):
+    """バケットに従って call() を実行し、429 のときはサーバー指定の秒数待って再試行"""
+    for attempt in range(max_retries):
+        with BUCKET_WAIT_SECONDS.time(route=bucket.route, outcome="ok"):
+            await bucket.acquire()
+        try:
+            with REST_SECONDS.time(route=bucket.route):
+                return await call()
+        except Exception as e:
+            retry_after = retry_after_from(e)
+            if retry_after is not None:
+                RATE_LIMITED.inc(route=bucket.route)
+            if retry_after is None or attempt == max_retries - 1:
+                raise
+            bucket.penalize(retry_after)
+            if on_retry is not None:
+                on_retry()
+
+
+# プロセス全体で共有するバケット
+buckets = RouteBuckets()
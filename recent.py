@@ -0,0 +1,69 @@
+from collections import OrderedDict
+
+# ---------------------
+# チャンネルごとの直近の発言（自動会話のプロンプト用）
+# ---------------------
+# 自動会話のたびに channel.history() を叩く代わりに、on_message で受け取った
+# 人間の発言をチャンネルごとに最大 per_channel 件だけ手元に持っておく。
+# 編集・削除は raw イベントで反映する（キャッシュに無い古いメッセージでも届く）。
+
+
+class RecentMessages:
+    """
+    channel_id -> OrderedDict(message_id -> (表示名, 本文))。
+    1チャンネルあたり per_channel 件・1件あたり max_chars 文字までに抑え、
+    max_channels を超えたら一番長く発言の無いチャンネルから捨てる。
+    """
+
+    def __init__(self, per_channel: int = 10, max_channels: int = 500, max_chars: int = 500):
+        self.per_channel = per_channel
+        self.max_channels = max_channels
+        self.max_chars = max_chars
+        self._channels = OrderedDict()
+
+    def add(self, message):
+        content = (message.content or "").strip()
+        if message.author.bot or not content:
+            return
+        buffer = self._channels.get(message.channel.id)
+        if buffer is None:
+            buffer = self._channels[message.channel.id] = OrderedDict()
+            while len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+        else:
+            self._channels.move_to_end(message.channel.id)
+        buffer[message.id] = (message.author.display_name, content[:self.max_chars])
+        while len(buffer) > self.per_channel:
+            buffer.popitem(last=False)
+
+    def edit(self, channel_id: int, message_id: int, content: str):
+        """持っている発言だけ本文を差し替える（空になったら消す）"""
+        buffer = self._channels.get(channel_id)
+        if buffer is None or message_id not in buffer:
+            return
+        content = (content or "").strip()
+        if not content:
+            del buffer[message_id]
+            return
+        name, _ = buffer[message_id]
+        buffer[message_id] = (name, content[:self.max_chars])
+
+    def delete(self, channel_id: int, message_ids):
+        buffer = self._channels.get(channel_id)
+        if buffer is None:
+            return
+        for message_id in message_ids:
+            buffer.pop(message_id, None)
+
+    def lines(self, channel_id: int) -> list:
+        """古い順の "表示名: 本文" のリスト"""
+        buffer = self._channels.get(channel_id)
+        if not buffer:
+            return []
+        return [f"{name}: {content}" for name, content in buffer.values()]
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._channels),
+            "messages": sum(len(b) for b in self._channels.values()),
+        }
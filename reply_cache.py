@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from cache import TTLCache
+from textutil import normalize_question
+
+# ---------------------
+# メンション質問の返信キャッシュ
+# ---------------------
+# 同じ質問（言い回しの揺れはならす）には、数分前の検索 + LLM の結果をそのまま返す。
+# キーは (プロンプトの版, バックエンド名, 会話の文脈, 正規化した質問)。system_instruction を
+# 書き換えれば版が変わるので、古い口調の返信は自然に使われなくなる。
+# 返信はチャンネル（ユーザー）ごとの会話履歴にも左右されるので、要約と履歴のハッシュも
+# キーに入れる。履歴が空なら文脈は "" になり、どのチャンネルの最初の質問とも使い回せる。
+# path を渡すと JSON に書き出して再起動後も引き継ぐ。
+# shared（SharedStore）を渡すと、手元に無いときはそこを見て、入れるときはそこにも書く
+# （シャードを分けた別のワーカーと返信を使い回す。JSON の代わりの永続化も兼ねる）。
+# 共有ストアは SQLite なので、読むのは alookup() からスレッドで、書くのは裏のタスクで。
+
+REPLY_CACHE_PATH = os.getenv("REPLY_CACHE_PATH", os.path.join("data", "reply_cache.json"))
+
+
+def prompt_version(system_prompt: str) -> str:
+    return hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:8]
+
+
+def context_fingerprint(summary: str, history: list) -> str:
+    """会話の要約と履歴のハッシュ（どちらも空なら ""）"""
+    if not summary and not history:
+        return ""
+    text = json.dumps([summary, history], ensure_ascii=False)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class ReplyCache:
+    def __init__(self, version: str, maxsize: int = 500, ttl: float = 1800.0,
+                 path: str = None, save_interval: float = 30.0, shared=None, context=None):
+        self.version = version
+        self.context = context      # context_key -> 文脈の文字列（context_fingerprint）。None なら文脈を見ない
+        self.path = path
+        self.ttl = ttl
+        self.shared = shared
+        self.shared_hits = 0
+        self._shared_writes = set()
+        self.save_interval = save_interval
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)   # key -> (返信, かかった秒数)
+        self.bypassed = 0
+        self.stored = 0
+        self.saved_seconds = 0.0
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        if path:
+            self._load()
+
+    def _key(self, backend: str, query: str, context_key=None) -> tuple:
+        context = self.context(context_key) if self.context is not None and context_key is not None else ""
+        return (self.version, backend, context, normalize_question(query))
+
+    @staticmethod
+    def _shared_key(key: tuple) -> str:
+        return "reply:" + json.dumps(key, ensure_ascii=False)
+
+    def _lookup_local(self, keys: list):
+        for key in keys:
+            if key in self._cache:
+                reply, latency = self._cache.get(key)
+                self.saved_seconds += latency
+                return reply
+        return None
+
+    async def _lookup_shared(self, keys: list):
+        for key in keys:
+            try:
+                found = await self.shared.call(self.shared.cache_get, self._shared_key(key))
+            except Exception as e:
+                print(f"[返信キャッシュ共有エラー] {e}")
+                return None
+            if found is not None:
+                (reply, latency), remaining = found
+                self._cache.set(key, (reply, latency), ttl=remaining)
+                self.shared_hits += 1
+                self.saved_seconds += latency
+                return reply
+        return None
+
+    async def alookup(self, query: str, backends: list, bypass: bool = False, context_key=None):
+        """
+        backends の順に手元のキャッシュを探し、最初に見つかった返信を返す（無ければ None）。
+        手元に無ければ共有ストアも（スレッドで）見る
+        """
+        if bypass:
+            self.bypassed += 1
+            return None
+        keys = [self._key(b, query, context_key) for b in backends]
+        reply = self._lookup_local(keys)
+        if reply is None and self.shared is not None:
+            reply = await self._lookup_shared(keys)
+        if reply is None:
+            self._cache.misses += 1
+        return reply
+
+    def store(self, backend: str, query: str, reply: str, latency: float, context_key=None):
+        self._store_key(self._key(backend, query, context_key), reply, latency)
+
+    def _store_key(self, key: tuple, reply: str, latency: float):
+        if not reply:
+            return
+        self._cache.set(key, (reply, latency))
+        self.stored += 1
+        if self.shared is not None:
+            task = asyncio.get_running_loop().create_task(self._store_shared(key, reply, latency))
+            self._shared_writes.add(task)
+            task.add_done_callback(self._shared_writes.discard)
+        self._dirty = True
+        if self.path and time.monotonic() - self._saved_at >= self.save_interval:
+            try:
+                self.save()
+            except OSError as e:
+                print(f"[返信キャッシュ保存エラー] {e}")
+
+    async def _store_shared(self, key: tuple, reply: str, latency: float):
+        try:
+            await self.shared.call(self.shared.cache_set, self._shared_key(key), [reply, latency], self.ttl)
+        except Exception as e:
+            print(f"[返信キャッシュ共有エラー] {e}")
+
+    def wrap(self, backend: str, call):
+        """async def call(query, **kwargs) -> str の結果をキャッシュに入れるラッパー"""
+        async def cached_call(query, **kwargs):
+            started = time.monotonic()
+            # 文脈は呼び出し前の履歴で決める（lookup と同じ時点。返信後に履歴へ積まれる）
+            key = self._key(backend, query, kwargs.get("context_key"))
+            reply = await call(query, **kwargs)
+            self._store_key(key, reply, time.monotonic() - started)
+            return reply
+        return cached_call
+
+    def wrap_stream(self, backend: str, stream):
+        """ストリーミング版。最後まで受け取れたときだけ全文をキャッシュに入れる"""
+        async def cached_stream(query, **kwargs):
+            started = time.monotonic()
+            key = self._key(backend, query, kwargs.get("context_key"))
+            parts = []
+            async for delta in stream(query, **kwargs):
+                parts.append(delta)
+                yield delta
+            self._store_key(key, "".join(parts).strip(), time.monotonic() - started)
+        return cached_stream
+
+    # --- 永続化 ---
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[返信キャッシュ読込エラー] {e}")
+            return
+        now = time.time()
+        for entry in data.get("entries", []):
+            if len(entry) != 7:
+                continue    # 文脈をキーに入れる前の形式は読まない
+            version, backend, context, question, reply, latency, expires_at = entry
+            if version == self.version and expires_at > now:
+                self._cache.set((version, backend, context, question), (reply, latency), ttl=expires_at - now)
+
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+        now = time.time()
+        entries = [
+            [*key, reply, latency, now + remaining]
+            for key, (reply, latency), remaining in self._cache.items()
+        ]
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def stats(self) -> dict:
+        cache_stats = self._cache.stats()
+        # TTLCache は手元のヒットしか数えないので、共有ストアからのヒットも足した率にする
+        hits = cache_stats["hits"] + self.shared_hits
+        total = hits + cache_stats["misses"]
+        return {
+            **cache_stats,
+            "hits": hits,
+            "local_hits": cache_stats["hits"],
+            "hit_rate": hits / total if total else 0.0,
+            "stored": self.stored,
+            "bypassed": self.bypassed,
+            "shared_hits": self.shared_hits,
+            "saved_seconds": self.saved_seconds,
+        }
@@ -0,0 +1,143 @@
+import json
+import os
+import time
+
+from textutil import normalize_text, original_span
+
+# ---------------------
+# 謎解きシナリオ（scenario.json）とキーワード照合
+# ---------------------
+# 段階ごとのトリガー語と返信をファイルから読み、全部まとめて1つの
+# Aho-Corasick オートマトンにする。メンション1件につき本文を1回なめるだけで
+# グループ（names / stage3 / answer）ごとに一番優先度の高い一致が分かる。
+
+SCENARIO_PATH = os.getenv("SCENARIO_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenario.json"))
+
+
+class KeywordAutomaton:
+    """
+    (keyword, group, priority, payload) をまとめた Aho-Corasick。
+    match() はグループごとに priority が最大の payload を返す。
+    match_spans() は正規化した本文のどこに当たったか (payload, 開始, 終了) も返す。
+    """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._patterns = []
+        for keyword, group, priority, payload in patterns:
+            keyword = normalize_text(keyword, fold_kana=True)
+            if not keyword:
+                continue
+            index = len(self._patterns)
+            self._patterns.append((group, priority, payload, len(keyword)))
+            node = 0
+            for ch in keyword:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(index)
+        self._build_fail_links()
+
+    def _build_fail_links(self):
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def match_spans(self, text: str) -> dict:
+        best = {}   # group -> (priority, payload, 開始, 終了)
+        node = 0
+        goto = self._goto
+        fail = self._fail
+        for position, ch in enumerate(normalize_text(text, fold_kana=True)):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for index in self._out[node]:
+                group, priority, payload, length = self._patterns[index]
+                current = best.get(group)
+                if current is None or priority > current[0]:
+                    best[group] = (priority, payload, position + 1 - length, position + 1)
+        return {group: (payload, start, end) for group, (_, payload, start, end) in best.items()}
+
+    def match(self, text: str) -> dict:
+        return {group: payload for group, (payload, _, _) in self.match_spans(text).items()}
+
+
+class Scenario:
+    def __init__(self, data: dict):
+        self.version = data.get("version", 1)
+        self.cipher = data["cipher"]
+        self.script = data["script"]
+        self.names = data["names"]
+        self.stage3 = data["stage3"]
+        patterns = []
+        # 名前はリストの先に書いたものを優先
+        for i, name in enumerate(self.names):
+            patterns.append((name, "names", -i, name))
+        for trigger in self.stage3:
+            for keyword in trigger["keywords"]:
+                patterns.append((keyword, "stage3", trigger["priority"], trigger["reply"]))
+        patterns.append((self.cipher["answer"], "answer", 0, True))
+        self.automaton = KeywordAutomaton(patterns)
+
+    def text(self, key: str, **kwargs) -> str:
+        return self.script[key].format(**kwargs) if kwargs else self.script[key]
+
+    def match(self, text: str) -> dict:
+        """
+        {"names": 名前, "stage3": 返信, "answer": True} のうち一致したものだけ入った dict。
+        名前はかなを揃えて照合するので、返すのはリストの表記ではなく本文に書かれていた表記
+        （「チルです」なら「チル」。リストでは「ちる」が先でも）
+        """
+        found = self.automaton.match_spans(text)
+        result = {group: payload for group, (payload, _, _) in found.items()}
+        if "names" in found:
+            _, start, end = found["names"]
+            result["names"] = original_span(text, start, end)
+        return result
+
+
+def load_scenario(path: str = SCENARIO_PATH) -> Scenario:
+    with open(path, encoding="utf-8") as f:
+        return Scenario(json.load(f))
+
+
+class ScenarioStore:
+    """
+    シナリオのホットリロード。get() のたびに（check_interval 秒に1回まで）
+    ファイルの更新時刻を見て、変わっていれば読み直す。読めなければ前のものを使い続ける。
+    """
+
+    def __init__(self, path: str = SCENARIO_PATH, check_interval: float = 2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = os.stat(path).st_mtime
+        self._scenario = load_scenario(path)
+        self._checked_at = time.monotonic()
+
+    def get(self) -> Scenario:
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if mtime != self._mtime:
+                    self._scenario = load_scenario(self.path)
+                    self._mtime = mtime
+                    print(f"[シナリオ再読込] {self.path}")
+            except Exception as e:
+                print(f"[シナリオ読込エラー] {e}")
+        return self._scenario
@@ -0,0 +1,122 @@
+import asyncio
+import heapq
+import itertools
+
+# ---------------------
+# イベント用のタイマー（ヒープ1本 + 実行タスク1本）
+# ---------------------
+# asyncio.create_task + sleep を投げっぱなしにする代わりに、
+# 予定をヒープで持ってキャンセル・世代ごとの一括破棄・一覧表示をできるようにする。
+# ループ時間で動くので Gateway の再接続とは無関係に生き残る。
+
+
+class TimerHandle:
+    def __init__(self, scheduler, when: float, callback, args: tuple, name: str, generation):
+        self._scheduler = scheduler
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.name = name
+        self.generation = generation
+        self.cancelled = False
+        self.task = None          # 発火後の実行タスク
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self.task is None:
+            self._scheduler._on_cancel()
+        elif not self.task.done() and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+
+class TimerScheduler:
+    def __init__(self):
+        self._heap = []                   # (when, seq, handle)
+        self._seq = itertools.count()
+        self._cancelled = 0
+        self._running = set()             # 発火して実行中のハンドル
+        self._wakeup = None
+        self._runner = None
+
+    def _loop_time(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def _ensure_runner(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.get_running_loop().create_task(self._run())
+
+    def call_later(self, delay: float, callback, *args, name: str = "", generation=None) -> TimerHandle:
+        """delay 秒後に await callback(*args) を実行する"""
+        handle = TimerHandle(self, self._loop_time() + delay, callback, args, name or callback.__name__, generation)
+        heapq.heappush(self._heap, (handle.when, next(self._seq), handle))
+        self._ensure_runner()
+        self._wakeup.set()
+        return handle
+
+    def cancel_generation(self, generation) -> int:
+        """その世代の予定と実行中タスクをまとめてキャンセル（呼び出し元自身は除く）"""
+        count = 0
+        for _, _, handle in self._heap:
+            if handle.generation == generation and not handle.cancelled:
+                handle.cancel()
+                count += 1
+        for handle in list(self._running):
+            if handle.generation == generation and not handle.cancelled:
+                handle.cancel()
+                count += 1
+        return count
+
+    def _on_cancel(self):
+        # キャンセル済みがヒープの半分を超えたら作り直して O(有効なタイマー数) に保つ
+        self._cancelled += 1
+        if self._cancelled > len(self._heap) // 2:
+            self._heap = [item for item in self._heap if not item[2].cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+
+    def _fire(self, handle: TimerHandle):
+        async def runner():
+            try:
+                await handle.callback(*handle.args)
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print(f"[タイマーエラー] {handle.name}: {e}")
+            finally:
+                self._running.discard(handle)
+        handle.task = asyncio.get_running_loop().create_task(runner())
+        self._running.add(handle)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = self._loop_time()
+            while self._heap and (self._heap[0][2].cancelled or self._heap[0][0] <= now):
+                _, _, handle = heapq.heappop(self._heap)
+                if handle.cancelled:
+                    self._cancelled = max(0, self._cancelled - 1)
+                    continue
+                self._fire(handle)
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def pending(self) -> int:
+        return len(self._heap) - self._cancelled
+
+    def dump(self) -> list:
+        """デバッグ用：待機中・実行中のタイマー一覧"""
+        now = self._loop_time()
+        lines = []
+        for when, _, handle in sorted(self._heap):
+            if not handle.cancelled:
+                lines.append(f"pending {handle.name} gen={handle.generation} in {when - now:.1f}s")
+        for handle in self._running:
+            lines.append(f"running {handle.name} gen={handle.generation}")
+        return lines
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import time
+
+import aiohttp
+
+import metrics
+from cache import TTLCache
+from textutil import normalize_text
+
+# ---------------------
+# SerpAPI 検索（非同期・コネクションプール・キャッシュ付き）
+# ---------------------
+# SERPAPI_URL を差し替えればローカルのスタブサーバーにも向けられる
+SERPAPI_URL = os.getenv("SERPAPI_URL", "https://serpapi.com/search")
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "600"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "256"))
+
+NOT_FOUND_TEXT = "検索結果が見つからなかったかな…"
+ERROR_TEXT = "検索サービスに接続できなかったかな…"
+
+SEARCH_SECONDS = metrics.histogram("search_request_seconds", "SerpAPI search latency by outcome")
+
+
+def extract_answer(data: dict) -> str:
+    if "answer_box" in data and "answer" in data["answer_box"]:
+        return data["answer_box"]["answer"]
+    elif "organic_results" in data and data["organic_results"]:
+        return data["organic_results"][0].get("snippet", NOT_FOUND_TEXT)
+    else:
+        return NOT_FOUND_TEXT
+
+
+class SearchClient:
+    """
+    keep-alive の aiohttp セッションを使い回す SerpAPI クライアント。
+    - (正規化クエリ, hl, gl) をキーに LRU+TTL キャッシュ
+    - 同じクエリが同時に来たら上流へのリクエストは1本にまとめる
+    """
+
+    def __init__(self, api_key: str, base_url: str = SERPAPI_URL, timeout: float = 5.0,
+                 pool_size: int = 8, cache: TTLCache = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.cache = cache if cache is not None else TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self._session = None
+        self._inflight = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # セッションはイベントループの中で作る必要があるので初回利用時に生成
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _fetch(self, query: str, hl: str, gl: str) -> str:
+        params = {
+            "q": query,
+            "hl": hl,
+            "gl": gl,
+            "api_key": self.api_key
+        }
+        self.upstream_calls += 1
+        async with self._get_session().get(self.base_url, params=params) as res:
+            res.raise_for_status()
+            data = await res.json(content_type=None)
+        return extract_answer(data)
+
+    async def search(self, query: str, hl: str = "ja", gl: str = "jp") -> str:
+        started = time.monotonic()
+        key = (normalize_text(query), hl, gl)
+        cached = self.cache.get(key)
+        if cached is not None:
+            SEARCH_SECONDS.observe(time.monotonic() - started, outcome="cache_hit")
+            return cached
+
+        task = self._inflight.get(key)
+        outcome = "upstream"
+        if task is not None:
+            self.coalesced += 1
+            outcome = "coalesced"
+        else:
+            task = asyncio.ensure_future(self._fetch(query, hl, gl))
+            self._inflight[key] = task
+
+            def _done(t, key=key):
+                self._inflight.pop(key, None)
+                if not t.cancelled() and t.exception() is None:
+                    self.cache.set(key, t.result())
+            task.add_done_callback(_done)
+
+        try:
+            # 待っている側がキャンセルされても他の待ち手のために上流は止めない
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = "error"
+            print(f"[SerpAPIエラー] {e}")
+            return ERROR_TEXT
+        finally:
+            SEARCH_SECONDS.observe(time.monotonic() - started, outcome=outcome)
+
+    def stats(self) -> dict:
+        return {
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            **self.cache.stats(),
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
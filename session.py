@@ -0,0 +1,158 @@
+import asyncio
+import os
+import time
+
+from journal import MessageJournal
+
+# ---------------------
+# 謎解きイベントのセッション（ギルド・チャンネルごと）
+# ---------------------
+# 以前はモジュールのグローバル変数で1プロセス1イベントだったものを、
+# (guild_id, channel_id) ごとの EventSession に分けたもの。
+# 状態を触るときは session.lock を取る。
+# store（SharedStore）を渡すと、ギルドのイベントの占有とクールダウンをそこに置き、
+# シャードを分けた別プロセスとも「1ギルド1イベント」を守る。
+
+EVENT_JOURNAL_DIR = os.getenv("EVENT_JOURNAL_DIR", os.path.join("data", "journals"))
+EVENT_LEASE_SECONDS = 2 * 3600     # イベント（1時間）+ 後片付けより十分長く。落ちたワーカーのリースはこれで切れる
+COOLDOWN_REFRESH_SECONDS = 30.0    # 手元のクールダウンを共有ストアから読み直す間隔
+
+
+class EventSession:
+    def __init__(self, guild_id: int, channel_id: int, journal: MessageJournal):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.active = False         # 謎解き全体のオン/オフ
+        self.stage = 0              # 0=待機 1=問いかけ済→待メンション 2=名前受付→待指定名 3=モニター段階 4=最終 5=睡眠
+        self.start_ts = 0           # イベント開始時のループ時間 (asyncio loop time)
+        self.end_ts = 0             # イベント終了予定時刻（開始 + 3600）
+        self.generation = 0         # イベントごとに増える世代番号（古いタイマーの発火防止）
+        self.finalizing = False     # 削除処理中（二重実行防止）
+        self.journal = journal      # イベント中の投稿の (channel_id, message_id, 種別)
+        self.pending_sends = set()  # 送信キューに積んだがまだ届いていない返信の future
+        self.lock = asyncio.Lock()
+
+    @property
+    def key(self) -> tuple:
+        return (self.guild_id, self.channel_id)
+
+    @property
+    def timer_generation(self) -> tuple:
+        """タイマーに付ける世代トークン（セッションをまたいで衝突しないようにキーを含める）"""
+        return (self.guild_id, self.channel_id, self.generation)
+
+    def is_current(self, generation) -> bool:
+        """タイマーが前のイベントに向けて発火しないよう、世代が今のイベントと同じか確認する"""
+        return self.active and not self.finalizing and generation == self.generation
+
+    def __repr__(self):
+        return f"<EventSession {self.guild_id}/{self.channel_id} active={self.active} stage={self.stage}>"
+
+
+class SessionRegistry:
+    """
+    (guild_id, channel_id) -> EventSession。
+    1つのギルドで同時に動くイベントは1つまで（クールダウンもギルド単位）。
+    """
+
+    def __init__(self, journal_dir: str = EVENT_JOURNAL_DIR, store=None):
+        self.journal_dir = journal_dir
+        self.store = store
+        self._sessions = {}
+        self._cooldown_until = {}   # guild_id -> オンラインカウント再開時刻（time.time()）。store があればその写し
+        self._cooldown_checked = {} # guild_id -> 写しを読み直した時刻（monotonic）
+        self._cooldown_refreshing = set()
+        os.makedirs(journal_dir, exist_ok=True)
+
+    def _journal_path(self, guild_id: int, channel_id: int) -> str:
+        return os.path.join(self.journal_dir, f"{guild_id}_{channel_id}.bin")
+
+    def get(self, guild_id: int, channel_id: int, create: bool = True) -> EventSession:
+        key = (guild_id, channel_id)
+        session = self._sessions.get(key)
+        if session is None and create:
+            journal = MessageJournal(self._journal_path(guild_id, channel_id))
+            session = self._sessions[key] = EventSession(guild_id, channel_id, journal)
+        return session
+
+    def for_channel(self, channel, create: bool = True) -> EventSession:
+        guild = getattr(channel, "guild", None)
+        return self.get(guild.id if guild else 0, channel.id, create)
+
+    def active_in_guild(self, guild_id: int) -> EventSession:
+        for session in self._sessions.values():
+            if session.guild_id == guild_id and session.active:
+                return session
+        return None
+
+    def active_sessions(self) -> list:
+        return [s for s in self._sessions.values() if s.active]
+
+    # --- プロセスをまたぐ占有とクールダウン ---
+    # 共有ストア（SQLite）はほかのワーカーの書き込み待ちで止まりうるので、すべてスレッドで呼ぶ
+    async def claim(self, guild_id: int) -> bool:
+        """このギルドのイベントを始めてよいか（他のワーカーが動かしていなければ占有する）"""
+        if self.store is None:
+            return True
+        return await self.store.call(self.store.acquire, f"event:{guild_id}", EVENT_LEASE_SECONDS)
+
+    async def release(self, guild_id: int):
+        if self.store is not None:
+            await self.store.call(self.store.release, f"event:{guild_id}")
+
+    async def holder(self, guild_id: int):
+        if self.store is None:
+            return None
+        return await self.store.call(self.store.holder, f"event:{guild_id}")
+
+    async def start_cooldown(self, guild_id: int, seconds: float):
+        until = time.time() + seconds
+        self._cooldown_until[guild_id] = until
+        self._cooldown_checked[guild_id] = time.monotonic()
+        if self.store is not None:
+            await self.store.call(self.store.set_cooldown, guild_id, until)
+
+    def in_cooldown(self, guild_id: int) -> bool:
+        """
+        presence 更新のたびに呼ばれるので手元の写しだけを見る。写しが古ければ
+        裏で読み直しを始める（結果は次の呼び出しから効く）。確実に知りたいときは cooldown_active()
+        """
+        if self.store is not None and time.monotonic() - self._cooldown_checked.get(guild_id, float("-inf")) >= COOLDOWN_REFRESH_SECONDS:
+            if guild_id not in self._cooldown_refreshing:
+                self._cooldown_refreshing.add(guild_id)
+                asyncio.get_running_loop().create_task(self._refresh_cooldown(guild_id))
+        return time.time() < self._cooldown_until.get(guild_id, 0)
+
+    async def _refresh_cooldown(self, guild_id: int):
+        try:
+            self._cooldown_until[guild_id] = await self.store.call(self.store.cooldown_until, guild_id)
+            self._cooldown_checked[guild_id] = time.monotonic()
+        except Exception as e:
+            print(f"[クールダウン読込エラー] {e}")
+        finally:
+            self._cooldown_refreshing.discard(guild_id)
+
+    async def cooldown_active(self, guild_id: int) -> bool:
+        """共有ストアまで見て判定する（イベントを始める直前など、回数の少ないところ用）"""
+        if self.store is not None:
+            await self._refresh_cooldown(guild_id)
+        return time.time() < self._cooldown_until.get(guild_id, 0)
+
+    def load_leftovers(self, owns=None) -> list:
+        """
+        前回プロセスのジャーナルが残っているセッション（落ちたときの後片付け用）。
+        owns(guild_id) を渡すと、このワーカーが受け持つギルドの分だけを返す
+        （別のワーカーが実行中のイベントのジャーナルには触らない）。
+        """
+        leftovers = []
+        for name in os.listdir(self.journal_dir):
+            stem, ext = os.path.splitext(name)
+            if ext != ".bin" or "_" not in stem:
+                continue
+            guild_id, channel_id = (int(x) for x in stem.split("_", 1))
+            if owns is not None and not owns(guild_id):
+                continue
+            session = self.get(guild_id, channel_id)
+            if len(session.journal) and not session.active:
+                leftovers.append(session)
+        return leftovers
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# ---------------------
+# ワーカープロセス間で共有する状態（SQLite・WAL）
+# ---------------------
+# シャードを複数プロセスに分けると、プロセス内の dict やロックでは
+# 「1ギルドにイベントは1つまで」を守れない。イベントのリース・クールダウン・
+# 返信キャッシュだけをここに置き、同じマシンのワーカーで1つのファイルを共有する。
+# どれも1文で完結する書き込みなので、明示的なトランザクションは張らない。
+# 時刻はプロセスをまたぐので、ループ時間ではなく time.time() で持つ。
+# 書き込みはほかのワーカーのロック待ちで最大 busy_timeout 秒止まりうるので、
+# イベントループからは call() でスレッドに逃がして呼ぶ（メソッド自体は同期のまま）。
+
+SHARED_STORE_PATH = os.getenv("SHARED_STORE_PATH", os.path.join("data", "shared.db"))
+
+SCHEMA = """
+-- 「このギルドのイベントはこのワーカーが動かしている」などの期限つきの占有
+CREATE TABLE IF NOT EXISTS leases (
+    name       TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+-- イベント終了後にオンラインカウントを止めておく期限（ギルドごと）
+CREATE TABLE IF NOT EXISTS cooldowns (
+    guild_id INTEGER PRIMARY KEY,
+    until    REAL NOT NULL
+);
+-- 期限つきの JSON 値（返信キャッシュなど）
+CREATE TABLE IF NOT EXISTS cache (
+    key        TEXT PRIMARY KEY,
+    value      TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SharedStore:
+    def __init__(self, path: str = SHARED_STORE_PATH, owner: str = "main", busy_timeout: float = 5.0):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        # owner は再起動しても変わらない名前にする（落ちたワーカーが戻ったとき自分のリースを取り直せるように）
+        self.owner = owner
+        self.db = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()   # 接続は1本なので、スレッドから呼ばれても1つずつ
+        self._execute("PRAGMA journal_mode=WAL")
+        self._execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        """書き込み。変わった行数を返す"""
+        with self._lock:
+            return self.db.execute(sql, params).rowcount
+
+    def _fetchone(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self.db.execute(sql, params).fetchone()
+
+    async def call(self, method, *args):
+        """await store.call(store.acquire, name, ttl) のように、同期メソッドをスレッドで実行する"""
+        return await asyncio.to_thread(method, *args)
+
+    # --- リース ---
+    def acquire(self, name: str, ttl: float) -> bool:
+        """空いているか期限切れか自分のものなら取って True。他のワーカーが持っていれば False"""
+        now = time.time()
+        changed = self._execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at <= ?",
+            (name, self.owner, now + ttl, now),
+        )
+        return changed == 1
+
+    def release(self, name: str):
+        self._execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+
+    def holder(self, name: str):
+        row = self._fetchone(
+            "SELECT owner FROM leases WHERE name = ? AND expires_at > ?", (name, time.time())
+        )
+        return row[0] if row else None
+
+    # --- クールダウン ---
+    def cooldown_until(self, guild_id: int) -> float:
+        row = self._fetchone("SELECT until FROM cooldowns WHERE guild_id = ?", (guild_id,))
+        return row[0] if row else 0.0
+
+    def set_cooldown(self, guild_id: int, until: float):
+        self._execute(
+            "INSERT INTO cooldowns (guild_id, until) VALUES (?, ?) "
+            "ON CONFLICT(guild_id) DO UPDATE SET until = excluded.until",
+            (guild_id, until),
+        )
+
+    # --- 期限つきの値 ---
+    def cache_get(self, key: str):
+        row = self._fetchone(
+            "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        )
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1] - time.time()
+
+    def cache_set(self, key: str, value, ttl: float):
+        self._execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time() + ttl),
+        )
+
+    def prune(self) -> int:
+        """期限切れの行を消す（定期的に呼ぶ）"""
+        now = time.time()
+        removed = 0
+        for table, column in (("leases", "expires_at"), ("cooldowns", "until"), ("cache", "expires_at")):
+            removed += self._execute(f"DELETE FROM {table} WHERE {column} <= ?", (now,))
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            table: self._fetchone(f"SELECT COUNT(*) FROM {table}")[0]
+            for table in ("leases", "cooldowns", "cache")
+        }
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+
+import ratelimit
+
+# ---------------------
+# LLM のストリーミング返信を「考え中だよ」メッセージへ少しずつ反映する
+# ---------------------
+# 生成が終わるまで何も見えないのを避けるため、届いた分だけ placeholder を書き換える。
+# ただし1トークンごとに edit すると edit_message のレートリミットにすぐ当たるので、
+# 最新の全文だけを覚えておき、min_interval 秒に1回まで反映する。
+
+DISCORD_MESSAGE_LIMIT = 2000
+STREAM_CURSOR = " ▍"     # 生成途中の印
+
+
+async def iterate_in_thread(make_iterator):
+    """
+    同期のストリーム（OpenAI の stream=True や Gemini の stream=True）を
+    別スレッドで回し、要素を async for で受け取れるようにする。
+    途中で抜けたらスレッド側も次の要素で止まる。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def put(item, error=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            # ループがもう閉じている
+            stop.set()
+
+    def worker():
+        try:
+            for item in make_iterator():
+                if stop.is_set():
+                    return
+                put(item)
+        except Exception as e:
+            put(done, e)
+        else:
+            put(done)
+
+    loop.run_in_executor(None, worker)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+class ProgressiveEditor:
+    """
+    update(全文) は最新のテキストを覚えるだけで、実際の edit は裏のタスクが
+    min_interval 秒に1回まで、前回から min_chars 文字以上増えたときだけ行う。
+    finish(全文) で途中の edit を待ってから最終版を必ず1回反映する。
+    """
+
+    def __init__(self, message, prefix: str = "", min_interval: float = 1.5, min_chars: int = 20,
+                 buckets: ratelimit.RouteBuckets = None):
+        self.message = message
+        self.prefix = prefix
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.bucket = (buckets or ratelimit.buckets).get("edit_message", message.channel.id)
+        self.edits = 0
+        self.failed_edits = 0
+        self._latest = ""
+        self._shown = ""
+        self._last_edit = 0.0
+        self._finished = False
+        self._pump_task = None
+
+    def _render(self, text: str, cursor: str = "") -> str:
+        content = f"{self.prefix}{text}"
+        limit = DISCORD_MESSAGE_LIMIT - len(cursor)
+        if len(content) > limit:
+            content = content[:limit - 1] + "…"
+        return content + cursor
+
+    def update(self, text: str):
+        if self._finished:
+            return
+        self._latest = text
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+
+    def _unshown(self) -> int:
+        """
+        まだ見せていない文字数。ディスパッチャが途中で別のバックエンドに切り替えると
+        全文が頭から書き直されるので、見せた分の続きでなければ全部を新しい分として数える
+        """
+        if self._latest.startswith(self._shown):
+            return len(self._latest) - len(self._shown)
+        return len(self._latest)
+
+    async def _pump(self):
+        while not self._finished and self._unshown() >= self.min_chars:
+            wait = self._last_edit + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            await self.bucket.acquire()
+            if self._finished:
+                return
+            text = self._latest
+            self._last_edit = time.monotonic()
+            try:
+                with ratelimit.REST_SECONDS.time(route=self.bucket.route):
+                    await self.message.edit(content=self._render(text, STREAM_CURSOR))
+            except Exception as e:
+                # 途中経過は取りこぼしても最後の edit で揃うので、429 だけ反映して先へ進む
+                self.failed_edits += 1
+                retry_after = ratelimit.retry_after_from(e)
+                if retry_after is not None:
+                    self.bucket.penalize(retry_after)
+                continue
+            self._shown = text
+            self.edits += 1
+
+    async def finish(self, text: str):
+        self._finished = True
+        if self._pump_task is not None and not self._pump_task.done():
+            # 送信中の途中経過 edit が最終版を上書きしないように待つ
+            try:
+                await self._pump_task
+            except Exception:
+                pass
+        await ratelimit.call_with_retry(self.bucket, lambda: self.message.edit(content=self._render(text)))
+        self.edits += 1
@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass
+
+from cache import TTLCache
+from textutil import estimate_tokens
+
+# ---------------------
+# 長いログの map-reduce 要約
+# ---------------------
+# ログを先頭からトークン数で区切る（区切り位置は先頭から決まるので、
+# 後からメッセージが増えても変わるのは最後のチャンクだけ）。
+# チャンクごとの要約はキャッシュしておき、再実行時は新しいチャンクだけ投げる。
+
+
+@dataclass
+class SummaryStats:
+    chunks: int = 0
+    cached_chunks: int = 0
+    tokens: int = 0
+    reduce_rounds: int = 0
+    map_seconds: float = 0.0
+    reduce_seconds: float = 0.0
+
+    def __str__(self):
+        return (
+            f"chunks={self.chunks} (cached {self.cached_chunks}) tokens={self.tokens} "
+            f"map={self.map_seconds:.2f}s reduce={self.reduce_seconds:.2f}s rounds={self.reduce_rounds}"
+        )
+
+
+def chunk_lines(lines: list, max_tokens: int) -> list:
+    """行をまたがないように max_tokens ごとに区切る。1行で超えるものは切り詰める"""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for line in lines:
+        tokens = estimate_tokens(line)
+        if tokens > max_tokens:
+            line = line[:max_tokens]
+            tokens = estimate_tokens(line)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current = []
+            current_tokens = 0
+        current.append(line)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class MapReduceSummarizer:
+    """
+    complete: async def complete(prompt) -> str（失敗時は例外）
+    map_prompt / reduce_prompt: "{text}" を含むプロンプトのテンプレート
+    final_prompt: チャンクが1つで済むときにそのまま使うテンプレート
+    """
+
+    def __init__(self, complete, map_prompt: str, reduce_prompt: str, final_prompt: str,
+                 chunk_tokens: int = 3000, workers: int = 3, cache: TTLCache = None):
+        self.complete = complete
+        self.map_prompt = map_prompt
+        self.reduce_prompt = reduce_prompt
+        self.final_prompt = final_prompt
+        self.chunk_tokens = chunk_tokens
+        self.workers = workers
+        self.cache = cache if cache is not None else TTLCache(maxsize=512, ttl=48 * 3600)
+
+    def _key(self, template: str, text: str) -> str:
+        return hashlib.sha1(f"{template}\0{text}".encode("utf-8")).hexdigest()
+
+    async def _run(self, template: str, text: str, semaphore: asyncio.Semaphore, stats: SummaryStats) -> str:
+        key = self._key(template, text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            stats.cached_chunks += 1
+            return cached
+        async with semaphore:
+            result = await self.complete(template.format(text=text))
+        self.cache.set(key, result)
+        return result
+
+    async def summarize(self, lines: list):
+        """(要約, SummaryStats) を返す"""
+        stats = SummaryStats(tokens=sum(estimate_tokens(line) for line in lines))
+        semaphore = asyncio.Semaphore(self.workers)
+        chunks = chunk_lines(lines, self.chunk_tokens)
+        stats.chunks = len(chunks)
+
+        started = time.monotonic()
+        if len(chunks) == 1:
+            summary = await self._run(self.final_prompt, "\n".join(chunks[0]), semaphore, stats)
+            stats.map_seconds = time.monotonic() - started
+            return summary, stats
+
+        # map: チャンクごとに並行で要約
+        partials = await asyncio.gather(*(
+            self._run(self.map_prompt, "\n".join(chunk), semaphore, stats) for chunk in chunks
+        ))
+        stats.map_seconds = time.monotonic() - started
+
+        # reduce: 部分要約が1回で収まるまで束ねて要約し直す
+        started = time.monotonic()
+        while True:
+            stats.reduce_rounds += 1
+            groups = chunk_lines(list(partials), self.chunk_tokens)
+            if len(groups) >= len(partials):
+                # 部分要約が長すぎて束ねられない場合は切り詰めて最後の1回にする
+                groups = [[p[:self.chunk_tokens // len(partials)] for p in partials]]
+            if len(groups) == 1:
+                summary = await self._run(self.final_prompt, "\n\n".join(groups[0]), semaphore, stats)
+                break
+            partials = await asyncio.gather(*(
+                self._run(self.reduce_prompt, "\n\n".join(group), semaphore, stats) for group in groups
+            ))
+        stats.reduce_seconds = time.monotonic() - started
+        return summary, stats
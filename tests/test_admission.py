@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def rejection(controller: AdmissionController, user_id: int, guild_id: int = 1) -> str:
+    with pytest.raises(AdmissionRejected) as info:
+        controller.admit(user_id, guild_id)
+    return info.value.reason
+
+
+def test_a_user_is_limited_to_their_burst():
+    controller = AdmissionController(user_rate=0.001, user_burst=2)
+    controller.admit(1, 1)
+    controller.admit(1, 1)
+
+    assert rejection(controller, 1) == "user"
+    controller.admit(2, 1)      # 他のユーザーは別のバケット
+    assert controller.stats()["shed"]["user"] == 1
+
+
+def test_a_guild_is_limited_across_users():
+    controller = AdmissionController(guild_rate=0.001, guild_burst=3)
+    for user_id in range(3):
+        controller.admit(user_id, 1)
+
+    assert rejection(controller, 99) == "guild"
+    controller.admit(99, 2)
+
+
+def test_a_rejection_does_not_spend_the_other_bucket():
+    controller = AdmissionController(user_rate=0.001, user_burst=1, guild_rate=0.001, guild_burst=2)
+    controller.admit(1, 1)
+    assert rejection(controller, 1) == "user"
+
+    controller.admit(2, 1)      # user 1 の2回目でギルドの枠は減っていない
+
+
+def test_requests_wait_for_a_slot_and_overflow_is_shed():
+    controller = AdmissionController(max_concurrent=1, max_queue=1)
+    order = []
+
+    async def run(ticket, name, delay):
+        async with ticket:
+            await ticket.acquire()
+            order.append(f"start {name}")
+            await asyncio.sleep(delay)
+            order.append(f"end {name}")
+
+    async def scenario():
+        first = asyncio.ensure_future(run(controller.admit(1, 1), "first", 0.05))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(run(controller.admit(2, 1), "second", 0))
+        await asyncio.sleep(0.01)
+        assert controller.stats()["in_flight"] == 1
+        assert controller.stats()["waiting"] == 1
+        assert rejection(controller, 3) == "queue"
+        await asyncio.gather(first, second)
+
+    asyncio.run(scenario())
+    assert order == ["start first", "end first", "start second", "end second"]
+    stats = controller.stats()
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+    assert stats["queued"] == 1
+    assert stats["max_wait"] > 0
+
+
+def test_leaving_without_acquiring_frees_the_queue_seat():
+    controller = AdmissionController(max_concurrent=1, max_queue=0)
+
+    async def scenario():
+        async with controller.admit(1, 1):
+            assert rejection(controller, 2) == "queue"
+        controller.admit(3, 1)
+
+    asyncio.run(scenario())
+
+
+def test_a_cancelled_waiter_returns_its_seat():
+    controller = AdmissionController(max_concurrent=1, max_queue=1)
+
+    async def hold(ticket, event):
+        async with ticket:
+            await ticket.acquire()
+            await event.wait()
+
+    async def scenario():
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(hold(controller.admit(1, 1), release))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(hold(controller.admit(2, 1), release))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert controller.stats()["waiting"] == 0
+        release.set()
+        await holder
+        assert controller.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_idle_buckets_are_pruned():
+    controller = AdmissionController(user_rate=1e6, guild_rate=1e6)
+
+    async def scenario():
+        for user_id in range(1100):
+            async with controller.admit(user_id, 1):
+                pass
+
+    asyncio.run(scenario())
+    assert len(controller._user_buckets) < 1100
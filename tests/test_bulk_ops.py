@@ -0,0 +1,190 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import discord
+
+import ratelimit
+from bulk_ops import BULK_DELETE_MAX, DISCORD_EPOCH_MS, bulk_edit, purge_messages, snowflake_timestamp
+
+DAY = 24 * 3600
+
+
+def snowflake(ts: float, seq: int = 0) -> int:
+    return (int(ts * 1000) - DISCORD_EPOCH_MS) << 22 | seq
+
+
+def not_found():
+    return discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "gone")
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("429")
+        self.retry_after = retry_after
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int = 1, bulk: bool = True, fail_bulk: bool = False):
+        self.id = channel_id
+        self.bulk_calls = []
+        self.single_deletes = []
+        self.fail_bulk = fail_bulk
+        if bulk:
+            self.delete_messages = self._delete_messages
+
+    async def _delete_messages(self, messages):
+        self.bulk_calls.append([m.id for m in messages])
+        if self.fail_bulk:
+            raise RuntimeError("bulk failed")
+
+
+class FakeMessage:
+    def __init__(self, channel: FakeChannel, message_id: int, missing: bool = False, rate_limited: int = 0):
+        self.channel = channel
+        self.id = message_id
+        self.missing = missing
+        self.rate_limited = rate_limited
+
+    async def delete(self):
+        if self.rate_limited:
+            self.rate_limited -= 1
+            raise RateLimited(0.01)
+        if self.missing:
+            raise not_found()
+        self.channel.single_deletes.append(self.id)
+
+
+def fast_buckets() -> ratelimit.RouteBuckets:
+    return ratelimit.RouteBuckets({route: (1e6, 1e6) for route in ratelimit.ROUTE_LIMITS})
+
+
+def test_snowflake_timestamp_round_trips():
+    assert abs(snowflake_timestamp(snowflake(1_700_000_000.5)) - 1_700_000_000.5) < 0.001
+
+
+def test_recent_messages_are_bulk_deleted_in_batches_of_100():
+    channel = FakeChannel()
+    now = time.time()
+    messages = [FakeMessage(channel, snowflake(now - 60, i)) for i in range(BULK_DELETE_MAX + 50)]
+
+    result = asyncio.run(purge_messages(messages, fast_buckets()))
+
+    assert [len(batch) for batch in channel.bulk_calls] == [BULK_DELETE_MAX, 50]
+    assert result.deleted == BULK_DELETE_MAX + 50
+    assert result.bulk_requests == 2
+    assert result.single_requests == 0
+
+
+def test_messages_older_than_14_days_are_deleted_one_by_one():
+    channel = FakeChannel()
+    now = time.time()
+    recent = [FakeMessage(channel, snowflake(now - DAY, i)) for i in range(3)]
+    old = [FakeMessage(channel, snowflake(now - 15 * DAY, i)) for i in range(2)]
+
+    result = asyncio.run(purge_messages(recent + old, fast_buckets()))
+
+    assert channel.bulk_calls == [[m.id for m in recent]]
+    assert sorted(channel.single_deletes) == sorted(m.id for m in old)
+    assert result.deleted == 5
+
+
+def test_duplicates_and_none_are_skipped():
+    channel = FakeChannel()
+    message = FakeMessage(channel, snowflake(time.time() - 60))
+
+    result = asyncio.run(purge_messages([message, None, message], fast_buckets()))
+
+    # 1件だけになったので bulk-delete ではなく単発
+    assert channel.bulk_calls == []
+    assert channel.single_deletes == [message.id]
+    assert result.deleted == 1
+
+
+def test_channels_without_bulk_delete_fall_back_to_single_deletes():
+    channel = FakeChannel(bulk=False)
+    messages = [FakeMessage(channel, snowflake(time.time() - 60, i)) for i in range(3)]
+
+    result = asyncio.run(purge_messages(messages, fast_buckets()))
+
+    assert len(channel.single_deletes) == 3
+    assert result.single_requests == 3
+
+
+def test_failed_bulk_batch_is_retried_as_single_deletes():
+    channel = FakeChannel(fail_bulk=True)
+    messages = [FakeMessage(channel, snowflake(time.time() - 60, i)) for i in range(3)]
+
+    result = asyncio.run(purge_messages(messages, fast_buckets()))
+
+    assert len(channel.bulk_calls) == 1
+    assert len(channel.single_deletes) == 3
+    assert result.deleted == 3
+
+
+def test_missing_messages_and_rate_limits_are_counted():
+    channel = FakeChannel(bulk=False)
+    now = time.time()
+    messages = [
+        FakeMessage(channel, snowflake(now, 1), missing=True),
+        FakeMessage(channel, snowflake(now, 2), rate_limited=1),
+    ]
+
+    result = asyncio.run(purge_messages(messages, fast_buckets()))
+
+    assert result.missing == 1
+    assert result.deleted == 1
+    assert result.retries == 1
+    assert result.failed == 0
+
+
+# ---------------------
+# 一括編集
+# ---------------------
+class EditableMessage:
+    def __init__(self, channel: FakeChannel, message_id: int, log: list, delay: float = 0.0, missing: bool = False):
+        self.channel = channel
+        self.id = message_id
+        self.log = log
+        self.delay = delay
+        self.missing = missing
+
+    async def edit(self, content=None):
+        await asyncio.sleep(self.delay)
+        if self.missing:
+            raise not_found()
+        self.log.append((self.id, content))
+
+
+def test_bulk_edit_rewrites_newest_first_and_skips_duplicates():
+    channel = FakeChannel()
+    log = []
+    messages = [EditableMessage(channel, message_id, log) for message_id in (3, 1, 2)]
+
+    result = asyncio.run(bulk_edit(messages + [messages[0], None], "観測した", concurrency=1, buckets=fast_buckets()))
+
+    assert log == [(3, "観測した"), (2, "観測した"), (1, "観測した")]
+    assert result.edited == 3
+
+
+def test_bulk_edit_gives_up_on_the_oldest_at_the_deadline():
+    channel = FakeChannel()
+    log = []
+    messages = [EditableMessage(channel, message_id, log, delay=0.05) for message_id in range(1, 6)]
+
+    result = asyncio.run(bulk_edit(messages, "x", concurrency=1, deadline=0.12, buckets=fast_buckets()))
+
+    assert [message_id for message_id, _ in log] == [5, 4]
+    assert result.edited == 2
+    assert result.timed_out == 3
+
+
+def test_bulk_edit_counts_missing_messages():
+    channel = FakeChannel()
+    log = []
+    messages = [EditableMessage(channel, 1, log, missing=True), EditableMessage(channel, 2, log)]
+
+    result = asyncio.run(bulk_edit(messages, "x", buckets=fast_buckets()))
+
+    assert result.missing == 1
+    assert result.edited == 1
@@ -0,0 +1,175 @@
+import asyncio
+import time
+
+import pytest
+
+from dispatch import AllBackendsFailed, Backend, CircuitBreaker, HedgedDispatcher
+
+
+# ---------------------
+# スタブのバックエンド
+# ---------------------
+def answer_after(delay: float, text: str):
+    async def call(query, **kwargs):
+        await asyncio.sleep(delay)
+        return text
+    return call
+
+
+def fail_after(delay: float):
+    async def call(query, **kwargs):
+        await asyncio.sleep(delay)
+        raise RuntimeError("boom")
+    return call
+
+
+def stream_after(delay: float, chunks: list, fail_at: int = None, gap: float = 0.01):
+    async def stream(query, **kwargs):
+        await asyncio.sleep(delay)
+        for i, chunk in enumerate(chunks):
+            if i == fail_at:
+                raise RuntimeError("stream broke")
+            yield chunk
+            await asyncio.sleep(gap)
+    return stream
+
+
+def timed(coro):
+    async def runner():
+        started = time.monotonic()
+        result = await coro
+        return result, time.monotonic() - started
+    return asyncio.run(runner())
+
+
+# ---------------------
+# run()
+# ---------------------
+def test_run_hedges_to_the_next_backend_when_the_first_is_slow():
+    slow = Backend("slow", answer_after(2.0, "slow"))
+    fast = Backend("fast", answer_after(0.05, "fast"))
+    dispatcher = HedgedDispatcher([slow, fast], hedge_delay=0.1)
+
+    result, elapsed = timed(dispatcher.run("q"))
+
+    assert result == "fast"
+    assert elapsed < 0.5
+    assert slow.stats.cancelled == 1
+
+
+def test_run_moves_on_immediately_after_a_failure():
+    broken = Backend("broken", fail_after(0.01))
+    fallback = Backend("fallback", answer_after(0.01, "ok"))
+    dispatcher = HedgedDispatcher([broken, fallback], hedge_delay=5.0)
+
+    result, elapsed = timed(dispatcher.run("q"))
+
+    assert result == "ok"
+    assert elapsed < 0.5    # hedge_delay まで待たない
+    assert broken.stats.errors == 1
+
+
+def test_run_raises_when_every_backend_fails():
+    dispatcher = HedgedDispatcher([Backend("a", fail_after(0)), Backend("b", fail_after(0))], hedge_delay=0.05)
+
+    with pytest.raises(AllBackendsFailed):
+        asyncio.run(dispatcher.run("q"))
+
+
+def test_empty_answer_counts_as_a_failure():
+    dispatcher = HedgedDispatcher([Backend("empty", answer_after(0, "")), Backend("ok", answer_after(0, "ok"))])
+
+    assert asyncio.run(dispatcher.run("q")) == "ok"
+
+
+# ---------------------
+# サーキットブレーカー
+# ---------------------
+def test_breaker_opens_after_repeated_failures_and_skips_the_backend():
+    broken = Backend("broken", fail_after(0), breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    fallback = Backend("fallback", answer_after(0, "ok"))
+    dispatcher = HedgedDispatcher([broken, fallback])
+
+    for _ in range(2):
+        asyncio.run(dispatcher.run("q"))
+    assert broken.breaker.state == "open"
+
+    asyncio.run(dispatcher.run("q"))
+    assert broken.stats.calls == 2
+    assert broken.stats.skipped == 1
+
+
+def test_breaker_allows_one_trial_when_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()      # 試行中は2本目を通さない
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_breaker_trial_slot_is_returned_when_the_backend_was_not_called():
+    # 先頭が答えたので2番目は投げずに終わる -> half-open の試行枠が残っていないといけない
+    spare_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    spare_breaker.record_failure()
+    dispatcher = HedgedDispatcher(
+        [Backend("fast", answer_after(0, "ok")), Backend("spare", answer_after(0, "spare"), breaker=spare_breaker)]
+    )
+
+    asyncio.run(dispatcher.run("q"))
+
+    assert spare_breaker.allow()
+
+
+# ---------------------
+# stream()
+# ---------------------
+def test_stream_is_as_fast_as_run_when_the_first_backend_stalls():
+    def backends():
+        return [
+            Backend("slow", answer_after(2.0, "slow"), stream=stream_after(2.0, ["slow"])),
+            Backend("fast", answer_after(0.1, "fast answer"), stream=stream_after(0.1, ["fast ", "answer"])),
+        ]
+
+    _, run_elapsed = timed(HedgedDispatcher(backends(), hedge_delay=0.2).run("q"))
+    texts = []
+    result, stream_elapsed = timed(HedgedDispatcher(backends(), hedge_delay=0.2).stream("q", texts.append))
+
+    assert result == "fast answer"
+    assert texts == ["fast ", "fast answer"]
+    assert stream_elapsed < run_elapsed + 0.3
+    assert stream_elapsed < 1.0
+
+
+def test_stream_forwards_only_the_backend_that_started_writing():
+    first = Backend("first", answer_after(0, "x"), stream=stream_after(0.3, ["late"]))
+    second = Backend("second", answer_after(0, "x"), stream=stream_after(0.0, ["a", "b", "c"], gap=0.05))
+    texts = []
+
+    result = asyncio.run(HedgedDispatcher([first, second], hedge_delay=0.05).stream("q", texts.append))
+
+    assert result == "abc"
+    assert texts == ["a", "ab", "abc"]
+    assert first.stats.cancelled == 1
+
+
+def test_stream_falls_back_when_the_writing_backend_breaks():
+    breaking = Backend("breaking", answer_after(0, "x"), stream=stream_after(0, ["part", "more"], fail_at=1))
+    fallback = Backend("fallback", answer_after(0.01, "full answer"))
+    texts = []
+
+    result = asyncio.run(HedgedDispatcher([breaking, fallback], hedge_delay=5.0).stream("q", texts.append))
+
+    assert result == "full answer"
+    assert texts == ["part"]        # 途中経過は返り値で上書きされる
+    assert breaking.stats.errors == 1
+
+
+def test_stream_uses_call_for_backends_without_streaming():
+    plain = Backend("plain", answer_after(0.01, "plain"))
+    texts = []
+
+    assert asyncio.run(HedgedDispatcher([plain]).stream("q", texts.append)) == "plain"
+    assert texts == []
@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+from journal import KIND_BOT, KIND_PARTICIPANT, MessageJournal
+
+
+def message(channel_id: int, message_id: int):
+    return SimpleNamespace(channel=SimpleNamespace(id=channel_id), id=message_id)
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+
+    def get_partial_message(self, message_id: int):
+        return (self.id, message_id)
+
+
+class FakeClient:
+    def __init__(self, cached: list):
+        self.cached = {channel_id: FakeChannel(channel_id) for channel_id in cached}
+        self.partial_lookups = []
+
+    def get_channel(self, channel_id: int):
+        return self.cached.get(channel_id)
+
+    def get_partial_messageable(self, channel_id: int):
+        self.partial_lookups.append(channel_id)
+        return FakeChannel(channel_id)
+
+
+def test_record_and_filter_by_kind(tmp_path):
+    journal = MessageJournal(str(tmp_path / "j.bin"))
+    journal.record(message(1, 10))
+    journal.record(message(1, 11), KIND_PARTICIPANT)
+    journal.record(None)    # 送信に失敗したときなど
+
+    assert len(journal) == 2
+    assert list(journal.entries(KIND_BOT)) == [(1, 10, KIND_BOT)]
+    assert list(journal.entries()) == [(1, 10, KIND_BOT), (1, 11, KIND_PARTICIPANT)]
+
+
+def test_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "j.bin")
+    journal = MessageJournal(path)
+    journal.add(1, 2**63, KIND_BOT)     # Discord の ID は 64 ビット
+    journal.add(3, 4, KIND_PARTICIPANT)
+    journal.close()
+
+    assert list(MessageJournal(path).entries()) == [(1, 2**63, KIND_BOT), (3, 4, KIND_PARTICIPANT)]
+
+
+def test_a_half_written_record_is_dropped_on_load(tmp_path):
+    path = tmp_path / "j.bin"
+    journal = MessageJournal(str(path))
+    journal.add(1, 2, KIND_BOT)
+    journal.close()
+    with open(path, "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    reloaded = MessageJournal(str(path))
+    assert list(reloaded.entries()) == [(1, 2, KIND_BOT)]
+    reloaded.add(5, 6, KIND_BOT)
+    reloaded.close()
+    assert len(MessageJournal(str(path))) == 2
+
+
+def test_discard_first_keeps_later_entries_on_disk(tmp_path):
+    path = str(tmp_path / "j.bin")
+    journal = MessageJournal(path)
+    for i in range(5):
+        journal.add(1, i, KIND_BOT)
+    journal.discard_first(3)
+    journal.add(1, 99, KIND_BOT)
+    journal.close()
+
+    assert [m for _, m, _ in MessageJournal(path).entries()] == [3, 4, 99]
+
+
+def test_clear_empties_the_file(tmp_path):
+    path = str(tmp_path / "j.bin")
+    journal = MessageJournal(path)
+    journal.add(1, 2, KIND_BOT)
+    journal.discard_first(10)
+    journal.close()
+
+    assert len(MessageJournal(path)) == 0
+
+
+def test_partial_messages_reuse_one_channel_object_per_channel(tmp_path):
+    journal = MessageJournal(str(tmp_path / "j.bin"))
+    for channel_id, message_id in [(1, 10), (2, 20), (2, 21), (1, 11)]:
+        journal.add(channel_id, message_id, KIND_BOT)
+    journal.add(2, 22, KIND_PARTICIPANT)
+    client = FakeClient(cached=[1])
+
+    assert journal.partial_messages(client, KIND_BOT) == [(1, 10), (2, 20), (2, 21), (1, 11)]
+    assert client.partial_lookups == [2]    # キャッシュに無いチャンネルだけ、1回だけ
@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from message_log import MessageLog
+
+
+def make_message(message_id: int, ts: float, content: str = "hello", channel_id: int = 1, bot: bool = False):
+    return SimpleNamespace(
+        id=message_id,
+        channel=SimpleNamespace(id=channel_id),
+        author=SimpleNamespace(id=10, display_name="user", bot=bot),
+        content=content,
+        created_at=datetime.fromtimestamp(ts, timezone.utc),
+    )
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, messages: list):
+        self.id = channel_id
+        self.messages = messages
+        self.calls = []
+
+    async def history(self, limit=None, after=None, before=None, oldest_first=True):
+        self.calls.append((after.timestamp(), before.timestamp()))
+        for message in self.messages:
+            if after <= message.created_at < before:
+                yield message
+
+
+def make_log(tmp_path, **kwargs) -> MessageLog:
+    return MessageLog(str(tmp_path / "messages.db"), **kwargs)
+
+
+def add_session(log: MessageLog, started_at: float, last_alive: float):
+    log.db.execute("INSERT INTO sessions (started_at, last_alive) VALUES (?, ?)", (started_at, last_alive))
+    log.db.commit()
+
+
+def test_append_is_buffered_until_flush(tmp_path):
+    log = make_log(tmp_path)
+    log.append(make_message(1, 1000, "first"))
+
+    assert log.db.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 0
+    assert log.fetch_window(1, 0, 2000) == [("user", "first")]     # 読む前に書き出す
+
+
+def test_append_flushes_when_the_buffer_is_full(tmp_path):
+    log = make_log(tmp_path, flush_size=2)
+    log.append(make_message(1, 1000))
+    log.append(make_message(2, 1001))
+
+    assert log.db.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 2
+
+
+def test_flush_extends_the_connected_session(tmp_path):
+    log = make_log(tmp_path)
+    log.begin_session()
+    log.db.execute("UPDATE sessions SET started_at = 0, last_alive = 0")
+    log.append(make_message(1, 1000))
+    log.flush()
+
+    assert log.db.execute("SELECT last_alive FROM sessions").fetchone()[0] > 0
+
+
+def test_update_and_delete_apply_to_buffered_rows(tmp_path):
+    log = make_log(tmp_path)
+    log.append(make_message(1, 1000, "before"))
+    log.append(make_message(2, 1001, "deleted"))
+    log.update(1, "after")
+    log.delete([2])
+
+    assert log.fetch_window(1, 0, 2000) == [("user", "after")]
+
+
+def test_fetch_window_skips_bots_and_other_channels(tmp_path):
+    log = make_log(tmp_path)
+    log.append(make_message(1, 1000, "human"))
+    log.append(make_message(2, 1001, "bot", bot=True))
+    log.append(make_message(3, 1002, "elsewhere", channel_id=2))
+
+    assert log.fetch_window(1, 0, 2000) == [("user", "human")]
+    assert log.fetch_window(1, 0, 2000, include_bots=True) == [("user", "human"), ("user", "bot")]
+
+
+def test_gaps_are_the_time_outside_sessions_and_coverage(tmp_path):
+    log = make_log(tmp_path)
+    add_session(log, 100, 200)
+    add_session(log, 150, 250)      # 重なる区間はまとめる
+    add_session(log, 400, 450)
+    log.db.execute("INSERT INTO coverage VALUES (1, 300, 350)")
+    log.db.execute("INSERT INTO coverage VALUES (2, 250, 400)")     # 別のチャンネルの分は数えない
+
+    assert log.gaps(1, 0, 500) == [(0, 100), (250, 300), (350, 400), (450, 500)]
+    assert log.gaps(1, 120, 240) == []
+
+
+def test_backfill_fetches_only_the_gaps_and_records_coverage(tmp_path):
+    log = make_log(tmp_path)
+    add_session(log, 1000, 2000)
+    channel = FakeChannel(1, [make_message(i, ts) for i, ts in enumerate([500, 1500, 2500], start=1)])
+
+    fetched = asyncio.run(log.backfill(channel, 0, 3000))
+
+    assert fetched == 2     # 1500 はセッション中に受け取っている前提なので取り直さない
+    assert channel.calls == [(0, 1000), (2000, 3000)]
+    assert log.gaps(1, 0, 3000) == []
+    assert asyncio.run(log.backfill(channel, 0, 3000)) == 0
+
+
+def test_prune_drops_old_rows_but_keeps_the_current_session(tmp_path):
+    log = make_log(tmp_path)
+    log.begin_session()
+    log.db.execute("UPDATE sessions SET started_at = 0, last_alive = 10")
+    add_session(log, 0, 10)
+    log.db.execute("INSERT INTO coverage VALUES (1, 0, 10)")
+    log.append(make_message(1, 5))
+    log.append(make_message(2, 500))
+
+    assert log.prune(100) == 1
+    assert log.fetch_window(1, 0, 1000) == [("user", "hello")]
+    assert log.db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 1
+    assert log.db.execute("SELECT COUNT(*) FROM coverage").fetchone()[0] == 0
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+import ratelimit
+from outbound import PRIORITY_FILLER, PRIORITY_REPLY, PRIORITY_SCRIPT, OutboundScheduler
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int = 1, delay: float = 0.0, fail_on: str = None):
+        self.id = channel_id
+        self.delay = delay
+        self.fail_on = fail_on
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.delay)
+        if content == self.fail_on:
+            raise RuntimeError("send failed")
+        self.sent.append(content)
+        return f"message:{content}"
+
+
+def make_scheduler(**kwargs) -> OutboundScheduler:
+    # ペースの検査ではないので、バケットはほぼ無制限にする
+    return OutboundScheduler(ratelimit.RouteBuckets({"send_message": (1000.0, 1000)}), **kwargs)
+
+
+def test_higher_priority_messages_are_sent_first():
+    channel = FakeChannel()
+
+    async def scenario():
+        outbound = make_scheduler()
+        futures = [
+            outbound.submit(channel, "filler", PRIORITY_FILLER),
+            outbound.submit(channel, "reply", PRIORITY_REPLY),
+            outbound.submit(channel, "script", PRIORITY_SCRIPT),
+        ]
+        results = await asyncio.gather(*futures)
+        assert results == ["message:filler", "message:reply", "message:script"]
+        assert outbound.depth() == 0
+
+    asyncio.run(scenario())
+    assert channel.sent == ["script", "reply", "filler"]
+
+
+def test_identical_fillers_are_coalesced():
+    channel = FakeChannel()
+
+    async def scenario():
+        outbound = make_scheduler()
+        first = outbound.submit(channel, "・・・。", PRIORITY_FILLER)
+        second = outbound.submit(channel, "・・・。", PRIORITY_FILLER)
+        other = outbound.submit(FakeChannel(channel_id=2), "・・・。", PRIORITY_FILLER)
+        assert first is second
+        assert first is not other
+        await asyncio.gather(first, other)
+        assert outbound.stats()["filler"]["coalesced"] == 1
+
+    asyncio.run(scenario())
+    assert channel.sent == ["・・・。"]
+
+
+def test_discard_drops_queued_sends_but_not_the_one_in_flight():
+    channel = FakeChannel(delay=0.05)
+
+    async def scenario():
+        outbound = make_scheduler()
+        in_flight = outbound.submit(channel, "first")
+        await asyncio.sleep(0.01)   # "first" を送信中にする
+        queued = [outbound.submit(channel, "second"), outbound.submit(channel, "third")]
+        kept = outbound.submit(channel, "fourth")
+
+        assert outbound.discard([in_flight, *queued]) == 2
+        assert all(f.cancelled() for f in queued)
+        assert await in_flight == "message:first"
+        assert await kept == "message:fourth"
+
+    asyncio.run(scenario())
+    assert channel.sent == ["first", "fourth"]
+
+
+def test_send_failure_is_reported_and_the_queue_keeps_draining():
+    channel = FakeChannel(fail_on="bad")
+
+    async def scenario():
+        outbound = make_scheduler()
+        bad = outbound.submit(channel, "bad")
+        good = outbound.submit(channel, "good")
+        with pytest.raises(RuntimeError):
+            await bad
+        assert await good == "message:good"
+        assert outbound.stats()["reply"]["failed"] == 1
+
+    asyncio.run(scenario())
+    assert channel.sent == ["good"]
+
+
+def test_cancelled_sender_does_not_cancel_the_send():
+    channel = FakeChannel(delay=0.05)
+
+    async def scenario():
+        outbound = make_scheduler()
+        waiter = asyncio.ensure_future(outbound.send(channel, "shielded"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert channel.sent == ["shielded"]
@@ -0,0 +1,120 @@
+import json
+import os
+
+from scenario import KeywordAutomaton, Scenario, ScenarioStore, load_scenario
+from textutil import normalize_question, normalize_text, original_span
+
+
+def make_scenario(**overrides) -> Scenario:
+    data = {
+        "cipher": {"text": "XHAJRVETKOU", "key": "KEY", "answer": "OBSERVATION"},
+        "script": {"name_reply": "{name}・・・！", "fallback": "・・・。"},
+        "names": ["ちる", "れいちる", "チル", "Lufe"],
+        "stage3": [
+            {"keywords": ["暗号"], "priority": 1, "reply": "cipher"},
+            {"keywords": ["ヒント"], "priority": 5, "reply": "hint"},
+        ],
+    }
+    data.update(overrides)
+    return Scenario(data)
+
+
+# ---------------------
+# 正規化
+# ---------------------
+def test_normalize_text_folds_width_case_and_spaces():
+    assert normalize_text("ＯＢＳ　Ｅｒｖ   ation ") == "obs erv ation"
+
+
+def test_normalize_text_folds_katakana_only_when_asked():
+    assert normalize_text("ﾁﾙ チル", fold_kana=True) == "ちる ちる"
+    assert normalize_text("チル") == "チル"
+
+
+def test_normalize_question_ignores_trailing_punctuation():
+    assert normalize_question("Lain って誰？？") == normalize_question("lain って誰")
+
+
+def test_original_span_maps_back_through_normalization():
+    text = "  ﾚｲﾁﾙ  です"
+    normalized = normalize_text(text, fold_kana=True)
+    start = normalized.index("ちる")
+
+    assert original_span(text, start, start + 2) == "ﾁﾙ"
+    assert original_span("a   b", 0, 3) == "a   b"
+
+
+# ---------------------
+# キーワード照合
+# ---------------------
+def test_automaton_returns_the_highest_priority_payload_per_group():
+    automaton = KeywordAutomaton([
+        ("he", "g1", 1, "he"),
+        ("she", "g1", 2, "she"),
+        ("hers", "g2", 0, "hers"),
+    ])
+
+    assert automaton.match("USHERS") == {"g1": "she", "g2": "hers"}
+    assert automaton.match("nothing") == {}
+
+
+def test_automaton_reports_where_the_match_was():
+    automaton = KeywordAutomaton([("チル", "names", 0, "チル")])
+
+    assert automaton.match_spans("はい ちるです") == {"names": ("チル", 3, 5)}
+
+
+def test_stage3_keywords_pick_the_highest_priority_reply():
+    scenario = make_scenario()
+
+    assert scenario.match("暗号のヒントがほしい") == {"stage3": "hint"}
+    assert scenario.match("observation")["answer"] is True
+
+
+def test_name_match_echoes_what_the_user_wrote():
+    scenario = make_scenario()
+
+    # 「ちる」と「チル」は同じキーになるが、返すのは本文の表記
+    assert scenario.match("<@1> チルです")["names"] == "チル"
+    assert scenario.match("レイチル")["names"] == "チル"
+    assert scenario.match("ちる")["names"] == "ちる"
+    assert scenario.match("ＬＵＦＥ")["names"] == "ＬＵＦＥ"
+    assert "names" not in scenario.match("だれでしょう")
+
+
+def test_text_formats_only_when_arguments_are_given():
+    scenario = make_scenario()
+
+    assert scenario.text("name_reply", name="チル") == "チル・・・！"
+    assert scenario.text("fallback") == "・・・。"
+
+
+def test_bundled_scenario_loads():
+    scenario = load_scenario()
+
+    assert scenario.match(scenario.cipher["answer"].lower()).get("answer") is True
+
+
+# ---------------------
+# ホットリロード
+# ---------------------
+def test_store_reloads_when_the_file_changes(tmp_path):
+    path = tmp_path / "scenario.json"
+    data = {
+        "cipher": {"text": "A", "key": "B", "answer": "C"},
+        "script": {"fallback": "old"},
+        "names": [],
+        "stage3": [],
+    }
+    path.write_text(json.dumps(data), encoding="utf-8")
+    store = ScenarioStore(str(path), check_interval=0)
+    assert store.get().text("fallback") == "old"
+
+    data["script"]["fallback"] = "new"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    os.utime(path, (1, 1))
+    assert store.get().text("fallback") == "new"
+
+    path.write_text("{broken", encoding="utf-8")
+    os.utime(path, (2, 2))
+    assert store.get().text("fallback") == "new"     # 読めなければ前のものを使い続ける
@@ -0,0 +1,102 @@
+import asyncio
+
+from scheduler import TimerScheduler
+
+
+def recorder(fired: list):
+    async def callback(name):
+        fired.append(name)
+    return callback
+
+
+def test_timers_fire_in_order_of_their_deadline():
+    fired = []
+
+    async def scenario():
+        scheduler = TimerScheduler()
+        record = recorder(fired)
+        scheduler.call_later(0.06, record, "late")
+        scheduler.call_later(0.02, record, "early")
+        scheduler.call_later(0.04, record, "middle")
+        assert scheduler.pending() == 3
+        await asyncio.sleep(0.15)
+        assert scheduler.pending() == 0
+
+    asyncio.run(scenario())
+    assert fired == ["early", "middle", "late"]
+
+
+def test_cancelled_timer_does_not_fire():
+    fired = []
+
+    async def scenario():
+        scheduler = TimerScheduler()
+        record = recorder(fired)
+        handle = scheduler.call_later(0.02, record, "cancelled")
+        scheduler.call_later(0.03, record, "kept")
+        handle.cancel()
+        handle.cancel()     # 2回目は何もしない
+        assert scheduler.pending() == 1
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert fired == ["kept"]
+
+
+def test_cancel_generation_stops_pending_and_running_timers():
+    fired = []
+    interrupted = []
+
+    async def long_running(name):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            interrupted.append(name)
+            raise
+
+    async def scenario():
+        scheduler = TimerScheduler()
+        scheduler.call_later(0.0, long_running, "running", generation=1)
+        scheduler.call_later(0.5, recorder(fired), "pending", generation=1)
+        scheduler.call_later(0.05, recorder(fired), "other", generation=2)
+        await asyncio.sleep(0.02)
+        assert scheduler.cancel_generation(1) == 2
+        await asyncio.sleep(0.1)
+        assert scheduler.dump() == []
+
+    asyncio.run(scenario())
+    assert interrupted == ["running"]
+    assert fired == ["other"]
+
+
+def test_a_failing_callback_does_not_stop_later_timers(capsys):
+    fired = []
+
+    async def explode():
+        raise RuntimeError("boom")
+
+    async def scenario():
+        scheduler = TimerScheduler()
+        scheduler.call_later(0.0, explode)
+        scheduler.call_later(0.02, recorder(fired), "after")
+        await asyncio.sleep(0.08)
+
+    asyncio.run(scenario())
+    assert fired == ["after"]
+    assert "[タイマーエラー] explode: boom" in capsys.readouterr().out
+
+
+def test_heap_is_compacted_when_most_timers_are_cancelled():
+    async def scenario():
+        scheduler = TimerScheduler()
+        handles = [scheduler.call_later(60, recorder([]), str(i)) for i in range(10)]
+        for handle in handles[:6]:
+            handle.cancel()
+        assert scheduler.pending() == 4
+        assert len(scheduler._heap) < 10
+        for handle in handles[6:]:
+            handle.cancel()
+        assert scheduler.pending() == 0
+        scheduler._runner.cancel()
+
+    asyncio.run(scenario())
@@ -0,0 +1,120 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from search import ERROR_TEXT, NOT_FOUND_TEXT, SearchClient, extract_answer
+
+
+class StubSerpApi:
+    """SerpAPI の代わりのローカル HTTP サーバー。q ごとに決めた JSON を delay 秒後に返す"""
+
+    def __init__(self, delay: float = 0.0, status: int = 200):
+        self.delay = delay
+        self.status = status
+        self.requests = []
+        app = web.Application()
+        app.router.add_get("/search", self.handle)
+        self.server = TestServer(app)
+
+    async def handle(self, request):
+        self.requests.append(dict(request.query))
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.Response(status=self.status)
+        return web.json_response({"answer_box": {"answer": f"answer to {request.query['q']}"}})
+
+    async def __aenter__(self):
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.server.close()
+
+    def client(self) -> SearchClient:
+        return SearchClient("test-key", base_url=str(self.server.make_url("/search")))
+
+
+def run_with_stub(scenario, **stub_options):
+    async def runner():
+        async with StubSerpApi(**stub_options) as stub:
+            client = stub.client()
+            try:
+                await scenario(stub, client)
+            finally:
+                await client.close()
+    asyncio.run(runner())
+
+
+def test_extract_answer_prefers_the_answer_box():
+    assert extract_answer({"answer_box": {"answer": "a"}, "organic_results": [{"snippet": "s"}]}) == "a"
+    assert extract_answer({"organic_results": [{"snippet": "s"}]}) == "s"
+    assert extract_answer({"organic_results": []}) == NOT_FOUND_TEXT
+
+
+def test_search_sends_the_query_and_caches_by_normalized_key():
+    async def scenario(stub, client):
+        assert await client.search("Lain") == "answer to Lain"
+        assert await client.search("  ＬＡＩＮ ") == "answer to Lain"    # 同じキーとしてキャッシュから
+        assert await client.search("Lain", hl="en") == "answer to Lain"  # hl が違えば別のキー
+        assert stub.requests[0] == {"q": "Lain", "hl": "ja", "gl": "jp", "api_key": "test-key"}
+        assert client.upstream_calls == 2
+        assert client.stats()["hits"] == 1
+
+    run_with_stub(scenario)
+
+
+def test_concurrent_identical_queries_share_one_request():
+    async def scenario(stub, client):
+        results = await asyncio.gather(*(client.search("lain") for _ in range(5)))
+        assert results == ["answer to lain"] * 5
+        assert len(stub.requests) == 1
+        assert client.coalesced == 4
+        assert client.stats()["inflight"] == 0
+
+    run_with_stub(scenario, delay=0.1)
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_request():
+    async def scenario(stub, client):
+        first = asyncio.ensure_future(client.search("lain"))
+        second = asyncio.ensure_future(client.search("lain"))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        assert await second == "answer to lain"
+        assert first.cancelled()
+        assert len(stub.requests) == 1
+
+    run_with_stub(scenario, delay=0.1)
+
+
+def test_request_finishes_and_is_cached_even_if_every_caller_gives_up():
+    async def scenario(stub, client):
+        waiter = asyncio.ensure_future(client.search("lain"))
+        await asyncio.sleep(0.02)
+        waiter.cancel()
+        await asyncio.sleep(0.15)
+        assert await client.search("lain") == "answer to lain"
+        assert len(stub.requests) == 1
+
+    run_with_stub(scenario, delay=0.1)
+
+
+def test_upstream_errors_are_not_cached():
+    async def scenario(stub, client):
+        assert await client.search("lain") == ERROR_TEXT
+        assert await client.search("lain") == ERROR_TEXT
+        assert len(stub.requests) == 2
+
+    run_with_stub(scenario, status=500)
+
+
+def test_close_releases_the_http_session():
+    async def scenario(stub, client):
+        await client.search("lain")
+        session = client._session
+        await client.close()
+        assert session.closed
+        assert await client.search("other") == "answer to other"    # 閉じた後は作り直す
+
+    run_with_stub(scenario)
@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+
+import ratelimit
+from streaming import STREAM_CURSOR, ProgressiveEditor
+
+
+class FakeMessage:
+    def __init__(self):
+        self.channel = SimpleNamespace(id=1)
+        self.contents = []
+
+    async def edit(self, content=None):
+        self.contents.append(content)
+
+
+def make_editor(message, **kwargs) -> ProgressiveEditor:
+    buckets = ratelimit.RouteBuckets({"edit_message": (1000.0, 1000)})
+    return ProgressiveEditor(message, min_interval=0.0, min_chars=5, buckets=buckets, **kwargs)
+
+
+def test_small_updates_wait_until_min_chars_have_arrived():
+    message = FakeMessage()
+
+    async def scenario():
+        editor = make_editor(message)
+        editor.update("abc")
+        await asyncio.sleep(0.01)
+        assert message.contents == []
+        editor.update("abcdef")
+        await asyncio.sleep(0.01)
+        await editor.finish("abcdefgh")
+
+    asyncio.run(scenario())
+    assert message.contents == ["abcdef" + STREAM_CURSOR, "abcdefgh"]
+
+
+def test_edits_resume_when_the_stream_restarts_with_a_shorter_text():
+    # ディスパッチャが途中で別のバックエンドに切り替えると、全文が短いところからやり直しになる
+    message = FakeMessage()
+
+    async def scenario():
+        editor = make_editor(message)
+        editor.update("the first backend wrote this much")
+        await asyncio.sleep(0.01)
+        editor.update("second")
+        await asyncio.sleep(0.01)
+        await editor.finish("second answer")
+
+    asyncio.run(scenario())
+    assert message.contents == [
+        "the first backend wrote this much" + STREAM_CURSOR,
+        "second" + STREAM_CURSOR,
+        "second answer",
+    ]
+
+
+def test_finish_renders_the_prefix_and_truncates_long_text():
+    message = FakeMessage()
+
+    async def scenario():
+        await make_editor(message, prefix="> ").finish("x" * 3000)
+
+    asyncio.run(scenario())
+    assert len(message.contents[-1]) == 2000
+    assert message.contents[-1].startswith("> x") and message.contents[-1].endswith("…")
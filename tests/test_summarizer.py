@@ -0,0 +1,117 @@
+import asyncio
+
+from summarizer import MapReduceSummarizer, chunk_lines
+from textutil import estimate_tokens
+
+
+def lines_of(count: int, tokens: int = 10) -> list:
+    # ASCII は4文字で1トークン
+    return [f"{i:04d}" + "x" * (tokens * 4 - 4) for i in range(count)]
+
+
+class StubLLM:
+    """プロンプトの種類ごとに呼ばれた回数を数え、短い要約を返す"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.prompts = []
+        self.running = 0
+        self.max_running = 0
+
+    async def complete(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(self.delay)
+        self.running -= 1
+        kind = prompt.split(":", 1)[0]
+        return f"{kind}-summary-{len(self.prompts)}"
+
+    def count(self, kind: str) -> int:
+        return sum(1 for p in self.prompts if p.startswith(kind + ":"))
+
+
+def make_summarizer(llm: StubLLM, chunk_tokens: int = 50, workers: int = 3) -> MapReduceSummarizer:
+    return MapReduceSummarizer(
+        llm.complete, "MAP:{text}", "REDUCE:{text}", "FINAL:{text}",
+        chunk_tokens=chunk_tokens, workers=workers,
+    )
+
+
+# ---------------------
+# チャンク分け
+# ---------------------
+def test_chunks_stay_under_the_budget_without_splitting_lines():
+    lines = lines_of(12)
+    chunks = chunk_lines(lines, 50)
+
+    assert [len(c) for c in chunks] == [5, 5, 2]
+    assert [line for chunk in chunks for line in chunk] == lines
+    assert all(sum(estimate_tokens(line) for line in chunk) <= 50 for chunk in chunks)
+
+
+def test_appending_lines_only_changes_the_last_chunk():
+    before = chunk_lines(lines_of(12), 50)
+    after = chunk_lines(lines_of(14), 50)
+
+    assert after[:-1] == before[:-1]
+
+
+def test_an_overlong_line_is_truncated():
+    chunks = chunk_lines(["y" * 1000, "short"], 50)
+
+    assert estimate_tokens(chunks[0][0]) <= 50
+    assert chunks[-1][-1] == "short"
+
+
+# ---------------------
+# map-reduce
+# ---------------------
+def test_a_single_chunk_goes_straight_to_the_final_prompt():
+    llm = StubLLM()
+    summary, stats = asyncio.run(make_summarizer(llm).summarize(lines_of(3)))
+
+    assert llm.count("FINAL") == 1 and len(llm.prompts) == 1
+    assert summary.startswith("FINAL-summary")
+    assert stats.chunks == 1
+
+
+def test_chunks_are_mapped_then_reduced_once():
+    llm = StubLLM()
+    summary, stats = asyncio.run(make_summarizer(llm).summarize(lines_of(12)))
+
+    assert llm.count("MAP") == 3
+    assert llm.count("FINAL") == 1
+    assert stats.chunks == 3
+    assert stats.reduce_rounds == 1
+    assert summary.startswith("FINAL-summary")
+
+
+def test_rerun_only_summarizes_the_changed_chunk():
+    llm = StubLLM()
+    summarizer = make_summarizer(llm)
+    asyncio.run(summarizer.summarize(lines_of(12)))
+    llm.prompts.clear()
+
+    _, stats = asyncio.run(summarizer.summarize(lines_of(14)))
+
+    assert llm.count("MAP") == 1        # 増えた最後のチャンクだけ
+    assert stats.cached_chunks == 2
+
+
+def test_map_calls_are_limited_to_the_worker_count():
+    llm = StubLLM(delay=0.02)
+    asyncio.run(make_summarizer(llm, workers=2).summarize(lines_of(40)))
+
+    assert llm.max_running == 2
+
+
+def test_many_partials_are_reduced_in_several_rounds():
+    llm = StubLLM()
+    # 1チャンク = 2行。8つの部分要約（各4トークンほど）は20トークンの枠に1回では収まらない
+    _, stats = asyncio.run(make_summarizer(llm, chunk_tokens=20).summarize(lines_of(16)))
+
+    assert llm.count("MAP") == 8
+    assert llm.count("REDUCE") > 0
+    assert llm.count("FINAL") == 1
+    assert stats.reduce_rounds >= 2
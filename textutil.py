@@ -0,0 +1,59 @@
+import unicodedata
+from bisect import bisect_left, bisect_right
+
+# ---------------------
+# テキスト関係の小物
+# ---------------------
+
+_TRAILING_PUNCTUATION = "?？!！。．.、,，・…〜~ 　"
+
+_KATAKANA_START = ord("ァ")
+_KATAKANA_END = ord("ヶ")
+_KANA_OFFSET = ord("ァ") - ord("ぁ")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数のざっくり見積もり。
+    日本語などの非ASCII文字は1文字≒1トークン、ASCIIは4文字≒1トークンとして数える。
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ch < "\x80")
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def normalize_text(text: str, fold_kana: bool = False) -> str:
+    """
+    NFKC → 小文字化 → 空白を1つにまとめる。全角/半角・大文字小文字・空白の揺れをならす。
+    fold_kana なら、さらにカタカナをひらがなにする（シナリオのキーワード照合用）。
+    """
+    text = " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+    if not fold_kana:
+        return text
+    return "".join(
+        chr(ord(ch) - _KANA_OFFSET) if _KATAKANA_START <= ord(ch) <= _KATAKANA_END else ch
+        for ch in text
+    )
+
+
+def original_span(text: str, start: int, end: int) -> str:
+    """
+    normalize_text(text) の [start, end) に当たる、元の text の部分文字列。
+    正規化した先頭部分の長さは元の長さに対して単調なので、境目を二分探索で探す
+    （カナの折り返しは長さを変えないので fold_kana の有無は関係ない）
+    """
+    def normalized_length(i: int) -> int:
+        return len(normalize_text(text[:i]))
+    positions = range(len(text) + 1)
+    begin = bisect_right(positions, start, key=normalized_length) - 1
+    finish = bisect_left(positions, end, key=normalized_length)
+    return text[max(begin, 0):finish]
+
+
+def normalize_question(text: str) -> str:
+    """
+    同じ質問の言い回しの揺れをならす（返信キャッシュのキー用）。
+    normalize_text に加えて、末尾の「？」「。」「・・・」などを無視する。
+    """
+    return normalize_text(text).rstrip(_TRAILING_PUNCTUATION)
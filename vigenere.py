@@ -0,0 +1,256 @@
+import argparse
+import json
+import re
+import sys
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from scenario import SCENARIO_PATH
+
+# ---------------------
+# ヴィジュネル暗号（NumPy でまとめて処理する版）と、シナリオの暗号の検査
+# ---------------------
+# 文字列を UCS-4 のコード配列（行 = 文字列）にして、鍵の位置・シフト量を行列で計算する。
+# 1つの暗号文に何千個の鍵候補を当てるのも、行列1つ分の演算で済む。
+# 規則は main.py にあったものと同じ：大文字にしてから A-Z だけをずらし、
+# それ以外の文字はそのまま残して鍵の位置も進めない。鍵の A-Z 以外の文字は無視し、
+# 鍵が空なら入力をそのまま返す（main.py 版は str.isalpha() で判定していたので、
+# かなや漢字も「文字」として壊していたが、ここでは A-Z 以外は素通しにしている）。
+#
+#   python vigenere.py                      # scenario.json の暗号を検査
+#   python vigenere.py --keys words.txt     # 辞書の単語も鍵候補に加える
+
+ALPHABET_SIZE = 26
+_A = ord("A")
+
+# 英文の文字頻度（答えが分からないときの採点用）
+ENGLISH_FREQUENCIES = np.array([
+    8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966, 0.153, 0.772, 4.025, 2.406,
+    6.749, 7.507, 1.929, 0.095, 5.987, 6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074,
+]) / 100
+
+
+def _codes(strings: list) -> np.ndarray:
+    """文字列のリスト -> (件数, 最長の長さ) のコード配列（短いものは 0 で埋まる）"""
+    array = np.asarray([s.upper() for s in strings], dtype=str)
+    width = max(array.dtype.itemsize // 4, 1)
+    return array.astype(f"<U{width}").view(np.uint32).reshape(len(strings), width).astype(np.int32)
+
+
+def _strings(codes: np.ndarray) -> list:
+    width = max(codes.shape[1], 1)
+    return np.ascontiguousarray(codes, dtype=np.uint32).view(f"<U{width}").reshape(-1).tolist()
+
+
+def _is_letter(codes: np.ndarray) -> np.ndarray:
+    return (codes >= _A) & (codes < _A + ALPHABET_SIZE)
+
+
+def _key_shifts(keys: list):
+    """鍵のリスト -> (シフト量の配列, 各鍵の長さ)。A-Z 以外は取り除いて左に詰める"""
+    codes = _codes(keys)
+    letters = _is_letter(codes)
+    lengths = letters.sum(axis=1)
+    # A-Z を左に詰める（安定ソートで、文字の順番は変えない）
+    order = np.argsort(~letters, axis=1, kind="stable")
+    shifts = np.take_along_axis(codes, order, axis=1) - _A
+    shifts[np.arange(shifts.shape[1]) >= lengths[:, None]] = 0
+    return shifts, lengths
+
+
+def _as_list(value) -> list:
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _transform(texts, keys, sign: int):
+    single = isinstance(texts, str) and isinstance(keys, str)
+    # 文字列の側はもう片方の件数に合わせる（もう片方が空のリストなら結果も空）
+    if isinstance(texts, str):
+        rows = len(_as_list(keys))
+    elif isinstance(keys, str):
+        rows = len(_as_list(texts))
+    else:
+        rows = max(len(texts), len(keys))
+    texts = _as_list(texts)
+    keys = _as_list(keys)
+    if rows == 0:
+        return []
+    if len(texts) not in (1, rows) or len(keys) not in (1, rows):
+        raise ValueError(f"texts と keys の件数が合わない: {len(texts)} / {len(keys)}")
+
+    codes = _codes(texts)
+    letters = _is_letter(codes)
+    # 何文字目の A-Z か（鍵のどの位置を使うか）
+    position = np.maximum(np.cumsum(letters, axis=1) - 1, 0)
+    shifts, lengths = _key_shifts(keys)
+
+    width = codes.shape[1]
+    codes = np.broadcast_to(codes, (rows, width))
+    letters = np.broadcast_to(letters, (rows, width))
+    index = np.broadcast_to(position, (rows, width)) % np.maximum(lengths, 1)[:, None]
+    shift = np.take_along_axis(np.broadcast_to(shifts, (rows, shifts.shape[1])), index, axis=1)
+    shifted = np.where(letters, (codes - _A + sign * shift) % ALPHABET_SIZE + _A, codes)
+    result = _strings(shifted)
+
+    # 鍵が空なら（大文字にもせず）そのまま返す
+    lengths = np.broadcast_to(lengths, (rows,))
+    if not lengths.all():
+        for i in np.flatnonzero(lengths == 0):
+            result[i] = texts[i if len(texts) == rows else 0]
+    return result[0] if single else result
+
+
+def encrypt(texts, keys):
+    """
+    texts・keys は文字列か文字列のリスト。片方が1件ならもう片方の全件に使う。
+    両方とも文字列なら文字列を、それ以外はリストを返す。
+    """
+    return _transform(texts, keys, 1)
+
+
+def decrypt(texts, keys):
+    return _transform(texts, keys, -1)
+
+
+def vigenere_encrypt(plaintext: str, key: str) -> str:
+    return encrypt(plaintext, key)
+
+
+def vigenere_decrypt(ciphertext: str, key: str) -> str:
+    return decrypt(ciphertext, key)
+
+
+# ---------------------
+# 鍵候補の一括試行
+# ---------------------
+@dataclass
+class Candidate:
+    key: str
+    plaintext: str
+    score: float    # 大きいほど良い（答えが分かっていれば一致した文字の割合、無ければ英文らしさ）
+
+
+def match_scores(plaintexts: list, expected: str) -> np.ndarray:
+    """各文字列について、expected と A-Z が一致している割合（0〜1）"""
+    codes = _codes(plaintexts)
+    target = _codes([expected])
+    width = max(codes.shape[1], target.shape[1])
+    codes = np.pad(codes, ((0, 0), (0, width - codes.shape[1])))
+    target = np.pad(target, ((0, 0), (0, width - target.shape[1])))
+    letters = _is_letter(target)
+    total = max(int(letters.sum()), 1)
+    return ((codes == target) & letters).sum(axis=1) / total
+
+
+def english_scores(plaintexts: list) -> np.ndarray:
+    """英文の文字頻度とのカイ二乗を符号反転したもの（英文らしいほど大きい）"""
+    codes = _codes(plaintexts)
+    letters = _is_letter(codes)
+    rows = np.broadcast_to(np.arange(len(plaintexts))[:, None], codes.shape)
+    counts = np.bincount(
+        (rows * ALPHABET_SIZE + codes - _A)[letters], minlength=len(plaintexts) * ALPHABET_SIZE
+    ).reshape(len(plaintexts), ALPHABET_SIZE)
+    expected = counts.sum(axis=1, keepdims=True) * ENGLISH_FREQUENCIES
+    chi2 = ((counts - expected) ** 2 / np.maximum(expected, 1e-9)).sum(axis=1)
+    return -chi2
+
+
+def solve(ciphertext: str, candidates: list, expected: str = None, top: int = 10) -> list:
+    """候補の鍵をすべて試し、score の高い順に top 件の Candidate を返す"""
+    keys = list(dict.fromkeys(k for k in candidates if k))
+    if not keys:
+        return []
+    plaintexts = decrypt(ciphertext, keys)
+    scores = match_scores(plaintexts, expected) if expected else english_scores(plaintexts)
+    order = np.argsort(-scores, kind="stable")[:top]
+    return [Candidate(keys[i], plaintexts[i], float(scores[i])) for i in order]
+
+
+def digits_to_key(digits: str) -> str:
+    """数字列を鍵にする（0=A, 1=B, ... 9=J）"""
+    return "".join(chr(_A + int(d)) for d in digits if d.isdigit())
+
+
+def scenario_key_candidates(scenario: dict) -> list:
+    """
+    シナリオの中から鍵になりそうなものを集める：
+    名前のうちローマ字のもの、台詞やトリガー語に出てくる長い数字列（数字 -> A-J）
+    """
+    candidates = [name for name in scenario.get("names", []) if re.fullmatch(r"[A-Za-z]+", name)]
+    texts = list(scenario.get("script", {}).values())
+    for trigger in scenario.get("stage3", []):
+        texts.extend(trigger.get("keywords", []))
+        texts.append(trigger.get("reply", ""))
+    for text in texts:
+        for digits in re.findall(r"\d{4,}", text):
+            candidates.append(digits_to_key(digits))
+    return list(dict.fromkeys(candidates))
+
+
+# ---------------------
+# シナリオの検査（デプロイ前に実行）
+# ---------------------
+def check_scenario(scenario: dict, extra_keys: list = (), top: int = 5) -> tuple:
+    """(エラーのリスト, 注意のリスト, 上位の候補, 試した候補数, かかった秒数)"""
+    errors = []
+    warnings = []
+    cipher = scenario["cipher"]
+    text, key, answer = cipher["text"], cipher["key"], cipher["answer"]
+
+    if not re.sub(r"[^A-Za-z]", "", key):
+        errors.append("鍵に A-Z が1文字も無い")
+    decrypted = decrypt(text, key)
+    if decrypted != answer.upper():
+        errors.append(f"暗号文を鍵で復号すると {decrypted} になり、答え {answer} と合わない")
+    encrypted = encrypt(answer, key)
+    if encrypted != text.upper():
+        errors.append(f"答えを鍵で暗号化すると {encrypted} になり、暗号文 {text} と合わない")
+    monitor = scenario.get("script", {}).get("monitor", "")
+    if monitor and text not in monitor:
+        warnings.append("monitor の台詞に暗号文が入っていない")
+
+    candidates = scenario_key_candidates(scenario) + list(extra_keys)
+    started = time.perf_counter()
+    best = solve(text, candidates, expected=answer, top=top)
+    elapsed = time.perf_counter() - started
+    if not any(c.score == 1.0 for c in best):
+        near = f"（一番近いのは {best[0].key} -> {best[0].plaintext}）" if best else ""
+        warnings.append(f"シナリオの名前・数字から答えに届く鍵が見つからない{near}")
+    return errors, warnings, best, len(set(candidates)), elapsed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="check the scenario's Vigenère cipher before deploy")
+    parser.add_argument("--scenario", default=SCENARIO_PATH)
+    parser.add_argument("--keys", help="extra candidate keys, one per line")
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--strict", action="store_true", help="treat warnings as failures")
+    args = parser.parse_args(argv)
+
+    with open(args.scenario, encoding="utf-8") as f:
+        scenario = json.load(f)
+    extra_keys = []
+    if args.keys:
+        with open(args.keys, encoding="utf-8") as f:
+            extra_keys = [line.strip() for line in f if line.strip()]
+
+    errors, warnings, best, tried, elapsed = check_scenario(scenario, extra_keys, top=args.top)
+    cipher = scenario["cipher"]
+    print(f"[暗号] text={cipher['text']} key={cipher['key']} answer={cipher['answer']}")
+    for message in errors:
+        print(f"[NG] {message}")
+    for message in warnings:
+        print(f"[注意] {message}")
+    print(f"[鍵候補] {tried}件を {elapsed * 1000:.1f}ms で試行")
+    for candidate in best:
+        print(f"  {candidate.score:6.1%}  {candidate.key:<24} -> {candidate.plaintext}")
+    if errors or (args.strict and warnings):
+        return 1
+    print("[OK]")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())